@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Python Toolbox - file hashing benchmark
+Eski 4 KB'lık okuma döngüsünü, hashlib.file_digest yolunu ve farklı tampon boyutlarıyla readinto
+motorunu dosya boyutuna göre karşılaştırır; ayrıca md5+sha256+sha512'nin üç ayrı geçişte mi yoksa
+tek geçişte mi hesaplandığını ölçer. Dosyalar ilk okumadan sonra sayfa önbelleğindedir, yani
+sonuçlar disk değil CPU/sistem çağrısı maliyetini gösterir.
+
+Usage: python scripts/benchmark_hash.py [sizes_mb...]
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from tools.system_tools import SystemTools
+
+BUFFER_SIZES = (256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 8 * 1024 * 1024)
+ALGORITHMS = ("md5", "sha256", "sha512")
+
+
+def legacy_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def timed(func, repeat):
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    sizes = [int(value) for value in sys.argv[1:]] or [1, 64, 512]
+    tools = SystemTools()
+
+    print(f"{'size':>7} {'method':<24} {'MB/s':>8} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in sizes:
+            path = os.path.join(tmp, f"{size_mb}mb.bin")
+            with open(path, "wb") as f:
+                for _ in range(size_mb):
+                    f.write(os.urandom(1024 * 1024))
+            repeat = max(1, 256 // size_mb)
+
+            cases = [("sha256 4 KB reads", lambda: legacy_sha256(path))]
+            if hasattr(hashlib, "file_digest"):
+                cases.append(("sha256 file_digest", lambda: tools.hash_file(path, "sha256")))
+            for buffer_size in BUFFER_SIZES:
+                cases.append((f"sha256 readinto {buffer_size // 1024} KB",
+                              lambda buffer_size=buffer_size: tools.hash_file(path, "sha256", buffer_size)))
+            multi = [("3 algorithms, 3 passes",
+                      lambda: [tools.hash_file(path, name, 4 * 1024 * 1024) for name in ALGORITHMS]),
+                     ("3 algorithms, 1 pass", lambda: tools.hash_file(path, ALGORITHMS, 4 * 1024 * 1024))]
+
+            for group in (cases, multi):
+                baseline = None
+                for name, func in group:
+                    seconds = timed(func, repeat)
+                    baseline = baseline or seconds
+                    print(f"{size_mb:>5}MB {name:<24} {size_mb / seconds:>8.0f} {baseline / seconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
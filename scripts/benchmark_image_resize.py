@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Python Toolbox - resize_image benchmark
+Her format ve yeniden örnekleme preset'i için süreyi ölçer ve hızlanmayı önceki resize_image
+uygulamasına (thumbnail + LANCZOS; JPEG'de draft ve reducing_gap=2.0 zaten vardı) göre yazdırır.
+
+Usage: python scripts/benchmark_image_resize.py [width height target repeat]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from tools.image_tools import ImageTools, RESAMPLING_PRESETS
+
+FORMATS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+
+def make_sample(path, width, height):
+    # Smooth gradients plus mild noise compress like a real photo, unlike pure noise.
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    rgb = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    rgb += np.random.default_rng(0).normal(0, 8, rgb.shape)
+    Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8)).save(path, quality=90)
+
+
+def legacy_resize(input_path, output_path, size):
+    # resize_image before presets: thumbnail() with its default draft + reducing_gap=2.0.
+    with Image.open(input_path) as img:
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+        img.save(output_path)
+
+
+def best_of(repeat, func, *args, **kwargs):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    width, height, target, repeat = 6000, 4000, 800, 3
+    if len(sys.argv) > 4:
+        width, height, target, repeat = (int(value) for value in sys.argv[1:5])
+
+    tools = ImageTools()
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Source {width}x{height} -> {target}px, best of {repeat}")
+        print(f"{'format':<6} {'preset':<10} {'seconds':>9} {'speedup':>8}")
+        for image_format, extension in FORMATS.items():
+            source = os.path.join(tmp, "source" + extension)
+            output = os.path.join(tmp, "output" + extension)
+            make_sample(source, width, height)
+
+            timings = {"previous": best_of(repeat, legacy_resize, source, output, (target, target))}
+            for preset in RESAMPLING_PRESETS:
+                timings[preset] = best_of(repeat, tools.resize_image, source, output, (target, target), preset=preset)
+
+            for preset, seconds in timings.items():
+                print(f"{image_format:<6} {preset:<10} {seconds:>9.3f} {timings['previous'] / seconds:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Python Toolbox - generate_qr benchmark
+qrcode'un PIL çizim yolu ile NumPy render yolunu (PNG ve SVG) karşılaştırır: önce yalnızca render
+(matris bir kez kodlanır), sonra kodlama dahil uçtan uca generate_qr, en son aynı içeriğin tekrarı
+(matris ve PNG önbelleği).
+
+Usage: python scripts/benchmark_qr.py [count box_size]
+"""
+
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import qrcode
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from tools.qr_tools import QRTools, _render_qr_png, _render_qr_svg
+
+CASES = (("pil", ".png"), ("numpy", ".png"), ("numpy", ".svg"))
+
+
+def render(qr, renderer, extension, box_size):
+    if renderer == "pil":
+        qr.box_size = box_size
+        qr.make_image().save(io.BytesIO(), "PNG")
+    elif extension == ".svg":
+        _render_qr_svg(qr.modules, box_size, qr.border)
+    else:
+        _render_qr_png(qr.modules, box_size, qr.border)
+
+
+def main():
+    count, box_size = 500, 10
+    if len(sys.argv) > 2:
+        count, box_size = int(sys.argv[1]), int(sys.argv[2])
+
+    tools = QRTools()
+    payloads = [f"https://example.com/item/{i:08d}?ref=label" for i in range(count)]
+    qr = qrcode.QRCode(border=5)
+    qr.add_data(payloads[0])
+    qr.make(fit=True)
+
+    print(f"{count} codes, box_size={box_size}")
+    print(f"{'stage':<10} {'renderer':<8} {'format':<6} {'codes/s':>9} {'speedup':>8}")
+    baseline = None
+    for renderer, extension in CASES:
+        start = time.perf_counter()
+        for _ in range(count):
+            render(qr, renderer, extension, box_size)
+        rate = count / (time.perf_counter() - start)
+        baseline = baseline or rate
+        print(f"{'render':<10} {renderer:<8} {extension[1:]:<6} {rate:>9.0f} {rate / baseline:>7.1f}x")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = None
+        for renderer, extension in CASES:
+            output = os.path.join(tmp, "code" + extension)
+            tools.clear_cache()
+            start = time.perf_counter()
+            for payload in payloads:
+                tools.generate_qr(payload, output, box_size=box_size, renderer=renderer)
+            rate = count / (time.perf_counter() - start)
+            baseline = baseline or rate
+            print(f"{'end-to-end':<10} {renderer:<8} {extension[1:]:<6} {rate:>9.0f} {rate / baseline:>7.1f}x")
+
+        # Label runs: one payload over and over, served from the matrix/PNG caches.
+        for renderer, extension in CASES:
+            output = os.path.join(tmp, "code" + extension)
+            tools.clear_cache()
+            start = time.perf_counter()
+            for _ in range(count):
+                tools.generate_qr(payloads[0], output, box_size=box_size, renderer=renderer)
+            rate = count / (time.perf_counter() - start)
+            print(f"{'repeated':<10} {renderer:<8} {extension[1:]:<6} {rate:>9.0f} {rate / baseline:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
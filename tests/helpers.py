@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Python Toolbox - shared test helpers
+Testlerin ortak geçici dizin düzeni
+"""
+
+import os
+import tempfile
+import unittest
+
+
+class TempDirTestCase(unittest.TestCase):
+    """A fresh temporary directory per test, with helpers to build files in it"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def write(self, name, data):
+        # Bytes are written as is, text as UTF-8 with "\n" line endings.
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(data, bytes):
+            with open(path, 'wb') as f:
+                f.write(data)
+        else:
+            with open(path, 'w', encoding='utf-8', newline='\n') as f:
+                f.write(data)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
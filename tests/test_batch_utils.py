@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Python Toolbox - batch_utils tests
+Dizin tarama, görev üretimi, paralel çalıştırma ve artımlı manifest davranışı
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from helpers import TempDirTestCase
+from tools.batch_utils import BatchManifest, iter_batch, iter_files, iter_tasks, run_batch
+from tools.image_tools import ImageTools
+
+
+def copy_file(input_path, output_path):
+    with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
+        dst.write(src.read())
+    return output_path
+
+
+def fail_on_bad(input_path, output_path):
+    if input_path.endswith('bad.txt'):
+        raise ValueError("bad input")
+    return copy_file(input_path, output_path)
+
+
+class TestBatchUtils(TempDirTestCase):
+    """Walk, task and batch helpers shared by the tool classes"""
+
+    def setUp(self):
+        super().setUp()
+        self.input = self.path('in')
+        for name in ('a.txt', 'b.TXT', 'c.dat', 'sub/d.txt', 'sub/deep/e.txt', 'skip/f.txt'):
+            self.write(os.path.join('in', name), name)
+
+    def relative(self, entries):
+        return [os.path.relpath(entry.path, self.input).replace(os.sep, '/') for entry in entries]
+
+    def test_iter_files_filters(self):
+        """Extensions, recursion and include/exclude globs select the expected files in order"""
+        self.assertEqual(self.relative(iter_files(self.input, '.txt')), ['a.txt', 'b.TXT'])
+        self.assertEqual(self.relative(iter_files(self.input, '.txt', recursive=True)),
+                         ['a.txt', 'b.TXT', 'skip/f.txt', 'sub/d.txt', 'sub/deep/e.txt'])
+        self.assertEqual(self.relative(iter_files(self.input, recursive=True, exclude=['skip', '*.dat'])),
+                         ['a.txt', 'b.TXT', 'sub/d.txt', 'sub/deep/e.txt'])
+        self.assertEqual(self.relative(iter_files(self.input, recursive=True, include=['sub/*'])),
+                         ['sub/d.txt', 'sub/deep/e.txt'])
+
+    def test_missing_root_raises(self):
+        """A missing or non-directory root raises on the call; nothing is created"""
+        with self.assertRaises(FileNotFoundError):
+            iter_files(self.path('missing'))
+        with self.assertRaises(NotADirectoryError):
+            iter_files(os.path.join(self.input, 'a.txt'))
+        with self.assertRaises(FileNotFoundError):
+            iter_tasks(self.path('missing'), self.path('out'))
+        with self.assertRaises(FileNotFoundError):
+            ImageTools().batch_resize(self.path('missing'), self.path('out'), (10, 10))
+        self.assertFalse(os.path.exists(self.path('out')))
+
+    @unittest.skipIf(os.name == 'nt' or os.geteuid() == 0, "directory permissions are not enforced")
+    def test_unreadable_subdirectory_is_skipped(self):
+        """Errors below the root only drop that subdirectory"""
+        locked = os.path.join(self.input, 'sub')
+        os.chmod(locked, 0)
+        self.addCleanup(os.chmod, locked, 0o755)
+        self.assertEqual(self.relative(iter_files(self.input, '.txt', recursive=True)),
+                         ['a.txt', 'b.TXT', 'skip/f.txt'])
+
+    def test_iter_tasks_mirrors_tree(self):
+        """Output paths mirror the input tree with the new extension"""
+        output = self.path('out')
+        tasks = list(iter_tasks(self.input, output, ('x',), '.txt', 'md', recursive=True, exclude=['skip']))
+        self.assertEqual([os.path.relpath(task[1], output).replace(os.sep, '/') for task in tasks],
+                         ['a.md', 'b.md', 'sub/d.md', 'sub/deep/e.md'])
+        self.assertTrue(all(task[2] == ('x',) for task in tasks))
+        self.assertTrue(os.path.isdir(os.path.join(output, 'sub', 'deep')))
+
+    def test_iter_batch_keeps_order_and_errors(self):
+        """Results come back in task order and failures become error items"""
+        self.write('in/bad.txt', 'x')
+        tasks = list(iter_tasks(self.input, self.path('out'), (), '.txt'))
+        progress = []
+        items = list(iter_batch(fail_on_bad, tasks, max_workers=2, chunksize=1, use_processes=False,
+                                progress=lambda done, total, item: progress.append((done, total))))
+        self.assertEqual([item['input'] for item in items], [task[0] for task in tasks])
+        errors = {os.path.basename(item['input']): item['error'] for item in items if item['error']}
+        self.assertEqual(errors, {'bad.txt': 'ValueError: bad input'})
+        self.assertEqual(progress[-1], (len(tasks), len(tasks)))
+        self.assertEqual(len(run_batch(copy_file, iter(tasks[:2]), use_processes=False)), 2)
+
+    def test_manifest_skips_unchanged_inputs(self):
+        """A second run only rebuilds modified inputs and missing outputs"""
+        output = self.path('out')
+        manifest = BatchManifest(output, 'copy')
+
+        def run(**options):
+            tasks = iter_tasks(self.input, output, (), '.txt', recursive=True)
+            return manifest.run(copy_file, tasks, use_processes=False, **options)
+
+        self.assertTrue(all(not item.get('skipped') for item in run()))
+        self.write('in/a.txt', 'changed')
+        os.remove(os.path.join(output, 'sub', 'd.txt'))
+        plan = run(dry_run=True)
+        self.assertEqual(plan['unchanged'], 3)
+        self.assertEqual({(os.path.basename(item['input']), item['reason']) for item in plan['pending']},
+                         {('a.txt', 'modified'), ('d.txt', 'output missing')})
+        rebuilt = [os.path.basename(item['input']) for item in run() if not item.get('skipped')]
+        self.assertEqual(sorted(rebuilt), ['a.txt', 'd.txt'])
+
+    def test_dry_run_has_no_side_effects(self):
+        """A dry run creates no output tree or manifest and leaves stored stamps alone"""
+        output = self.path('out')
+        manifest = BatchManifest(output, 'copy')
+        tasks = list(iter_tasks(self.input, output, (), '.txt', recursive=True, create_dirs=False))
+        plan = manifest.run(copy_file, tasks, dry_run=True)
+        self.assertEqual((plan['total'], plan['unchanged'], len(plan['pending'])), (5, 0, 5))
+        self.assertFalse(os.path.exists(output))
+        self.assertFalse(os.path.exists(manifest.path))
+
+        image_input = self.path('images')
+        os.makedirs(image_input)
+        Image.new('RGB', (20, 20), 'red').save(os.path.join(image_input, 'red.png'))
+        plan = ImageTools().batch_resize(image_input, self.path('small'), (10, 10), dry_run=True)
+        self.assertEqual(len(plan['pending']), 1)
+        self.assertFalse(os.path.exists(self.path('small')))
+        self.assertFalse(os.path.exists(self.path('small.manifest.db')))
+
+        manifest.run(copy_file, iter_tasks(self.input, output, (), '.txt', recursive=True), use_processes=False)
+        a = os.path.join(self.input, 'a.txt')
+        os.utime(a, (1, 1))
+        with sqlite3.connect(manifest.path) as db:
+            stamps = db.execute("SELECT input, mtime FROM entries ORDER BY input").fetchall()
+        self.assertEqual(manifest.run(copy_file, tasks, dry_run=True)['unchanged'], 5)
+        with sqlite3.connect(manifest.path) as db:
+            self.assertEqual(db.execute("SELECT input, mtime FROM entries ORDER BY input").fetchall(), stamps)
+
+    def test_manifest_hashes_inputs_in_the_workers(self):
+        """Input digests are computed by the workers and stored with the result"""
+        threads = []
+
+        def digests(path):
+            threads.append(threading.current_thread())
+            with open(path, 'rb') as f:
+                return {'sha256': hashlib.sha256(f.read()).hexdigest()}
+
+        manifest = BatchManifest(self.path('out'), 'copy')
+        with mock.patch('tools.batch_utils.file_digests', side_effect=digests):
+            items = manifest.run(copy_file, iter_tasks(self.input, self.path('out'), (), '.txt'), use_processes=False)
+        self.assertEqual([item['result'] for item in items], [item['output'] for item in items])
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+        with sqlite3.connect(manifest.path) as db:
+            digest = db.execute("SELECT sha256 FROM entries WHERE input = ?",
+                                (os.path.join(self.input, 'a.txt'),)).fetchone()[0]
+        self.assertEqual(digest, hashlib.sha256(b'a.txt').hexdigest())
+
+    def test_watermark_manifest_follows_watermark_content(self):
+        """Replacing the watermark image in place makes every input pending again"""
+        images = self.path('images')
+        os.makedirs(images)
+        Image.new('RGB', (40, 40), 'white').save(os.path.join(images, 'photo.png'))
+        mark = self.path('mark.png')
+        Image.new('RGBA', (8, 8), (255, 0, 0, 255)).save(mark)
+        tools = ImageTools()
+
+        def watermark(**options):
+            return tools.batch_add_watermark(images, self.path('marked'), 'image', mark, max_workers=1, **options)
+
+        watermark(incremental=True)
+        self.assertEqual(watermark(dry_run=True)['unchanged'], 1)
+        Image.new('RGBA', (8, 8), (0, 0, 255, 255)).save(mark)
+        plan = watermark(dry_run=True)
+        self.assertEqual([item['reason'] for item in plan['pending']], ['parameters changed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Python Toolbox - image_tools tests
+Meta veri taraması, kalite araması ve çoklu boyut üretimi, filigran ve kopya tespiti için davranış testleri
+"""
+
+import os
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from PIL import Image, ImageCms, PngImagePlugin
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from helpers import TempDirTestCase
+from tools.batch_utils import run_batch
+from tools.image_tools import BKTree, ImageTools, _encode, _encoded_ssim, _hamming, _image_layer, _ssim_luma, \
+    _text_layer
+
+
+class TestImageTools(TempDirTestCase):
+    """ImageTools behaviour that is easy to regress silently"""
+
+    def setUp(self):
+        super().setUp()
+        self.tools = ImageTools()
+
+    def test_scan_metadata_reads_png_exif_without_decoding(self):
+        """PNG eXIf is read from the header; pixel data is never decoded"""
+        exif = Image.Exif()
+        exif[0x010F] = 'Canon'
+        Image.new('RGB', (64, 48), 'red').save(self.path('exif.png'), exif=exif.tobytes())
+        Image.new('RGB', (32, 32), 'blue').save(self.path('plain.png'))
+
+        with mock.patch.object(PngImagePlugin.PngImageFile, 'load', side_effect=AssertionError("decoded")):
+            records = {os.path.basename(record['path']): record for record in self.tools.scan_metadata(self.tmp.name)}
+
+        self.assertEqual(records['exif.png']['exif'], {'Make': 'Canon'})
+        self.assertEqual(records['exif.png']['width'], 64)
+        self.assertEqual(records['exif.png']['size_bytes'], os.path.getsize(self.path('exif.png')))
+        self.assertEqual(records['plain.png']['exif'], {})
+
+    def photo(self, size=(1200, 900)):
+        x = np.linspace(0, 255, size[0])[None, :, None]
+        y = np.linspace(0, 255, size[1])[:, None, None]
+        noise = np.random.default_rng(0).normal(0, 12, (size[1], size[0], 3))
+        return Image.fromarray((x * 0.6 + y * 0.4 + noise).clip(0, 255).astype(np.uint8))
+
+    def test_ssim_reference_and_candidates_share_the_downscale(self):
+        """Lossless output scores 1.0 and lossy scores grow with quality"""
+        img = self.photo()
+        reference = _ssim_luma(img)
+        self.assertEqual(max(reference.size), 512)
+        self.assertEqual(_encoded_ssim(reference, _encode(img, 'PNG')), 1.0)
+        low, high = (_encoded_ssim(reference, _encode(img, 'JPEG', quality)) for quality in (30, 95))
+        self.assertLess(low, high)
+        self.assertLess(high, 1.0)
+
+    def test_optimize_image_meets_min_ssim(self):
+        """The SSIM search returns a JPEG that reaches the requested score"""
+        source = self.path('photo.png')
+        self.photo().save(source)
+        output = self.tools.optimize_image(source, self.path('photo.jpg'), min_ssim=0.9)
+        with open(output, 'rb') as f:
+            data = f.read()
+        with Image.open(source) as img:
+            self.assertGreaterEqual(_encoded_ssim(_ssim_luma(img), data), 0.9)
+
+    def tagged_jpeg(self, name, orientation=6):
+        exif = Image.Exif()
+        exif[0x010F] = 'Canon'
+        exif[0x0112] = orientation
+        icc = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        self.photo((120, 80)).save(self.path(name), quality=95, exif=exif.tobytes(), icc_profile=icc)
+        return self.path(name), icc
+
+    def test_lossless_jpeg_transforms_only_reencode_on_request(self):
+        """Without jpegtran the transforms raise unless allowed to re-encode, and then crop the exact box"""
+        source, _ = self.tagged_jpeg('tagged.jpg')
+        with mock.patch('tools.image_tools._jpegtran', side_effect=RuntimeError("jpegtran is required")):
+            with self.assertRaises(RuntimeError):
+                self.tools.crop_jpeg_lossless(source, self.path('crop.jpg'), (20, 20, 120, 100))
+            with self.assertRaises(RuntimeError):
+                self.tools.normalize_jpeg_orientation(source, self.path('upright.jpg'))
+
+            self.tools.crop_jpeg_lossless(source, self.path('crop.jpg'), (20, 20, 120, 100), allow_reencode=True)
+            self.tools.normalize_jpeg_orientation(source, self.path('upright.jpg'), allow_reencode=True)
+
+        with Image.open(source) as img, Image.open(self.path('crop.jpg')) as crop:
+            self.assertEqual(crop.size, (100, 60))
+            expected = np.asarray(img.crop((20, 20, 120, 80)), np.int16)
+            self.assertLess(np.abs(np.asarray(crop, np.int16) - expected).mean(), 3)
+        with Image.open(self.path('upright.jpg')) as upright:
+            self.assertEqual(upright.size, (80, 120))
+            self.assertEqual(upright.getexif().get(0x0112, 1), 1)
+
+    def test_optimize_image_strips_metadata_on_every_path(self):
+        """strip_metadata drops EXIF but keeps ICC and orientation, lossless or re-encoded"""
+        source, icc = self.tagged_jpeg('tagged.jpg')
+        paths = {
+            'lossless': {'quality': None},
+            'reencode': {'quality': 70},
+            'adaptive': {'min_ssim': 0.5, 'formats': ['JPEG', 'WEBP']},
+        }
+        for name, options in paths.items():
+            for strip in (True, False):
+                with self.subTest(path=name, strip=strip):
+                    output = self.tools.optimize_image(source, self.path(f'{name}-{strip}.jpg'), strip_metadata=strip,
+                                                       **options)
+                    with Image.open(output) as img:
+                        exif = dict(img.getexif())
+                        self.assertEqual(img.info.get('icc_profile'), icc)
+                    self.assertEqual(exif, {0x0112: 6} if strip else {0x010F: 'Canon', 0x0112: 6})
+
+    def test_render_renditions_decodes_the_source_once(self):
+        """Every size and format comes from a single open of the source, and only the marked one is watermarked"""
+        source = self.path('photo.jpg')
+        self.photo().save(source, quality=95)
+        renditions = [
+            {'name': 'large', 'size': (600, 600)},
+            {'name': 'thumb', 'size': (150, 150), 'format': 'WEBP', 'quality': 80},
+            {'name': 'marked', 'size': (300, 300), 'format': 'PNG',
+             'watermark': {'text': 'ORNEK', 'position': (10, 10), 'opacity': 255}},
+        ]
+        with mock.patch('tools.image_tools.Image.open', wraps=Image.open) as opened:
+            outputs = self.tools.render_renditions(source, self.path('out'), renditions)
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual([os.path.basename(path) for path in outputs],
+                         ['photo_large.jpg', 'photo_thumb.webp', 'photo_marked.png'])
+
+        with Image.open(source) as img:
+            reference = img.convert('RGB').resize((300, 225), Image.Resampling.LANCZOS)
+        expected = {'photo_large.jpg': ('JPEG', (600, 450)), 'photo_thumb.webp': ('WEBP', (150, 112)),
+                    'photo_marked.png': ('PNG', (300, 225))}
+        for path in outputs:
+            with Image.open(path) as img:
+                self.assertEqual((img.format, img.size), expected[os.path.basename(path)])
+        with Image.open(outputs[2]) as img:
+            diff = np.abs(np.asarray(img.convert('RGB'), np.int16) - np.asarray(reference, np.int16))
+        # The draft-scaled decode stays close to a full decode; the text adds white pixels top left only.
+        self.assertLess(diff[120:, :].mean(), 3)
+        self.assertGreater(diff[:60, :150].max(), 100)
+
+    def test_batch_render_renditions_mirrors_the_tree(self):
+        """Batch renditions land in the mirrored directory of each source"""
+        os.makedirs(self.path('in/sub'))
+        self.photo((200, 100)).save(self.path('in/a.png'))
+        self.photo((100, 200)).save(self.path('in/sub/b.jpg'))
+        outputs = self.tools.batch_render_renditions(self.path('in'), self.path('out'),
+                                                     [{'name': 'small', 'size': (50, 50)}], max_workers=1,
+                                                     recursive=True)
+        self.assertEqual(sorted(os.path.relpath(path, self.path('out')) for path in outputs),
+                         ['a_small.png', os.path.join('sub', 'b_small.jpg')])
+        with Image.open(self.path('out/sub/b_small.jpg')) as img:
+            self.assertEqual(img.size, (25, 50))
+
+    def full_overlay(self, img, layer, position):
+        # What the layer cache replaced: a canvas-sized overlay composited over the whole image.
+        overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
+        overlay.paste(layer, position)
+        return Image.alpha_composite(img.convert('RGBA'), overlay)
+
+    def test_watermark_bounding_box_matches_full_overlay(self):
+        """Compositing only the layer's box gives the full-canvas result, including layers hanging off the edge"""
+        mark = np.zeros((60, 80, 4), np.uint8)
+        mark[..., 0], mark[..., 3] = 255, np.linspace(0, 255, 80, dtype=np.uint8)
+        Image.fromarray(mark).save(self.path('mark.png'))
+        layer = _image_layer(self.path('mark.png'), os.path.getmtime(self.path('mark.png')), 0.5)
+        base = self.photo((120, 90))
+        for mode in ('RGB', 'RGBA', 'L'):
+            for position in ((50, 50), (100, 80), (-10, -5)):
+                with self.subTest(mode=mode, position=position):
+                    img = base.convert(mode)
+                    expected = self.full_overlay(img, layer, position)
+                    result = self.tools._apply_image_watermark(img.copy(), self.path('mark.png'), position, 0.5)
+                    self.assertEqual(result.size, img.size)
+                    diff = np.abs(np.asarray(result.convert('RGBA'), np.int16) - np.asarray(expected, np.int16))
+                    self.assertLessEqual(diff[..., :3].max(), 1)
+
+    def test_watermark_layers_are_cached(self):
+        """The text sprite is rendered once for repeated files, and a changed watermark file is picked up"""
+        _text_layer.cache_clear()
+        os.makedirs(self.path('in'))
+        for i in range(3):
+            self.photo((120, 90)).save(self.path(f'in/{i}.png'))
+            self.tools.add_text_watermark(self.path(f'in/{i}.png'), self.path(f'{i}.png'), 'ORNEK', (5, 5), 200)
+        info = _text_layer.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, 2))
+
+        layer, offset = _text_layer('ORNEK', 36, 200)
+        with Image.open(self.path('in/0.png')) as img:
+            expected = self.full_overlay(img, layer, (5 + offset[0], 5 + offset[1])).convert('RGB')
+        with Image.open(self.path('0.png')) as img:
+            self.assertLessEqual(np.abs(np.asarray(img, np.int16) - np.asarray(expected, np.int16)).max(), 1)
+
+        Image.new('RGBA', (40, 40), (255, 0, 0, 255)).save(self.path('mark.png'))
+        first = _image_layer(self.path('mark.png'), os.path.getmtime(self.path('mark.png')), 0.5)
+        self.assertIs(_image_layer(self.path('mark.png'), os.path.getmtime(self.path('mark.png')), 0.5), first)
+        Image.new('RGBA', (80, 80), (0, 0, 255, 255)).save(self.path('mark.png'))
+        os.utime(self.path('mark.png'), (0, os.path.getmtime(self.path('mark.png')) + 1))
+        second = _image_layer(self.path('mark.png'), os.path.getmtime(self.path('mark.png')), 0.5)
+        self.assertEqual((first.size, second.size), ((12, 12), (24, 24)))
+
+    def test_bktree_search_matches_brute_force(self):
+        """The triangle-inequality pruning finds exactly what a linear scan finds"""
+        rng = np.random.default_rng(1)
+        values = [int(v) for v in rng.integers(0, 2 ** 16, 300)]
+        tree = BKTree()
+        for i, value in enumerate(values):
+            tree.add(value, i)
+        for query in values[:20]:
+            for distance in (0, 2, 5):
+                expected = {(_hamming(query, value), i) for i, value in enumerate(values)
+                            if _hamming(query, value) <= distance}
+                self.assertEqual(set(tree.search(query, distance)), expected)
+
+    def duplicate_set(self):
+        # Smooth colour blobs: structure the hashes can see at every scale.
+        blocks = np.random.default_rng(2).integers(0, 256, (6, 8, 3), dtype=np.uint8)
+        img = Image.fromarray(blocks).resize((400, 300), Image.Resampling.BICUBIC)
+        os.makedirs(self.path('in'))
+        img.save(self.path('in/a.png'))
+        img.resize((200, 150)).save(self.path('in/b.jpg'), quality=70)
+        img.save(self.path('in/c.webp'), quality=60)
+        img.transpose(Image.Transpose.FLIP_LEFT_RIGHT).save(self.path('in/flipped.png'))
+        return [self.path(f'in/{name}') for name in ('a.png', 'b.jpg', 'c.webp')]
+
+    def test_find_duplicates_groups_resized_and_reencoded_copies(self):
+        """Resized and re-encoded copies group together; a mirrored image does not join them"""
+        group = self.duplicate_set()
+        for algorithm in ('ahash', 'dhash', 'phash'):
+            with self.subTest(algorithm=algorithm):
+                self.assertEqual(self.tools.find_duplicates(self.path('in'), algorithm=algorithm, max_workers=1),
+                                 [group])
+
+    def test_compute_hashes_reuses_the_sqlite_cache(self):
+        """Unchanged files are read from the cache; a touched file is hashed again"""
+        paths = self.duplicate_set()
+        cache = self.path('hashes.db')
+        first = self.tools.compute_hashes(paths, cache_path=cache, max_workers=1)
+        os.utime(paths[1], (0, os.path.getmtime(paths[1]) + 10))
+        with mock.patch('tools.image_tools.run_batch', wraps=run_batch) as batch:
+            second = self.tools.compute_hashes(paths, cache_path=cache, max_workers=1)
+        self.assertEqual(second, first)
+        self.assertEqual([task[0] for task in batch.call_args[0][1]], [paths[1]])
+
+    def test_batch_optimize_skips_duplicates(self):
+        """skip_duplicates keeps the first file of each group and the unrelated image"""
+        self.duplicate_set()
+        outputs = self.tools.batch_optimize(self.path('in'), self.path('out'), max_workers=1, skip_duplicates=True)
+        self.assertEqual(sorted(os.path.basename(path) for path in outputs), ['a.png', 'flipped.png'])
+        self.assertEqual(sorted(os.listdir(self.path('out'))), ['a.png', 'flipped.png'])
+
+
+if __name__ == '__main__':
+    unittest.main()
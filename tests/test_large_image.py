@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Python Toolbox - large_image tests
+Bant bant (strip) okuma/yazma yolunun tam çözümlü yolla aynı pikselleri ürettiğini doğrular
+"""
+
+import sys
+import unittest
+import warnings
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from helpers import TempDirTestCase
+from tools.large_image import strip_source, tiled_convert, tiled_resize
+
+# Small enough to force many 16-row bands on the test images.
+TINY_BUDGET = 1
+
+try:
+    import pyvips  # noqa: F401
+    HAS_PYVIPS = True
+except ImportError:
+    HAS_PYVIPS = False
+
+
+def sample_image(mode, size=(64, 70)):
+    rng = np.random.default_rng(len(mode))
+    channels = len(mode)
+    pixels = rng.integers(0, 256, (size[1], size[0], channels), dtype=np.uint8)
+    if channels == 1:
+        pixels = pixels[:, :, 0]
+    return Image.fromarray(pixels, mode)
+
+
+class TestLargeImage(TempDirTestCase):
+    """Streaming convert/resize against the in-memory result"""
+
+    def assertSamePixels(self, first, second):
+        self.assertEqual(first.size, second.size)
+        self.assertEqual(first.mode, second.mode)
+        self.assertTrue(np.array_equal(np.asarray(first), np.asarray(second)))
+
+    def test_tiff_round_trip_per_mode(self):
+        """Every streamed mode is written as a readable multi- and single-strip TIFF"""
+        for mode in ('L', 'LA', 'RGB', 'RGBA'):
+            for budget in (TINY_BUDGET, 1024 ** 3):
+                with self.subTest(mode=mode, budget=budget):
+                    source = self.path(f'{mode}.tif')
+                    output = self.path(f'{mode}-{budget}-out.tif')
+                    sample_image(mode).save(source, compression=None)
+                    tiled_convert(source, output, memory_budget=budget)
+                    with Image.open(source) as expected, Image.open(output) as result:
+                        self.assertSamePixels(result, expected)
+
+    def test_png_round_trip_per_mode(self):
+        """PNG output decodes back to the source pixels"""
+        for mode in ('L', 'LA', 'RGB', 'RGBA'):
+            with self.subTest(mode=mode):
+                source = self.path(f'{mode}.tif')
+                output = self.path(f'{mode}-out.png')
+                sample_image(mode).save(source, compression=None)
+                tiled_convert(source, output, memory_budget=TINY_BUDGET)
+                with Image.open(source) as expected, Image.open(output) as result:
+                    self.assertSamePixels(result, expected)
+
+    def test_palette_sources_keep_their_colours(self):
+        """P-mode raw TIFF/BMP bands carry the source palette and transparency"""
+        paletted = sample_image('RGB').quantize(64)
+        for name, params in (('p.tif', {'compression': None}), ('p.bmp', {}), ('pt.tif', {'transparency': 3})):
+            with self.subTest(source=name):
+                source = self.path(name)
+                output = self.path(name + '.png')
+                paletted.save(source, **params)
+                tiled_convert(source, output, memory_budget=TINY_BUDGET)
+                with Image.open(source) as img:
+                    expected = img.convert('RGBA')
+                with Image.open(output) as result:
+                    self.assertSamePixels(result, expected)
+
+    def assertStreams(self, path, reader):
+        # Forward, overlapping, skipping and backward reads all match the full decode.
+        with Image.open(path) as img:
+            img.load()
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                source = strip_source(path)
+            try:
+                self.assertEqual(type(source).__name__, reader)
+                for y0, y1 in ((0, 17), (10, 50), (50, 51), (48, 70), (5, 9)):
+                    band = source.read(y0, y1)
+                    expected = img.crop((0, y0, img.width, y1))
+                    self.assertEqual(band.mode, expected.mode)
+                    self.assertTrue(np.array_equal(np.asarray(band.convert('RGBA')),
+                                                   np.asarray(expected.convert('RGBA'))))
+            finally:
+                source.close()
+
+    @unittest.skipIf(HAS_PYVIPS, "pyvips takes precedence over the built-in readers")
+    def test_compressed_png_streams(self):
+        """Compressed PNG is read band by band without pyvips"""
+        images = {mode: sample_image(mode) for mode in ('L', 'LA', 'RGB', 'RGBA')}
+        images['P'] = sample_image('RGB').quantize(200)
+        images['P4'] = sample_image('RGB').quantize(16)
+        images['1'] = sample_image('L').convert('1')
+        images['I;16'] = Image.fromarray((np.arange(64 * 70).reshape(70, 64) * 7).astype(np.uint16))
+        for name, img in images.items():
+            with self.subTest(mode=name):
+                path = self.path(f'{name}.png')
+                img.save(path, **({'bits': 4} if name == 'P4' else {}))
+                self.assertStreams(path, '_PNGStrips')
+
+    @unittest.skipIf(HAS_PYVIPS, "pyvips takes precedence over the built-in readers")
+    def test_deflate_tiff_streams(self):
+        """Deflate TIFF strips are inflated band by band, with and without the predictor"""
+        for mode in ('L', 'RGB', 'RGBA'):
+            for info in ({}, {317: 2, 278: 7}):
+                with self.subTest(mode=mode, tags=info):
+                    path = self.path(f'{mode}-{len(info)}.tif')
+                    sample_image(mode).save(path, compression='tiff_adobe_deflate', tiffinfo=info)
+                    self.assertStreams(path, '_DeflateTIFFStrips')
+
+    @unittest.skipIf(HAS_PYVIPS, "pyvips streams LZW TIFF")
+    def test_whole_image_fallback_warns(self):
+        """Formats without a streaming reader say so instead of silently decoding whole"""
+        path = self.path('lzw.tif')
+        sample_image('RGB').save(path, compression='tiff_lzw')
+        with self.assertWarns(RuntimeWarning):
+            strip_source(path).close()
+
+    def test_resize_matches_full_decode(self):
+        """Banded resize stays within rounding of the whole-image resize"""
+        source = self.path('rgb.tif')
+        output = self.path('rgb-small.png')
+        sample_image('RGB', (300, 240)).save(source, compression=None)
+        tiled_resize(source, output, (100, 80), memory_budget=TINY_BUDGET)
+        with Image.open(source) as img:
+            expected = np.asarray(img.resize((100, 80), Image.Resampling.LANCZOS, reducing_gap=3.0), dtype=np.int16)
+        with Image.open(output) as result:
+            self.assertEqual(result.size, (100, 80))
+            self.assertLess(np.abs(np.asarray(result, dtype=np.int16) - expected).mean(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Python Toolbox - pdf_tools tests
+PDF sıkıştırma ve görselden PDF yazma yollarını render edilmiş piksellerle doğrular
+"""
+
+import io
+import os
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import fitz
+import numpy as np
+import pikepdf
+from PIL import Image, ImageOps
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from helpers import TempDirTestCase
+from tools.pdf_tools import PDFImageSheet, PDFImageWriter, PDFTools
+
+
+def render(path, page=0, dpi=72):
+    with fitz.open(path) as doc:
+        pix = doc[page].get_pixmap(dpi=dpi, colorspace=fitz.csRGB, alpha=False)
+        return np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, 3).astype(np.int16)
+
+
+def photo(size, seed=0):
+    x = np.linspace(0, 255, size[0])[None, :]
+    y = np.linspace(0, 255, size[1])[:, None]
+    noise = np.random.default_rng(seed).normal(0, 10, (size[1], size[0], 3))
+    rgb = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1) + noise
+    return Image.fromarray(rgb.clip(0, 255).astype(np.uint8))
+
+
+class TestPDFTools(TempDirTestCase):
+    """PDF writing and compression checked against rendered output"""
+
+    def setUp(self):
+        super().setUp()
+        self.tools = PDFTools()
+
+    def pdf_images(self, path):
+        with pikepdf.open(path) as pdf:
+            return [(int(obj.Width), int(obj.Height), "/SMask" in obj) for obj in pdf.objects
+                    if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == pikepdf.Name.Image]
+
+    def on_white(self, img):
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGBA', 'LA') and 'transparency' not in img.info:
+            return np.asarray(img.convert('RGB'), np.int16)
+        background = Image.new('RGBA', img.size, 'white')
+        return np.asarray(Image.alpha_composite(background, img.convert('RGBA')).convert('RGB'), np.int16)
+
+    def fitz_reference(self, source):
+        # MuPDF colour-manages CMYK, so Pillow's naive CMYK->RGB is no reference there.
+        reference = self.path('reference.pdf')
+        with Image.open(source) as img, fitz.open() as doc:
+            page = doc.new_page(width=img.width, height=img.height)
+            page.insert_image(page.rect, filename=source)
+            doc.save(reference)
+        return render(reference)
+
+    def assertRendersAs(self, pdf, source, tolerance=2, page=0):
+        with Image.open(source) as img:
+            expected = self.fitz_reference(source) if img.mode == 'CMYK' else self.on_white(img)
+        result = render(pdf, page)
+        self.assertEqual(result.shape, expected.shape)
+        self.assertLess(np.abs(result - expected).mean(), tolerance)
+
+    def test_image_writer_renders_sources(self):
+        """JPEG, PNG (opaque, alpha, palette) and 1-bit inputs render as the decoded image"""
+        base = photo((120, 80))
+        alpha = base.copy()
+        alpha.putalpha(Image.fromarray(np.tile(np.linspace(0, 255, 120, dtype=np.uint8), (80, 1))))
+        palette = base.quantize(32)
+        keyed = palette.copy()
+        keyed.info['transparency'] = int(np.asarray(keyed)[0, 0])
+        sources = {
+            'photo.jpg': (base, {'quality': 95}, 6),
+            'gray.jpg': (base.convert('L'), {'quality': 95}, 6),
+            'cmyk.jpg': (base.convert('CMYK'), {'quality': 95}, 6),
+            'rgb.png': (base, {}, 2),
+            'alpha.png': (alpha, {}, 2),
+            'palette.png': (palette, {}, 2),
+            'keyed.png': (keyed, {'transparency': keyed.info['transparency']}, 2),
+            'bilevel.png': (base.convert('1'), {}, 2),
+        }
+        for name, (img, params, tolerance) in sources.items():
+            with self.subTest(source=name):
+                source = self.path(name)
+                img.save(source, **params)
+                output = self.path(name + '.pdf')
+                with PDFImageWriter(output) as writer:
+                    self.assertEqual(writer.add_image(source), 1)
+                self.assertRendersAs(output, source, tolerance)
+
+        # JPEG bytes go in untouched and alpha travels as an /SMask.
+        with open(self.path('photo.jpg'), 'rb') as f, pikepdf.open(self.path('photo.jpg.pdf')) as pdf:
+            image = pdf.pages[0].Resources.XObject.Im0
+            self.assertEqual(image.Filter, pikepdf.Name.DCTDecode)
+            self.assertEqual(image.read_raw_bytes(), f.read())
+        self.assertEqual(sorted(self.pdf_images(self.path('alpha.png.pdf'))), [(120, 80, False), (120, 80, True)])
+
+    def test_image_writer_applies_exif_orientation(self):
+        """EXIF-rotated JPEGs render upright, whether passed through or re-encoded"""
+        base = photo((120, 80), seed=1)
+        for orientation in (1, 3, 5, 6, 8):
+            with self.subTest(orientation=orientation):
+                exif = Image.Exif()
+                exif[0x0112] = orientation
+                source = self.path(f'o{orientation}.jpg')
+                base.save(source, quality=95, exif=exif.tobytes())
+                output = self.path(f'o{orientation}.pdf')
+                self.tools.images_to_pdf([source], output)
+                self.assertRendersAs(output, source, 6)
+
+    def test_image_writer_page_layout(self):
+        """Page size, margin and fit modes decide where the image lands"""
+        source = self.path('red.png')
+        Image.new('RGB', (200, 100), (255, 0, 0)).save(source)
+        for fit, red_box in (('fit', (10, 35, 90, 65)), ('fill', (10, 10, 90, 90)), ('none', (10, 10, 90, 90))):
+            with self.subTest(fit=fit):
+                output = self.path(f'{fit}.pdf')
+                self.tools.images_to_pdf([source], output, page_size=(100, 100), fit=fit, margin=10)
+                page = render(output)
+                self.assertEqual(page.shape, (100, 100, 3))
+                x0, y0, x1, y1 = red_box
+                self.assertTrue((page[y0 + 1:y1 - 1, x0 + 1:x1 - 1] == (255, 0, 0)).all())
+                self.assertTrue((page[:9] == 255).all() and (page[:, :9] == 255).all())
+        with self.assertRaises(ValueError):
+            PDFImageWriter(self.path('bad.pdf'), page_size='B7')
+
+    def test_image_sheet_fills_grid_row_by_row(self):
+        """Cells fill left to right, top to bottom, and a new page starts when the grid is full"""
+        colours = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255)]
+        output = self.path('sheet.pdf')
+        with PDFImageSheet(output, page_size=(200, 200), columns=2, rows=2, margin=0, gap=0) as sheet:
+            for colour in colours[:4]:
+                sheet.add_image(Image.new('RGB', (50, 50), colour))
+            buffer = io.BytesIO()
+            Image.new('RGB', (50, 50), colours[4]).save(buffer, 'PNG')
+            sheet.add_image(buffer.getvalue())
+        self.assertEqual((sheet.page_count, sheet.image_count), (2, 5))
+
+        cells = {0: [(50, 50), (50, 150), (150, 50), (150, 150)], 1: [(50, 50), (50, 150)]}
+        expected = {0: colours[:4], 1: [colours[4], (255, 255, 255)]}
+        for page, points in cells.items():
+            pixels = render(output, page)
+            # (row, column) centres: top left, top right, bottom left, bottom right.
+            found = [tuple(pixels[y, x]) for y, x in points]
+            self.assertEqual(found, expected[page])
+
+    def test_compress_downsamples_soft_masked_images(self):
+        """An image with an /SMask is downsampled together with its mask"""
+        yy, xx = np.mgrid[:1200, :1200]
+        alpha = np.where((xx - 600) ** 2 + (yy - 600) ** 2 < 500 ** 2, 255, 0).astype(np.uint8)
+        masked = photo((1200, 1200))
+        masked.putalpha(Image.fromarray(alpha))
+        masked.save(self.path('masked.png'))
+        with fitz.open() as doc:
+            doc.new_page(width=200, height=200).insert_image(fitz.Rect(50, 50, 150, 150),
+                                                            filename=self.path('masked.png'))
+            doc.save(self.path('masked.pdf'))
+
+        output = self.path('masked-small.pdf')
+        self.tools.compress_pdf(self.path('masked.pdf'), output, quality='/screen')
+        self.assertLess(os.path.getsize(output), os.path.getsize(self.path('masked.pdf')) / 10)
+        self.assertEqual(sorted(self.pdf_images(output)), [(100, 100, False), (100, 100, True)])
+        self.assertLess(np.abs(render(output) - render(self.path('masked.pdf'))).mean(), 3)
+
+    def test_compress_sizes_images_for_largest_placement(self):
+        """An image shown at 1in and 5in keeps the resolution the 5in placement needs, duplicates included"""
+        photo((1000, 1000), seed=2).save(self.path('big.jpg'), quality=95)
+        with fitz.open() as doc:
+            doc.new_page(width=100, height=100).insert_image(fitz.Rect(14, 14, 86, 86), filename=self.path('big.jpg'))
+            doc.new_page(width=400, height=400).insert_image(fitz.Rect(20, 20, 380, 380), filename=self.path('big.jpg'))
+            doc.save(self.path('shared.pdf'))
+        # Same bytes in a second object: deduplication has to carry the placement over.
+        with pikepdf.open(self.path('shared.pdf')) as pdf:
+            xobjects = pdf.pages[1].Resources.XObject
+            for name in list(xobjects.keys()):
+                source = xobjects[name]
+                xobjects[name] = pdf.make_stream(source.read_raw_bytes(), source.stream_dict)
+            pdf.save(self.path('copies.pdf'))
+
+        for name in ('shared.pdf', 'copies.pdf'):
+            with self.subTest(source=name):
+                output = self.path('small-' + name)
+                report = self.tools.compress_pdf(self.path(name), output, quality='/ebook', return_report=True)
+                self.assertEqual([size[:2] for size in self.pdf_images(output)], [(1000, 1000)])
+                self.assertEqual(report['stages'][0]['images'], 0 if name == 'shared.pdf' else 1)
+
+    def test_compress_downsamples_cmyk_images(self):
+        """CMYK JPEGs are downsampled as CMYK and render like the original"""
+        photo((600, 600), seed=3).convert('CMYK').save(self.path('cmyk.jpg'), quality=95)
+        with fitz.open() as doc:
+            doc.new_page(width=100, height=100).insert_image(fitz.Rect(0, 0, 100, 100), filename=self.path('cmyk.jpg'))
+            doc.save(self.path('cmyk.pdf'))
+
+        output = self.path('cmyk-small.pdf')
+        report = self.tools.compress_pdf(self.path('cmyk.pdf'), output, quality='/screen', return_report=True)
+        self.assertEqual(report['stages'][1]['images'], 1)
+        self.assertEqual(self.pdf_images(output), [(100, 100, False)])
+        with pikepdf.open(output) as pdf:
+            image = next(iter(pdf.pages[0].Resources.XObject.values()))
+            self.assertEqual(pikepdf.PdfImage(image).mode, 'CMYK')
+        self.assertLess(np.abs(render(output) - render(self.path('cmyk.pdf'))).mean(), 6)
+
+    def test_compress_reports_skipped_images(self):
+        """Images the recompressor cannot reproduce are listed with a reason"""
+        photo((300, 300), seed=4).save(self.path('plain.png'))
+        with fitz.open() as doc:
+            doc.new_page(width=100, height=100).insert_image(fitz.Rect(0, 0, 50, 50), filename=self.path('plain.png'))
+            doc.save(self.path('plain.pdf'))
+        with pikepdf.open(self.path('plain.pdf')) as pdf:
+            xobjects = pdf.pages[0].Resources.XObject
+            image = xobjects[list(xobjects.keys())[0]]
+            image.Decode = pikepdf.Array([0, 0.5] * 3)
+            xobjects.Fax = pdf.make_stream(b'\0' * 16, Type=pikepdf.Name.XObject, Subtype=pikepdf.Name.Image,
+                                           Width=8, Height=8, BitsPerComponent=1,
+                                           ColorSpace=pikepdf.Name.DeviceGray, Filter=pikepdf.Name.CCITTFaxDecode)
+            pdf.save(self.path('odd.pdf'))
+
+        report = self.tools.compress_pdf(self.path('odd.pdf'), self.path('odd-small.pdf'), quality='/screen',
+                                         return_report=True)
+        images = report['stages'][1]
+        self.assertEqual(images['images'], 0)
+        self.assertEqual(sorted(item['reason'] for item in images['skipped']), ['/CCITTFaxDecode filter', '/Decode array'])
+
+    def test_image_watermark_position(self):
+        """Without a position the watermark covers the page; with one it sits there at its pixel size"""
+        with fitz.open() as doc:
+            doc.new_page(width=100, height=100)
+            doc.save(self.path('blank.pdf'))
+        Image.new('RGB', (20, 10), (255, 0, 0)).save(self.path('mark.png'))
+
+        self.tools.add_watermark_image(self.path('blank.pdf'), self.path('placed.pdf'), self.path('mark.png'),
+                                       position=(30, 40), opacity=1)
+        page = render(self.path('placed.pdf'))
+        self.assertTrue((page[41:49, 31:49] == (255, 0, 0)).all())
+        self.assertEqual(int((page != 255).any(axis=2).sum()), 200)
+
+        self.tools.add_watermark_image(self.path('blank.pdf'), self.path('full.pdf'), self.path('mark.png'), opacity=1)
+        page = render(self.path('full.pdf'))
+        self.assertTrue((page[26:74, 1:99] == (255, 0, 0)).all())
+
+    def test_batch_watermark_reports_errors_per_file(self):
+        """A broken PDF becomes an error item; the other files are still stamped"""
+        source = self.path('in')
+        os.makedirs(os.path.join(source, 'sub'))
+        for name in ('a.pdf', 'sub/b.pdf'):
+            with fitz.open() as doc:
+                doc.new_page(width=100, height=100)
+                doc.save(os.path.join(source, name))
+        with open(os.path.join(source, 'broken.pdf'), 'wb') as f:
+            f.write(b'not a pdf')
+        Image.new('RGB', (20, 10), (255, 0, 0)).save(self.path('mark.png'))
+        output = self.path('out')
+
+        for kind, data in (('image', self.path('mark.png')), ('text', 'TASLAK')):
+            with self.subTest(kind=kind):
+                items = self.tools.batch_add_watermark(source, output, kind, data, position=(10, 20), max_workers=1,
+                                                       recursive=True, return_details=True)
+                errors = {os.path.basename(item['input']): item['error'] is not None for item in items}
+                self.assertEqual(errors, {'a.pdf': False, 'broken.pdf': True, 'b.pdf': False})
+                self.assertTrue((render(os.path.join(output, 'sub', 'b.pdf')) != 255).any())
+                self.assertEqual(self.tools.batch_add_watermark(source, output, kind, data, max_workers=1),
+                                 [os.path.join(output, 'a.pdf')])
+
+    def test_search_quotes_user_terms(self):
+        """Plain queries are matched literally; FTS5 syntax needs raw=True and errors become ValueError"""
+        with fitz.open() as doc:
+            for text in ("fatura-2024 toplam tutar", "fatura 2023 iptal", "C++ derleyici notlari"):
+                doc.new_page().insert_text((72, 72), text)
+            doc.save(self.path('docs.pdf'))
+        index = self.path('idx.db')
+        self.tools.index_pdfs(self.path('docs.pdf'), index, max_workers=1)
+
+        def pages(query, raw=False):
+            return sorted(hit['page'] for hit in self.tools.search_pdfs(index, query, raw=raw))
+
+        self.assertEqual(pages('fatura-2024'), [1])
+        self.assertEqual(pages('C++'), [3])
+        self.assertEqual(pages('tutar "toplam'), [1])
+        self.assertEqual(pages('fatura'), [1, 2])
+        self.assertEqual(pages('fatura NOT iptal', raw=True), [1])
+        self.assertEqual(pages('fatura NOT iptal'), [])
+        with self.assertRaises(ValueError):
+            pages('fatura-2024', raw=True)
+        with self.assertRaises(ValueError):
+            pages('   ')
+
+    def test_interrupted_index_update_resumes(self):
+        """Files interrupted before their text was stored are indexed on the next run"""
+        for i in range(3):
+            with fitz.open() as doc:
+                doc.new_page().insert_text((72, 72), f"zebra number {i}")
+                doc.save(self.path(f'doc{i}.pdf'))
+        index = self.path('idx.db')
+        with mock.patch('tools.pdf_tools.as_completed', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.tools.index_pdfs(self.tmp.name, index, max_workers=1)
+        self.assertEqual(self.tools.search_pdfs(index, 'zebra'), [])
+
+        stats = self.tools.index_pdfs(self.tmp.name, index, max_workers=1)
+        self.assertEqual((stats['indexed'], stats['unchanged']), (3, 0))
+        self.assertEqual(len(self.tools.search_pdfs(index, 'zebra')), 3)
+        self.assertEqual(self.tools.index_pdfs(self.tmp.name, index, max_workers=1)['unchanged'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
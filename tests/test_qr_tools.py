@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Python Toolbox - qr_tools tests
+QR üretimi (PNG/önbellek/CSV) ve bulunan kodların kaynak görsele geri eşlenmesi (zbar gerektirmez)
+"""
+
+import os
+import struct
+import sys
+import zlib
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import fitz
+import numpy as np
+import qrcode
+from PIL import Image
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from helpers import TempDirTestCase
+from tools.qr_tools import QRTools, _decoded_records, _scale_records, _unrotate_records
+
+
+def symbol(rect, data=b'payload'):
+    left, top, width, height = rect
+    polygon = [(left, top), (left, top + height), (left + width, top + height), (left + width, top)]
+    return SimpleNamespace(type='QRCODE', data=data, rect=rect, polygon=polygon)
+
+
+def whole_region(img, symbols=None):
+    # Stands in for zbar: "finds" one code covering the image it was given.
+    return [symbol((0, 0, img.width, img.height))]
+
+
+class TestQRTools(TempDirTestCase):
+    """QR rendering, caching and CSV batches, and the decoder's coordinate bookkeeping without zbar"""
+
+    def setUp(self):
+        super().setUp()
+        self.tools = QRTools()
+
+    def png_chunks(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(data[:8], b'\x89PNG\r\n\x1a\n')
+        chunks, pos = {}, 8
+        while pos < len(data):
+            length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+            body = data[pos + 8:pos + 8 + length]
+            self.assertEqual(struct.unpack('>I', data[pos + 8 + length:pos + 12 + length])[0],
+                             zlib.crc32(kind + body) & 0xFFFFFFFF, kind)
+            chunks[kind] = body
+            pos += 12 + length
+        return chunks
+
+    def test_png_matches_qrcode_matrix(self):
+        """Grayscale and palette PNGs are valid, use only None/Up filters and draw qrcode's matrix"""
+        data = 'https://example.com/urun/12345'
+        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M)
+        qr.add_data(data)
+        qr.make(fit=True)
+        expected = np.pad(np.array(qr.modules, dtype=bool), 4)
+
+        styles = {
+            'gray': ('black', 'white', 0, {'L', '1'}),
+            'palette': ('navy', (255, 255, 200), 3, {'P'}),
+            'transparent': ('black', 'transparent', 3, {'P'}),
+        }
+        for name, (fill, back, colour_type, modes) in styles.items():
+            with self.subTest(style=name):
+                output = self.tools.generate_qr(data, self.path(f'{name}.png'), box_size=3, border=4,
+                                                fill_color=fill, back_color=back)
+                chunks = self.png_chunks(output)
+                width, height, depth, kind = struct.unpack('>IIBB', chunks[b'IHDR'][:10])
+                self.assertEqual((width, height, depth, kind), (expected.shape[1] * 3, expected.shape[0] * 3, 1,
+                                                                colour_type))
+                self.assertEqual(b'PLTE' in chunks, colour_type == 3)
+                self.assertEqual(b'tRNS' in chunks, back == 'transparent')
+                raw = zlib.decompress(chunks[b'IDAT'])
+                stride = (width + 7) // 8 + 1
+                self.assertEqual(set(raw[::stride]), {0, 2})
+
+                with Image.open(output) as img:
+                    self.assertIn(img.mode, modes)
+                    rgba = np.asarray(img.convert('RGBA'))
+                centres = rgba[1::3, 1::3]
+                dark = np.all(centres == Image.new('RGBA', (1, 1), fill).getpixel((0, 0)), axis=-1)
+                np.testing.assert_array_equal(dark, expected)
+                if back == 'transparent':
+                    np.testing.assert_array_equal(centres[..., 3] == 0, ~expected)
+
+    def test_matrix_and_png_caches(self):
+        """Repeated payloads are served from the LRU caches, and clear_cache empties them"""
+        self.tools.clear_cache()
+        for i in range(3):
+            self.tools.generate_qr('ayni veri', self.path(f'same{i}.png'))
+        self.tools.generate_qr('ayni veri', self.path('same.svg'))
+        self.tools.generate_qr('ayni veri', self.path('big.png'), box_size=4)
+        info = self.tools.cache_info()
+        self.assertEqual((info['png']['misses'], info['png']['hits']), (2, 2))
+        self.assertEqual((info['matrices']['misses'], info['matrices']['hits']), (1, 2))
+        with open(self.path('same0.png'), 'rb') as a, open(self.path('same2.png'), 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+        self.tools.clear_cache()
+        self.assertEqual(self.tools.cache_info()['png']['currsize'], 0)
+
+    def test_csv_errors_name_the_line(self):
+        """A bad CSV row becomes an error item naming its line; the other rows are written"""
+        with open(self.path('codes.csv'), 'w', encoding='utf-8', newline='') as f:
+            f.write('data,filename\nbir,one\n"iki\nsatir",two\nyalniz\n' + 'x' * 4000 + ',big\n')
+        items = self.tools.batch_generate_qr(self.path('codes.csv'), self.path('out'), max_workers=1,
+                                             return_details=True)
+        self.assertEqual([item['error'] is None for item in items], [True, True, False, False])
+        self.assertTrue(items[2]['error'].startswith("ValueError: CSV line 5: ValueError: row needs both"))
+        self.assertTrue(items[3]['error'].startswith("ValueError: CSV line 6: "))
+        self.assertEqual(sorted(os.listdir(self.path('out'))), ['one.png', 'two.png'])
+
+    def test_decoded_records_undo_crop_and_scale(self):
+        """Region coordinates map back through the downscale and the crop offset"""
+        records = _decoded_records([symbol((10, 20, 30, 40))], scale=(0.5, 0.25), offset=(100, 200))
+        self.assertEqual(records[0]['rect'], [120, 280, 60, 160])
+        self.assertEqual(records[0]['polygon'], [[120, 280], [120, 440], [180, 440], [180, 280]])
+        self.assertEqual((records[0]['type'], records[0]['data']), ('QRCODE', 'payload'))
+
+        scaled = _scale_records(records, 0.36, 0.36)
+        self.assertEqual(scaled[0]['rect'], [43.2, 100.8, 21.6, 57.6])
+        self.assertEqual(scaled[0]['polygon'][2], [64.8, 158.4])
+
+    def test_unrotate_follows_pil_rotation(self):
+        """Points found on a rotated copy land back where PIL took them from"""
+        region = Image.new('L', (300, 200), 0)
+        region.paste(255, (220, 40, 226, 46))
+        scale, offset = (0.5, 0.5), (50, 10)
+        for angle in (22.5, 45, 67.5):
+            with self.subTest(angle=angle):
+                rotated = region.rotate(angle, Image.Resampling.BILINEAR, expand=True, fillcolor=0)
+                ys, xs = np.nonzero(np.asarray(rotated) > 127)
+                found = [{"rect": None, "polygon": [[xs.mean() + 0.5, ys.mean() + 0.5]] * 2}]
+                (record,) = _unrotate_records(found, angle, rotated.size, region.size, scale, offset)
+                # The square's centre (223, 43) in region pixels, undone through scale and offset.
+                x, y = record['polygon'][0]
+                self.assertAlmostEqual(x, 50 + 223 / 0.5, delta=2)
+                self.assertAlmostEqual(y, 10 + 43 / 0.5, delta=2)
+                self.assertEqual(record['rect'][2:], [0, 0])
+
+    def test_read_qr_reports_source_coordinates(self):
+        """ROIs, max_side downscaling, JPEG draft decoding and PDF pages all report source coordinates"""
+        Image.new('L', (2000, 1000), 255).save(self.path('wide.png'))
+        Image.new('L', (2000, 1000), 255).save(self.path('wide.jpg'))
+        with fitz.open() as doc:
+            doc.new_page(width=200, height=100)
+            doc.save(self.path('page.pdf'))
+
+        with mock.patch('tools.qr_tools._decode_symbols', side_effect=whole_region):
+            roi = self.tools.read_qr(self.path('wide.png'), max_side=500, rois=[(0.5, 0, 1, 0.5)])
+            draft = self.tools.read_qr(self.path('wide.jpg'), max_side=500)
+            page = self.tools.read_qr(self.path('page.pdf'), dpi=144)
+
+        self.assertEqual(roi[0]['rect'], [1000, 0, 1000, 500])
+        self.assertEqual(draft[0]['rect'], [0, 0, 2000, 1000])
+        self.assertEqual((page[0]['page'], page[0]['rect']), (1, [0, 0, 200, 100]))
+
+
+if __name__ == '__main__':
+    unittest.main()
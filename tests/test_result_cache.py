@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Python Toolbox - result_cache tests
+Sonuç önbelleğinin isabet/ıska, bozulma tespiti ve LRU temizleme davranışı
+"""
+
+import os
+import stat
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from helpers import TempDirTestCase
+from tools.image_tools import ImageTools
+from tools.result_cache import ResultCache
+
+
+class TestResultCache(TempDirTestCase):
+    """Store, hit, miss and eviction through the public ResultCache API"""
+
+    def setUp(self):
+        super().setUp()
+        self.cache = ResultCache(self.path('cache'))
+        self.input = self.write('input.txt', b'source')
+
+    def store(self, operation='op', data=b'result', name='result.bin'):
+        key = self.cache.make_key(operation, self.input, {'level': 1})
+        self.cache.put_file(key, self.write(name, data), {'note': operation})
+        return key
+
+    def test_keys_follow_content_and_params(self):
+        """Keys change with the input bytes and the parameters, not with the path"""
+        key = self.cache.make_key('op', self.input, {'level': 1})
+        copy = self.write('copy.txt', b'source')
+        self.assertEqual(self.cache.make_key('op', copy, {'level': 1}), key)
+        self.assertNotEqual(self.cache.make_key('op', self.input, {'level': 2}), key)
+        self.write('input.txt', b'changed')
+        self.assertNotEqual(self.cache.make_key('op', self.input, {'level': 1}), key)
+
+    def test_hit_and_miss(self):
+        """A stored result comes back with its metadata; unknown keys miss"""
+        self.assertIsNone(self.cache.get_file('0' * 64, self.path('out.bin')))
+        key = self.store()
+        self.assertEqual(self.cache.get_file(key, self.path('out.bin')), {'note': 'op'})
+        self.assertEqual(self.read(self.path('out.bin')), b'result')
+        self.assertEqual(self.cache.get_files(key, self.path('dir')), [os.path.join(self.path('dir'), 'result.bin')])
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['stores'], stats['entries']), (2, 1, 1, 1))
+        self.assertEqual(stats['size'], len(b'result'))
+
+    def test_linked_outputs_do_not_alias_the_cache(self):
+        """Cache objects are read-only, and a tampered object is evicted instead of served"""
+        self.cache = ResultCache(self.path('cache'), link=True)
+        key = self.store()
+        output = self.path('out.bin')
+        self.cache.get_file(key, output)
+        self.assertEqual(os.stat(output).st_nlink, 2)
+        self.assertFalse(os.stat(output).st_mode & 0o222)
+        if os.name != 'nt' and os.geteuid() != 0:
+            with self.assertRaises(PermissionError):
+                open(output, 'r+b')
+
+        # Forcing a write through the link anyway must not poison later hits.
+        os.chmod(output, stat.S_IRUSR | stat.S_IWUSR)
+        with open(output, 'r+b') as f:
+            f.write(b'XX')
+        self.assertIsNone(self.cache.get_file(key, self.path('again.bin')))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+        key = self.store()
+        self.cache.get_file(key, self.path('again.bin'))
+        self.assertEqual(self.read(self.path('again.bin')), b'result')
+
+    def test_copied_outputs_are_writable(self):
+        """By default outputs are independent, writable copies"""
+        cache = self.cache
+        key = self.store()
+        output = self.path('out.bin')
+        cache.get_file(key, output)
+        self.assertEqual(os.stat(output).st_nlink, 1)
+        with open(output, 'r+b') as f:
+            f.write(b'XX')
+        self.assertEqual(cache.get_file(key, self.path('again.bin')), {'note': 'op'})
+        self.assertEqual(self.read(self.path('again.bin')), b'result')
+
+    def test_miss_after_hit_replaces_the_output(self):
+        """A miss writing over the output of an earlier hit leaves the cached result intact"""
+        source = self.path('photo.jpg')
+        Image.fromarray(np.random.default_rng(0).integers(0, 256, (64, 64, 3), dtype=np.uint8)).save(source, quality=95)
+        output = self.path('out.jpg')
+        for link in (False, True):
+            with self.subTest(link=link):
+                tools = ImageTools(cache=ResultCache(self.path(f'cache-{link}'), link=link))
+                tools.optimize_image(source, output, quality=85)
+                first = self.read(output)
+                tools.optimize_image(source, output, quality=85)
+                tools.optimize_image(source, output, quality=40)
+                self.assertNotEqual(self.read(output), first)
+                tools.optimize_image(source, output, quality=85)
+                self.assertEqual(self.read(output), first)
+                stats = tools.cache.stats()
+                self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (2, 2, 2))
+
+    def test_evicts_least_recently_used(self):
+        """Over max_bytes the oldest entries go first; clear empties the cache"""
+        cache = ResultCache(self.path('small'), max_bytes=25)
+        keys = []
+        for i in range(3):
+            keys.append(cache.make_key(f'op{i}', self.input))
+            cache.put_file(keys[-1], self.write(f'r{i}.bin', b'x' * 10))
+            if i == 1:
+                cache.get_file(keys[0], self.path('touch.bin'))
+        self.assertIsNotNone(cache.get_file(keys[0], self.path('a.bin')))
+        self.assertIsNone(cache.get_file(keys[1], self.path('b.bin')))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.clear(), 2)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
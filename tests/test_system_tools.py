@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Python Toolbox - system_tools tests
+Dosya hash'leme, hash önbelleği ve checksum manifest yazma/doğrulama davranışı
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from helpers import TempDirTestCase
+from tools.system_tools import SystemTools
+
+FILES = {
+    'a.txt': b'alpha\n',
+    'b c.txt': b'name with a space\n',
+    'back\\slash.txt': b'backslash in the name\n',
+    'sub/d.bin': bytes(range(256)) * 64,
+}
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class TestSystemTools(TempDirTestCase):
+    """Hashing and checksum manifests on a small directory tree"""
+
+    def setUp(self):
+        super().setUp()
+        self.tools = SystemTools()
+        self.root = self.path('data')
+        for name, data in FILES.items():
+            self.write_data(name, data)
+
+    def write_data(self, name, data):
+        return self.write(os.path.join('data', name), data)
+
+    def test_hash_file_matches_hashlib(self):
+        """Single and multi-algorithm digests agree with hashlib, whatever the buffer size"""
+        path = os.path.join(self.root, 'sub', 'd.bin')
+        data = FILES['sub/d.bin']
+        self.assertEqual(self.tools.hash_file(path), sha256(data))
+        expected = {name: hashlib.new(name, data).hexdigest() for name in ('md5', 'sha1', 'blake2b')}
+        for buffer_size in (None, 1000, 1 << 20):
+            with self.subTest(buffer_size=buffer_size):
+                self.assertEqual(self.tools.hash_file(path, list(expected), buffer_size), expected)
+        # An explicit buffer_size is honoured for a single algorithm too, instead of hashlib.file_digest.
+        with mock.patch('hashlib.file_digest', side_effect=AssertionError("file_digest"), create=True):
+            self.assertEqual(self.tools.hash_file(path, 'sha256', buffer_size=1000), sha256(data))
+        self.assertTrue(self.tools.verify_hash(path, ' ' + sha256(data).upper() + '\n'))
+        with self.assertRaises(ValueError):
+            self.tools.hash_file(path, 'crc32')
+
+    def test_hash_cache_reuses_unchanged_files(self):
+        """A second pass serves unchanged files from the cache and rehashes modified ones"""
+        cache = self.path('hashes.db')
+        first = {r['path']: r for r in self.tools.iter_hash_files(self.root, 'sha256', cache_path=cache)}
+        self.assertFalse(any(record['cached'] for record in first.values()))
+        self.write_data('a.txt', b'changed\n')
+        second = {r['path']: r for r in self.tools.iter_hash_files(self.root, 'sha256', cache_path=cache)}
+        self.assertEqual({path for path, record in second.items() if not record['cached']}, {'a.txt'})
+        self.assertEqual(second['a.txt']['digests']['sha256'], sha256(b'changed\n'))
+        self.assertEqual(second['b c.txt']['digests'], first['b c.txt']['digests'])
+
+    def test_full_walk_prunes_deleted_files_from_the_cache(self):
+        """Only a complete, unfiltered walk drops entries, and only those under the walked directory"""
+        cache = self.path('hashes.db')
+        self.write('other/e.txt', b'another tree\n')
+        list(self.tools.iter_hash_files(self.path('other'), 'sha256', cache_path=cache))
+        list(self.tools.iter_hash_files(self.root, 'sha256', cache_path=cache))
+        os.remove(os.path.join(self.root, 'a.txt'))
+
+        def cached_names():
+            with sqlite3.connect(cache) as db:
+                paths = {os.path.relpath(path, self.tmp.name) for (path,) in db.execute("SELECT path FROM hashes")}
+            return {path.replace(os.sep, '/') for path in paths}
+
+        list(self.tools.iter_hash_files(self.root, 'sha256', cache_path=cache, exclude=['*.bin']))
+        next(self.tools.iter_hash_files(self.root, 'sha256', cache_path=cache))
+        self.assertIn('data/a.txt', cached_names())
+
+        self.tools.write_manifest(self.root, self.path('SHA256SUMS'), cache_path=cache)
+        self.assertEqual(cached_names(), {'other/e.txt'} | {'data/' + name for name in FILES if name != 'a.txt'})
+
+    def test_gnu_manifest_round_trip(self):
+        """Names with spaces and backslashes are escaped the coreutils way and read back"""
+        manifest = os.path.join(self.root, 'SHA256SUMS')
+        result = self.tools.write_manifest(self.root, manifest)
+        self.assertEqual((result['files'], result['errors']), (len(FILES), []))
+        with open(manifest, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertIn('\\' + sha256(FILES['back\\slash.txt']) + '  back\\\\slash.txt', lines)
+        self.assertIn(sha256(FILES['b c.txt']) + '  b c.txt', lines)
+
+        report = self.tools.verify_manifest(manifest)
+        self.assertTrue(report['passed'])
+        self.assertEqual((report['hash_type'], report['total'], report['ok']), ('sha256', len(FILES), len(FILES)))
+
+    @unittest.skipIf(shutil.which('sha256sum') is None, "coreutils sha256sum not available")
+    def test_gnu_manifest_interoperates_with_sha256sum(self):
+        """sha256sum -c accepts our manifest, and we accept sha256sum's own output"""
+        manifest = self.path('ours.sha256')
+        self.tools.write_manifest(self.root, manifest)
+        subprocess.run(['sha256sum', '--quiet', '-c', manifest], cwd=self.root, check=True)
+
+        names = sorted(FILES)
+        theirs = subprocess.run(['sha256sum', '-b'] + names, cwd=self.root, check=True, capture_output=True).stdout
+        with open(self.path('theirs.sha256'), 'wb') as f:
+            f.write(theirs)
+        report = self.tools.verify_manifest(self.path('theirs.sha256'), self.root)
+        self.assertEqual(report['ok'], len(FILES))
+        self.assertTrue(report['passed'])
+
+    def test_bsd_and_json_manifests(self):
+        """BSD "SHA256 (name) = digest" lines and JSON manifests verify too"""
+        bsd = ''.join(f'SHA256 ({name}) = {sha256(data)}\n' for name, data in FILES.items() if '\\' not in name)
+        report = self.tools.verify_manifest(self.write('tag.txt', bsd), self.root, check_extra=False)
+        self.assertEqual((report['hash_type'], report['ok']), ('sha256', len(FILES) - 1))
+        self.assertTrue(report['passed'])
+
+        md5 = f'MD5 (a.txt) = {hashlib.md5(FILES["a.txt"]).hexdigest()}\n'
+        report = self.tools.verify_manifest(self.write('md5.txt', md5), self.root, check_extra=False)
+        self.assertEqual((report['hash_type'], report['ok']), ('md5', 1))
+
+        manifest = self.path('manifest.json')
+        self.tools.write_manifest(self.root, manifest, hash_type='blake2b')
+        with open(manifest, encoding='utf-8') as f:
+            data = json.load(f)
+        self.assertEqual(data['hash_type'], 'blake2b')
+        self.assertEqual(data['files']['sub/d.bin'], hashlib.blake2b(FILES['sub/d.bin']).hexdigest())
+        self.assertTrue(self.tools.verify_manifest(manifest, self.root)['passed'])
+
+        with self.assertRaises(ValueError):
+            self.tools.verify_manifest(self.write('bad.txt', 'not a checksum line\n'), self.root)
+
+    def test_verify_reports_each_mismatch_kind(self):
+        """Missing, modified and extra files are reported separately"""
+        manifest = os.path.join(self.root, 'SHA256SUMS')
+        self.tools.write_manifest(self.root, manifest)
+        os.remove(os.path.join(self.root, 'a.txt'))
+        self.write_data('sub/d.bin', b'tampered')
+        self.write_data('sub/new.txt', b'not in the manifest')
+
+        report = self.tools.verify_manifest(manifest)
+        self.assertFalse(report['passed'])
+        self.assertEqual(report['missing'], ['a.txt'])
+        self.assertEqual(report['mismatched'], ['sub/d.bin'])
+        self.assertEqual(report['extra'], ['sub/new.txt'])
+        self.assertEqual((report['ok'], report['errors'], report['stopped']), (len(FILES) - 2, [], False))
+
+        stopped = self.tools.verify_manifest(manifest, max_workers=1, stop_on_failure=True)
+        self.assertTrue(stopped['stopped'])
+        self.assertFalse(stopped['passed'])
+        self.assertEqual(len(stopped['missing']) + len(stopped['mismatched']), 1)
+        self.assertEqual(stopped['extra'], [])
+
+        relaxed = self.tools.verify_manifest(manifest, check_extra=False)
+        self.assertEqual(relaxed['extra'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,309 @@
+import hashlib
+import json
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from functools import lru_cache, partial
+from itertools import islice
+from pathlib import Path
+
+
+def _matches(relative, name, patterns):
+    return any(fnmatch(relative, pattern) or fnmatch(name, pattern) for pattern in patterns)
+
+
+def _list_directory(directory):
+    with os.scandir(directory) as listing:
+        return sorted(listing, key=lambda entry: entry.name)
+
+
+def iter_files(root, extensions=None, recursive=False, include=None, exclude=None):
+    # Yields os.DirEntry objects, whose type (and on Windows stat) data comes
+    # from the directory listing itself, one directory at a time and depth
+    # first, so callers can start working before the walk is finished.
+    # include/exclude globs are matched against the root-relative POSIX path
+    # and the bare name; excluded directories are not descended into.
+    # The root is listed right away, so a missing or unreadable root raises
+    # here (before callers create any output); unreadable subdirectories are
+    # skipped.
+    if isinstance(extensions, str):
+        extensions = (extensions,)
+    return _walk(_list_directory(root), extensions, recursive, include, exclude)
+
+
+def _walk(root_entries, extensions, recursive, include, exclude):
+    stack = [(None, "")]
+    while stack:
+        directory, prefix = stack.pop()
+        if directory is None:
+            entries = root_entries
+        else:
+            try:
+                entries = _list_directory(directory)
+            except OSError:
+                continue
+        subdirectories = []
+        for entry in entries:
+            relative = prefix + entry.name
+            if exclude and _matches(relative, entry.name, exclude):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    subdirectories.append((entry.path, relative + "/"))
+            elif entry.is_file():
+                if extensions and not entry.name.lower().endswith(extensions):
+                    continue
+                if include and not _matches(relative, entry.name, include):
+                    continue
+                yield entry
+        stack.extend(reversed(subdirectories))
+
+
+def iter_tasks(input_dir, output_dir, args=(), extensions=None, extension=None, recursive=False, include=None,
+               exclude=None, skip=None, create_dirs=True):
+    # (input_path, output_path, args) tasks with input subdirectories mirrored
+    # under output_dir; each output directory is created once, when first needed
+    # (not at all with create_dirs=False, e.g. for dry runs).
+    # Like iter_files, a bad input_dir raises on the call itself.
+    return _mirror(iter_files(input_dir, extensions, recursive, include, exclude), input_dir, output_dir, args,
+                   extension, skip, create_dirs)
+
+
+def _mirror(entries, input_dir, output_dir, args, extension, skip, create_dirs):
+    created = set()
+    for entry in entries:
+        if skip and entry.path in skip:
+            continue
+        relative = os.path.relpath(entry.path, input_dir)
+        if extension:
+            relative = os.path.splitext(relative)[0] + f".{extension}"
+        output_path = os.path.join(output_dir, relative)
+        directory = os.path.dirname(output_path)
+        if create_dirs and directory not in created:
+            os.makedirs(directory, exist_ok=True)
+            created.add(directory)
+        yield entry.path, output_path, args
+
+
+def _run_chunk(func, chunk):
+    results = []
+    for input_path, output_path, args in chunk:
+        try:
+            results.append((func(input_path, output_path, *args), None))
+        except Exception as e:
+            results.append((None, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def iter_batch(func, tasks, max_workers=None, chunksize=8, use_processes=True, progress=None):
+    total = len(tasks) if hasattr(tasks, "__len__") else None
+    workers = max_workers or os.cpu_count() or 1
+    pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    tasks = iter(tasks)
+    pending = deque()
+    done = 0
+
+    with pool_class(max_workers=workers) as executor:
+        while True:
+            # Keep a bounded number of chunks in flight and hand results back in
+            # submission order, so huge (or lazily produced) task lists stay cheap.
+            while len(pending) < workers * 4:
+                chunk = list(islice(tasks, chunksize))
+                if not chunk:
+                    break
+                pending.append((chunk, executor.submit(_run_chunk, func, chunk)))
+            if not pending:
+                break
+
+            chunk, future = pending.popleft()
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [(None, f"{type(e).__name__}: {e}")] * len(chunk)
+            for (input_path, output_path, _), (result, error) in zip(chunk, results):
+                item = {"input": input_path, "output": output_path, "result": result, "error": error}
+                done += 1
+                if progress is not None:
+                    progress(done, total, item)
+                yield item
+
+
+def run_batch(func, tasks, max_workers=None, chunksize=8, use_processes=True, progress=None):
+    return list(iter_batch(func, tasks, max_workers, chunksize, use_processes, progress))
+
+
+def batch_outputs(items, return_details=False):
+    if return_details:
+        return items
+    return [item["result"] for item in items if item["error"] is None]
+
+
+HASH_TYPES = ("md5", "sha1", "sha224", "sha256", "sha384", "sha512", "blake2b", "blake2s", "sha3_256", "sha3_512")
+DEFAULT_HASH_BUFFER = 4 * 1024 * 1024
+
+
+# Keyed by pid: a process-pool worker forked from a parent that already
+# started the pool must not inherit its (threadless) copy.
+@lru_cache(maxsize=1)
+def _hash_pool(pid):
+    return ThreadPoolExecutor(max_workers=min(len(HASH_TYPES), os.cpu_count() or 1))
+
+
+def new_hashers(hash_types):
+    for hash_type in hash_types:
+        if hash_type not in HASH_TYPES:
+            raise ValueError(f"Unsupported hash type: {hash_type}")
+    return [hashlib.new(hash_type) for hash_type in hash_types]
+
+
+def _digest_stream(f, hashers, buffer_size):
+    # Two buffers filled with readinto: while the hashers (on pool threads,
+    # hashlib drops the GIL for large updates) work through one, the next
+    # chunk is read into the other.
+    buffers = [bytearray(buffer_size), bytearray(buffer_size)]
+    pool = _hash_pool(os.getpid())
+    pending = []
+    index = 0
+    while True:
+        size = f.readinto(buffers[index])
+        for future in pending:
+            future.result()
+        if not size:
+            break
+        view = memoryview(buffers[index])[:size]
+        pending = [pool.submit(hasher.update, view) for hasher in hashers]
+        index ^= 1
+
+
+def file_digests(path, hash_types=("sha256",), buffer_size=None):
+    # The one file hashing helper for the toolbox: every requested digest
+    # comes from a single pass over the file, returned as {name: hexdigest}.
+    # With no buffer_size a lone algorithm goes through hashlib.file_digest
+    # where available (Python 3.11+), which picks its own read size; an
+    # explicit buffer_size always uses buffered readinto passes of that size.
+    hashers = new_hashers(hash_types)
+    with open(path, "rb", buffering=0) as f:
+        if len(hashers) == 1 and buffer_size is None and hasattr(hashlib, "file_digest"):
+            return {hash_types[0]: hashlib.file_digest(f, lambda: hashers[0]).hexdigest()}
+        buffer_size = buffer_size or DEFAULT_HASH_BUFFER
+        if os.fstat(f.fileno()).st_size < buffer_size:
+            # Small files fit one read; not worth a trip through the pool.
+            data = f.read()
+            for hasher in hashers:
+                hasher.update(data)
+        else:
+            _digest_stream(f, hashers, buffer_size)
+    return {hash_type: hasher.hexdigest() for hash_type, hasher in zip(hash_types, hashers)}
+
+
+def _run_and_fingerprint(func, input_path, output_path, *args):
+    # Runs in the worker, so hashing the input does not serialise the batch
+    # on the parent process.
+    result = func(input_path, output_path, *args)
+    stat = os.stat(input_path)
+    return result, (stat.st_size, stat.st_mtime, file_digests(input_path)["sha256"])
+
+
+class BatchManifest:
+    # Lives next to the output directory ("out" -> "out.manifest.db") and maps
+    # each input to the size/mtime/sha256 and parameters it was last built from.
+    # The database is only created by the first real run; dry runs read it.
+    def __init__(self, output_dir, operation, params=()):
+        self.path = os.path.abspath(output_dir).rstrip(os.sep) + ".manifest.db"
+        self.operation = operation
+        self.params = hashlib.sha256(json.dumps([operation, params], sort_keys=True, default=str).encode()).hexdigest()
+
+    @contextmanager
+    def _connect(self, read_only=False):
+        if read_only:
+            db = sqlite3.connect(Path(self.path).as_uri() + "?mode=ro", uri=True, timeout=30)
+        else:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("CREATE TABLE IF NOT EXISTS entries (input TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+                       "sha256 TEXT, params TEXT, result TEXT)")
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _outputs_exist(self, result):
+        paths = result if isinstance(result, list) else [result]
+        return all(isinstance(path, str) and os.path.exists(path) for path in paths)
+
+    def plan(self, tasks, dry_run=False):
+        if dry_run and not os.path.exists(self.path):
+            return [(task, "new") for task in tasks], []
+        pending, unchanged = [], []
+        with self._connect(read_only=dry_run) as db:
+            for task in tasks:
+                input_path = os.path.abspath(task[0])
+                stat = os.stat(input_path)
+                row = db.execute("SELECT size, mtime, sha256, params, result FROM entries WHERE input = ?",
+                                 (input_path,)).fetchone()
+                if row is None:
+                    reason = "new"
+                elif row[3] != self.params:
+                    reason = "parameters changed"
+                elif not self._outputs_exist(json.loads(row[4])):
+                    reason = "output missing"
+                elif row[0] != stat.st_size:
+                    reason = "modified"
+                elif row[1] != stat.st_mtime and file_digests(input_path)["sha256"] != row[2]:
+                    reason = "modified"
+                else:
+                    # Same bytes under a new mtime (copied or touched): just
+                    # refresh the stamp so the next run skips hashing it.
+                    if row[1] != stat.st_mtime and not dry_run:
+                        db.execute("UPDATE entries SET mtime = ? WHERE input = ?", (stat.st_mtime, input_path))
+                    unchanged.append({"input": task[0], "output": task[1], "result": json.loads(row[4]),
+                                      "error": None, "skipped": True})
+                    continue
+                pending.append((task, reason))
+        return pending, unchanged
+
+    def record(self, items, batch_size=500):
+        # Items come from _run_and_fingerprint, whose results carry the input's
+        # (size, mtime, sha256) next to the function's own result.
+        rows = []
+        for item in items:
+            if item["error"] is None:
+                item["result"], (size, mtime, sha256) = item["result"]
+                rows.append((os.path.abspath(item["input"]), size, mtime, sha256, self.params,
+                             json.dumps(item["result"])))
+            if len(rows) >= batch_size:
+                self._store(rows)
+                rows = []
+            yield item
+        self._store(rows)
+
+    def _store(self, rows):
+        if rows:
+            with self._connect() as db:
+                db.executemany("INSERT OR REPLACE INTO entries (input, size, mtime, sha256, params, result) "
+                               "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def run(self, func, tasks, dry_run=False, **batch_options):
+        tasks = list(tasks)
+        pending, unchanged = self.plan(tasks, dry_run)
+        if dry_run:
+            return {
+                "manifest": self.path,
+                "total": len(tasks),
+                "unchanged": len(unchanged),
+                "pending": [{"input": task[0], "output": task[1], "reason": reason} for task, reason in pending],
+            }
+
+        items = {item["input"]: item for item in unchanged}
+        # Recorded while the batch streams, so an interrupted run keeps its
+        # progress; progress is reported once the fingerprint is unpacked.
+        progress = batch_options.pop("progress", None)
+        batch = iter_batch(partial(_run_and_fingerprint, func), [task for task, _ in pending], **batch_options)
+        for done, item in enumerate(self.record(batch), 1):
+            items[item["input"]] = item
+            if progress is not None:
+                progress(done, len(pending), item)
+        return [items[task[0]] for task in tasks]
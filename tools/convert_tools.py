@@ -6,6 +6,7 @@ from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import simpleSplit
 import os
+from tools.batch_utils import BatchManifest, batch_outputs, iter_tasks
 
 class ConvertTools:
     def __init__(self):
@@ -64,43 +65,35 @@ class ConvertTools:
         convert(docx_file, output_path)
         return output_path
 
-    def batch_convert(self, input_dir, output_dir, conversion_type):
-        os.makedirs(output_dir, exist_ok=True)
+    def batch_convert(self, input_dir, output_dir, conversion_type, incremental=False, dry_run=False, recursive=False,
+                      include=None, exclude=None):
+        conversions = {
+            "excel_to_json": (('.xlsx', '.xls'), '.json', self.excel_to_json),
+            "json_to_excel": ('.json', '.xlsx', self.json_to_excel),
+            "csv_to_excel": ('.csv', '.xlsx', self.csv_to_excel),
+            "txt_to_pdf": ('.txt', '.pdf', self.txt_to_pdf),
+            "word_to_pdf": ('.docx', '.pdf', self.word_to_pdf),
+        }
+        if conversion_type not in conversions:
+            return []
+        extensions, output_extension, func = conversions[conversion_type]
+
+        tasks = iter_tasks(input_dir, output_dir, extensions=extensions, extension=output_extension.lstrip('.'),
+                           recursive=recursive, include=include, exclude=exclude, create_dirs=not dry_run)
+        if not dry_run:
+            os.makedirs(output_dir, exist_ok=True)
+
+        if incremental or dry_run:
+            # Converters share process-wide state (docx2pdf drives Word), so the
+            # pending files still run one at a time.
+            items = BatchManifest(output_dir, conversion_type).run(func, tasks, dry_run, max_workers=1,
+                                                                    use_processes=False)
+            return items if dry_run else batch_outputs(items)
+
         results = []
-        
-        for filename in os.listdir(input_dir):
-            input_path = os.path.join(input_dir, filename)
-            
-            if conversion_type == "excel_to_json" and filename.endswith(('.xlsx', '.xls')):
-                output_filename = os.path.splitext(filename)[0] + '.json'
-                output_path = os.path.join(output_dir, output_filename)
-                self.excel_to_json(input_path, output_path)
-                results.append(output_path)
-            
-            elif conversion_type == "json_to_excel" and filename.endswith('.json'):
-                output_filename = os.path.splitext(filename)[0] + '.xlsx'
-                output_path = os.path.join(output_dir, output_filename)
-                self.json_to_excel(input_path, output_path)
-                results.append(output_path)
-            
-            elif conversion_type == "csv_to_excel" and filename.endswith('.csv'):
-                output_filename = os.path.splitext(filename)[0] + '.xlsx'
-                output_path = os.path.join(output_dir, output_filename)
-                self.csv_to_excel(input_path, output_path)
-                results.append(output_path)
-            
-            elif conversion_type == "txt_to_pdf" and filename.endswith('.txt'):
-                output_filename = os.path.splitext(filename)[0] + '.pdf'
-                output_path = os.path.join(output_dir, output_filename)
-                self.txt_to_pdf(input_path, output_path)
-                results.append(output_path)
-            
-            elif conversion_type == "word_to_pdf" and filename.endswith('.docx'):
-                output_filename = os.path.splitext(filename)[0] + '.pdf'
-                output_path = os.path.join(output_dir, output_filename)
-                self.word_to_pdf(input_path, output_path)
-                results.append(output_path)
-        
+        for input_path, output_path, _ in tasks:
+            func(input_path, output_path)
+            results.append(output_path)
         return results
 
     def convert_format(self, input_file, output_path, input_format=None, output_format=None):
@@ -1,109 +1,589 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import ExifTags, Image, ImageDraw, ImageFont, ImageOps, JpegImagePlugin
+import io
+import json
 import os
+import shutil
+import sqlite3
+import struct
+import subprocess
 import piexif
-from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from tools.batch_utils import BatchManifest, batch_outputs, file_digests, iter_batch, iter_files, iter_tasks, \
+    run_batch
+from tools.large_image import DEFAULT_MEMORY_BUDGET, exceeds_budget, open_large, tiled_convert, tiled_resize, \
+    tiled_watermark
+from tools.result_cache import ResultCache, release_output
 
-class ImageTools:
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff')
+
+# preset -> (resampling filter, reducing_gap). A reducing_gap lets Pillow shrink
+# by an integer factor first (in the DCT domain for JPEG via draft) and only run
+# the expensive filter over the last ~gap x reduction. The old thumbnail() path
+# already did this with a gap of 2.0; "exact" (full decode, LANCZOS over every
+# pixel) is the slow, reference-quality option, not the previous behaviour.
+RESAMPLING_PRESETS = {
+    "fast": (Image.Resampling.BILINEAR, 2.0),
+    "balanced": (Image.Resampling.BICUBIC, 2.5),
+    "quality": (Image.Resampling.LANCZOS, 3.0),
+    "exact": (Image.Resampling.LANCZOS, None),
+}
+
+OPTIMIZE_FORMATS = {'JPEG': '.jpg', 'WEBP': '.webp', 'PNG': '.png', 'PNG8': '.png'}
+LOSSY_FORMATS = ('JPEG', 'WEBP')
+
+# SSIM is computed on a downscaled luminance copy; above this size extra pixels
+# barely move the score but cost a lot per bisection step.
+SSIM_MAX_SIDE = 512
+
+
+def _box_mean(values, window=7):
+    import numpy as np
+    total = np.pad(values, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    return (total[window:, window:] - total[:-window, window:] - total[window:, :-window]
+            + total[:-window, :-window]) / (window * window)
+
+
+def _ssim(reference, candidate):
+    import numpy as np
+    a = np.asarray(reference, dtype=np.float64)
+    b = np.asarray(candidate, dtype=np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_a, mu_b = _box_mean(a), _box_mean(b)
+    var_a = _box_mean(a * a) - mu_a ** 2
+    var_b = _box_mean(b * b) - mu_b ** 2
+    covariance = _box_mean(a * b) - mu_a * mu_b
+    ssim = ((2 * mu_a * mu_b + c1) * (2 * covariance + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim.mean())
+
+
+def _ssim_luma(img, size=None):
+    # The reference and every decoded candidate go through this same
+    # downscale; a filter mismatch alone would keep lossless output below 1.0.
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+    luma = img.convert('L')
+    if size is None:
+        ratio = min(1.0, SSIM_MAX_SIDE / max(luma.size))
+        size = (max(1, round(luma.width * ratio)), max(1, round(luma.height * ratio)))
+    if luma.size != size:
+        luma = luma.resize(size, Image.Resampling.BILINEAR)
+    return luma
+
+
+def _encode(img, output_format, quality=None, metadata=None):
+    buffer = io.BytesIO()
+    metadata = metadata or {}
+    if output_format == 'JPEG':
+        img = img if img.mode in ('RGB', 'L') else img.convert('RGB')
+        img.save(buffer, 'JPEG', quality=quality, optimize=True, **metadata)
+    elif output_format == 'WEBP':
+        img.save(buffer, 'WEBP', quality=quality, method=4, **metadata)
+    elif output_format == 'PNG8':
+        img.quantize(256, method=Image.Quantize.FASTOCTREE).save(buffer, 'PNG', optimize=True, **metadata)
+    else:
+        img.save(buffer, 'PNG', optimize=True, **metadata)
+    return buffer.getvalue()
+
+
+def _metadata_params(img, strip_metadata=False):
+    # Save keywords carrying the source metadata over to a re-encode. Stripping
+    # matches strip_jpeg_metadata: the ICC profile and orientation stay.
+    params = {}
+    if img.info.get('icc_profile'):
+        params['icc_profile'] = img.info['icc_profile']
+    if strip_metadata:
+        orientation = img.getexif().get(0x0112, 1)
+        if orientation != 1:
+            exif = Image.Exif()
+            exif[0x0112] = orientation
+            params['exif'] = exif.tobytes()
+    else:
+        for key in ('exif', 'xmp'):
+            if img.info.get(key):
+                params[key] = img.info[key]
+    return params
+
+
+def _encoded_ssim(reference, data):
+    with Image.open(io.BytesIO(data)) as decoded:
+        return _ssim(reference, _ssim_luma(decoded, reference.size))
+
+
+def _search_quality(img, output_format, reference, target_size=None, min_ssim=None, min_quality=20, max_quality=95,
+                    metadata=None):
+    encoded = {}
+
+    def encode(quality):
+        if quality not in encoded:
+            encoded[quality] = _encode(img, output_format, quality, metadata)
+        return encoded[quality]
+
+    # Both properties grow with quality, so each bound is a bisection: the
+    # lowest quality reaching min_ssim and the highest one fitting target_size.
+    chosen = max_quality
+    if min_ssim is not None:
+        low, high = min_quality, max_quality
+        while low < high:
+            middle = (low + high) // 2
+            if _encoded_ssim(reference, encode(middle)) >= min_ssim:
+                high = middle
+            else:
+                low = middle + 1
+        chosen = low
+    if target_size is not None:
+        low, high = min_quality, max_quality
+        while low < high:
+            middle = (low + high + 1) // 2
+            if len(encode(middle)) <= target_size:
+                low = middle
+            else:
+                high = middle - 1
+        chosen = min(chosen, low)
+    return chosen, encode(chosen)
+
+
+def _exif_value(value):
+    if isinstance(value, bytes):
+        return value.hex() if len(value) <= 64 else None
+    if isinstance(value, tuple):
+        return [_exif_value(item) for item in value]
+    if isinstance(value, (int, str)):
+        return value.strip('\x00') if isinstance(value, str) else value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _exif_summary(exif):
+    summary = {}
+    # The base IFD plus the Exif sub-IFD hold the commonly indexed tags
+    # (camera, timestamps, exposure); GPS is kept as its own block.
+    for tags in (exif, exif.get_ifd(ExifTags.IFD.Exif)):
+        for tag, value in tags.items():
+            if tag in (ExifTags.Base.ExifOffset, ExifTags.Base.GPSInfo):
+                continue
+            value = _exif_value(value)
+            if value is not None:
+                summary[ExifTags.TAGS.get(tag, str(tag))] = value
+    gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    if gps:
+        summary["GPSInfo"] = {ExifTags.GPSTAGS.get(tag, str(tag)): _exif_value(value) for tag, value in gps.items()}
+    return summary
+
+
+def _header_exif(img):
+    # PngImageFile.getexif() decodes every pixel to look for an eXIf chunk
+    # after IDAT; for PNG only what Image.open parsed before IDAT is used.
+    if img.format != 'PNG':
+        return img.getexif()
+    exif = Image.Exif()
+    if 'exif' in img.info:
+        exif.load(img.info['exif'])
+    return exif
+
+
+# jpegtran arguments that undo each EXIF orientation in the DCT domain.
+JPEGTRAN_ORIENTATION = {
+    2: ["-flip", "horizontal"],
+    3: ["-rotate", "180"],
+    4: ["-flip", "vertical"],
+    5: ["-transpose"],
+    6: ["-rotate", "90"],
+    7: ["-transverse"],
+    8: ["-rotate", "270"],
+}
+
+
+def _jpegtran(args, data):
+    jpegtran = shutil.which("jpegtran")
+    if jpegtran is None:
+        raise RuntimeError("jpegtran is required for lossless JPEG transforms")
+    return subprocess.run([jpegtran, *args], input=data, capture_output=True, check=True).stdout
+
+
+def _strip_jpeg_segments(data, keep_icc=True):
+    if data[:2] != b'\xff\xd8':
+        raise ValueError("Not a JPEG file")
+    kept = [data[:2]]
+    pos = 2
+    while pos < len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("Corrupt JPEG marker segment")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xDA:
+            kept.append(data[pos:])
+            break
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            kept.append(data[pos:pos + 2])
+            pos += 2
+            continue
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        segment = data[pos:pos + 2 + length]
+        pos += 2 + length
+        # Drop comments and APP1..APP15 (EXIF, XMP, IPTC, vendor blobs) but keep
+        # JFIF (APP0), Adobe (APP14, it defines the colour transform) and, on
+        # request, the ICC profile (APP2) so colours render the same.
+        if marker == 0xFE:
+            continue
+        if 0xE1 <= marker <= 0xEF and marker != 0xEE:
+            if not (marker == 0xE2 and keep_icc and segment[4:16] == b'ICC_PROFILE\x00'):
+                continue
+        kept.append(segment)
+    return b''.join(kept)
+
+
+def _jpeg_orientation(data):
+    try:
+        return piexif.load(data)["0th"].get(piexif.ImageIFD.Orientation, 1)
+    except Exception:
+        return 1
+
+
+def _with_orientation(data, orientation):
+    try:
+        exif = piexif.load(data)
+    except Exception:
+        exif = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+    exif["0th"][piexif.ImageIFD.Orientation] = orientation
+    output = io.BytesIO()
+    piexif.insert(piexif.dump(exif), data, output)
+    return output.getvalue()
+
+
+HASH_ALGORITHMS = ('ahash', 'dhash', 'phash')
+
+
+def _hash_bits(bits):
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _dct_matrix(size):
+    import numpy as np
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def _image_hash(image_path, algorithm='phash'):
+    import numpy as np
+    sizes = {'ahash': (8, 8), 'dhash': (9, 8), 'phash': (32, 32)}
+    with Image.open(image_path) as img:
+        img.draft('L', (sizes[algorithm][0] * 4, sizes[algorithm][1] * 4))
+        pixels = np.asarray(img.convert('L').resize(sizes[algorithm], Image.Resampling.BILINEAR), dtype=np.float64)
+    if algorithm == 'ahash':
+        return _hash_bits(pixels > pixels.mean())
+    if algorithm == 'dhash':
+        return _hash_bits(pixels[:, 1:] > pixels[:, :-1])
+    dct = _dct_matrix(32)
+    low = (dct @ pixels @ dct.T)[:8, :8].flatten()[1:]
+    return _hash_bits(low > np.median(low))
+
+
+def _hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
     def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = (value, item, {})
+            return
+        node = self.root
+        while True:
+            distance = _hamming(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        matches = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = _hamming(value, node_value)
+            if distance <= max_distance:
+                matches.append((distance, item))
+            # Triangle inequality: only subtrees within max_distance of this
+            # node's distance can hold matches.
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return matches
+
+
+# Watermark layers are cached per process, so a batch renders the font, the text
+# sprite and the scaled watermark image once per worker instead of once per file.
+@lru_cache(maxsize=32)
+def _load_font(font_size):
+    try:
+        return ImageFont.truetype("arial.ttf", font_size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=64)
+def _text_layer(text, font_size, opacity):
+    font = _load_font(font_size)
+    left, top, right, bottom = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), text, font=font)
+    layer = Image.new('RGBA', (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+    ImageDraw.Draw(layer).text((-left, -top), text, font=font, fill=(255, 255, 255, opacity))
+    return layer, (left, top)
+
+
+@lru_cache(maxsize=16)
+def _image_layer(watermark_path, mtime, opacity):
+    with Image.open(watermark_path) as watermark:
+        watermark = watermark.convert('RGBA')
+        watermark = watermark.resize((int(watermark.width * 0.3), int(watermark.height * 0.3)))
+    alpha = watermark.getchannel('A').point(lambda p: int(p * opacity))
+    watermark.putalpha(alpha)
+    return watermark
+
+
+class ImageTools:
+    def __init__(self, cache=None, memory_budget=DEFAULT_MEMORY_BUDGET):
         self.supported_formats = ['PNG', 'JPG', 'JPEG', 'WEBP', 'BMP', 'TIFF']
+        self.cache = ResultCache(cache) if isinstance(cache, str) else cache
+        # Images whose decoded raster would exceed this many bytes are processed
+        # in horizontal bands (see tools.large_image); None disables the guard.
+        self.memory_budget = memory_budget
+
+    def _oversized(self, input_path):
+        return bool(self.memory_budget) and exceeds_budget(input_path, self.memory_budget)
 
     def convert_image(self, input_path, output_path, output_format):
+        if self._oversized(input_path):
+            return tiled_convert(input_path, output_path, output_format, self.memory_budget)
         with Image.open(input_path) as img:
             if output_format.upper() == 'JPG' and img.mode in ('RGBA', 'LA'):
                 img = img.convert('RGB')
             img.save(output_path, format=output_format.upper())
         return output_path
 
-    def batch_convert(self, input_dir, output_dir, output_format):
-        os.makedirs(output_dir, exist_ok=True)
-        results = []
-        
-        for filename in os.listdir(input_dir):
-            if filename.lower().endswith(tuple(['.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff'])):
-                input_path = os.path.join(input_dir, filename)
-                output_filename = os.path.splitext(filename)[0] + f'.{output_format.lower()}'
-                output_path = os.path.join(output_dir, output_filename)
-                self.convert_image(input_path, output_path, output_format)
-                results.append(output_path)
-        
-        return results
-
-    def resize_image(self, input_path, output_path, size, maintain_aspect=True):
+    def _batch_tasks(self, input_dir, output_dir, args=(), extension=None, skip_duplicates=False, recursive=False,
+                     include=None, exclude=None, dry_run=False):
+        duplicates = set()
+        if skip_duplicates:
+            # Keep the first file of each near-duplicate group and skip the rest.
+            for group in self.find_duplicates(input_dir, recursive=recursive, include=include, exclude=exclude):
+                duplicates.update(group[1:])
+        tasks = iter_tasks(input_dir, output_dir, args, IMAGE_EXTENSIONS, extension, recursive, include, exclude,
+                           duplicates, create_dirs=not dry_run)
+        if not dry_run:
+            os.makedirs(output_dir, exist_ok=True)
+        return tasks
+
+    def _run_batch(self, func, tasks, max_workers=None, chunksize=8, progress=None, return_details=False,
+                   output_dir=None, incremental=False, dry_run=False, params=None):
+        if incremental or dry_run:
+            # Every task of a batch shares the same args, so unless the caller
+            # has a better fingerprint they double as the manifest parameters.
+            tasks = list(tasks)
+            if params is None:
+                params = tasks[0][2] if tasks else ()
+            manifest = BatchManifest(output_dir, func.__name__, params)
+            items = manifest.run(func, tasks, dry_run, max_workers=max_workers, chunksize=chunksize,
+                                 progress=progress)
+            if dry_run:
+                return items
+        else:
+            items = run_batch(func, tasks, max_workers=max_workers, chunksize=chunksize, progress=progress)
+        return batch_outputs(items, return_details)
+
+    def batch_convert(self, input_dir, output_dir, output_format, max_workers=None, chunksize=8, progress=None,
+                      return_details=False, skip_duplicates=False, incremental=False, dry_run=False, recursive=False,
+                      include=None, exclude=None):
+        tasks = self._batch_tasks(input_dir, output_dir, (output_format,), output_format.lower(), skip_duplicates,
+                                  recursive, include, exclude, dry_run)
+        return self._run_batch(self.convert_image, tasks, max_workers, chunksize, progress, return_details,
+                               output_dir, incremental, dry_run)
+
+    def resize_image(self, input_path, output_path, size, maintain_aspect=True, preset="quality"):
+        if preset not in RESAMPLING_PRESETS:
+            raise ValueError(f"Unsupported resampling preset: {preset}")
+        resample, reducing_gap = RESAMPLING_PRESETS[preset]
+
+        if self._oversized(input_path):
+            with open_large(input_path) as img:
+                target = self._target_size(img.size, size, maintain_aspect)
+            return tiled_resize(input_path, output_path, target, resample, reducing_gap, self.memory_budget)
+
         with Image.open(input_path) as img:
-            if maintain_aspect:
-                img.thumbnail(size, Image.Resampling.LANCZOS)
-            else:
-                img = img.resize(size, Image.Resampling.LANCZOS)
-            img.save(output_path)
+            target = self._target_size(img.size, size, maintain_aspect)
+            if target == img.size:
+                img.save(output_path)
+                return output_path
+            if reducing_gap and img.format == 'JPEG':
+                img.draft(img.mode, (int(target[0] * reducing_gap), int(target[1] * reducing_gap)))
+            resized = img.resize(target, resample, reducing_gap=reducing_gap)
+            resized.save(output_path)
         return output_path
 
-    def batch_resize(self, input_dir, output_dir, size, maintain_aspect=True):
-        os.makedirs(output_dir, exist_ok=True)
-        results = []
-        
-        for filename in os.listdir(input_dir):
-            if filename.lower().endswith(tuple(['.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff'])):
-                input_path = os.path.join(input_dir, filename)
-                output_path = os.path.join(output_dir, filename)
-                self.resize_image(input_path, output_path, size, maintain_aspect)
-                results.append(output_path)
-        
-        return results
+    def _target_size(self, source, size, maintain_aspect=True):
+        if not maintain_aspect:
+            return tuple(size)
+        # Same rule as Image.thumbnail: fit inside size, never upscale.
+        scale = min(size[0] / source[0], size[1] / source[1], 1)
+        return max(1, round(source[0] * scale)), max(1, round(source[1] * scale))
+
+    def batch_resize(self, input_dir, output_dir, size, maintain_aspect=True, max_workers=None, chunksize=8,
+                     progress=None, return_details=False, preset="quality", incremental=False, dry_run=False,
+                     recursive=False, include=None, exclude=None):
+        tasks = self._batch_tasks(input_dir, output_dir, (size, maintain_aspect, preset), recursive=recursive,
+                                  include=include, exclude=exclude, dry_run=dry_run)
+        return self._run_batch(self.resize_image, tasks, max_workers, chunksize, progress, return_details,
+                               output_dir, incremental, dry_run)
 
     def add_text_watermark(self, input_path, output_path, text, position=(50, 50), opacity=128, font_size=36):
+        if self._oversized(input_path):
+            layer, offset = _text_layer(text, font_size, opacity)
+            position = (position[0] + offset[0], position[1] + offset[1])
+            return tiled_watermark(input_path, output_path, layer, position, self.memory_budget)
         with Image.open(input_path) as img:
-            watermark = Image.new('RGBA', img.size, (0, 0, 0, 0))
-            draw = ImageDraw.Draw(watermark)
-            
-            try:
-                font = ImageFont.truetype("arial.ttf", font_size)
-            except:
-                font = ImageFont.load_default()
-            
-            bbox = draw.textbbox((0, 0), text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            
-            x = position[0]
-            y = position[1]
-            
-            draw.text((x, y), text, font=font, fill=(255, 255, 255, opacity))
-            
-            watermarked = Image.alpha_composite(img.convert('RGBA'), watermark)
-            watermarked.save(output_path)
+            watermarked = self._apply_text_watermark(img, text, position, opacity, font_size)
+            self._save_image(watermarked, output_path)
         return output_path
 
+    def _apply_text_watermark(self, img, text, position=(50, 50), opacity=128, font_size=36):
+        layer, offset = _text_layer(text, font_size, opacity)
+        return self._composite_layer(img, layer, (position[0] + offset[0], position[1] + offset[1]))
+
     def add_image_watermark(self, input_path, output_path, watermark_path, position=(50, 50), opacity=0.5):
+        if self._oversized(input_path):
+            layer = _image_layer(watermark_path, os.path.getmtime(watermark_path), opacity)
+            return tiled_watermark(input_path, output_path, layer, position, self.memory_budget)
         with Image.open(input_path) as img:
-            with Image.open(watermark_path) as watermark:
-                watermark = watermark.convert('RGBA')
-                watermark = watermark.resize((int(watermark.width * 0.3), int(watermark.height * 0.3)))
-                
-                alpha = watermark.split()[-1]
-                alpha = alpha.point(lambda p: int(p * opacity))
-                watermark.putalpha(alpha)
-                
-                img.paste(watermark, position, watermark)
-                img.save(output_path)
+            watermarked = self._apply_image_watermark(img, watermark_path, position, opacity)
+            self._save_image(watermarked, output_path)
         return output_path
 
-    def batch_add_watermark(self, input_dir, output_dir, watermark_type, watermark_data, position=(50, 50), opacity=128):
+    def _apply_image_watermark(self, img, watermark_path, position=(50, 50), opacity=0.5):
+        layer = _image_layer(watermark_path, os.path.getmtime(watermark_path), opacity)
+        return self._composite_layer(img, layer, position)
+
+    def _composite_layer(self, img, layer, position):
+        # Blends only the layer's bounding box into img (in place when the mode
+        # allows) rather than compositing a full-size overlay.
+        if img.mode not in ('RGB', 'RGBA'):
+            has_alpha = img.mode in ('LA', 'PA') or 'transparency' in img.info
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+        x, y = int(position[0]), int(position[1])
+        if img.mode == 'RGBA' and x >= 0 and y >= 0:
+            img.alpha_composite(layer, (x, y))
+        else:
+            img.paste(layer, (x, y), layer)
+        return img
+
+    def _save_image(self, img, output_path, output_format=None, quality=None, optimize=False):
+        if output_format:
+            output_format = output_format.upper().replace('JPG', 'JPEG')
+        else:
+            output_format = Image.registered_extensions().get(os.path.splitext(output_path)[1].lower())
+        if output_format == 'JPEG' and img.mode not in ('RGB', 'L', 'CMYK'):
+            img = img.convert('RGB')
+
+        params = {}
+        if quality is not None and output_format in ('JPEG', 'WEBP'):
+            params['quality'] = quality
+        if optimize and output_format in ('JPEG', 'PNG'):
+            params['optimize'] = True
+        img.save(output_path, format=output_format, **params)
+        return output_path
+
+    def render_renditions(self, input_path, output_dir, renditions):
         os.makedirs(output_dir, exist_ok=True)
-        results = []
-        
-        for filename in os.listdir(input_dir):
-            if filename.lower().endswith(tuple(['.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff'])):
-                input_path = os.path.join(input_dir, filename)
-                output_path = os.path.join(output_dir, filename)
-                
-                if watermark_type == "text":
-                    self.add_text_watermark(input_path, output_path, watermark_data, position, opacity)
-                elif watermark_type == "image":
-                    self.add_image_watermark(input_path, output_path, watermark_data, position, opacity/255.0)
-                
-                results.append(output_path)
-        
-        return results
+        stem = os.path.splitext(os.path.basename(input_path))[0]
+        outputs = []
+
+        with Image.open(input_path) as img:
+            source_format = img.format
+            targets = []
+            for rendition in renditions:
+                size = rendition.get('size')
+                targets.append(self._target_size(img.size, size, rendition.get('maintain_aspect', True)) if size else img.size)
+
+            # Decode once, at the smallest DCT scale that still serves the largest rendition.
+            presets = [RESAMPLING_PRESETS[rendition.get('preset', 'quality')] for rendition in renditions]
+            gaps = [gap for _, gap in presets]
+            if source_format == 'JPEG' and all(gaps):
+                gap = max(gaps)
+                img.draft(img.mode, (int(max(t[0] for t in targets) * gap), int(max(t[1] for t in targets) * gap)))
+            img.load()
+
+            for rendition, target, (resample, reducing_gap) in zip(renditions, targets, presets):
+                output = img if target == img.size else img.resize(target, resample, reducing_gap=reducing_gap)
+
+                watermark = rendition.get('watermark')
+                if watermark and output is img:
+                    output = img.copy()
+                if watermark and 'text' in watermark:
+                    output = self._apply_text_watermark(output, watermark['text'], watermark.get('position', (50, 50)),
+                                                        watermark.get('opacity', 128), watermark.get('font_size', 36))
+                elif watermark and 'image' in watermark:
+                    output = self._apply_image_watermark(output, watermark['image'], watermark.get('position', (50, 50)),
+                                                         watermark.get('opacity', 0.5))
+
+                output_format = rendition.get('format', source_format)
+                extension = 'jpg' if output_format.upper() in ('JPEG', 'JPG') else output_format.lower()
+                name = rendition.get('name', f'{target[0]}x{target[1]}')
+                output_path = os.path.join(output_dir, f'{stem}_{name}.{extension}')
+                self._save_image(output, output_path, output_format, rendition.get('quality'),
+                                 rendition.get('optimize', True))
+                outputs.append(output_path)
+        return outputs
+
+    def batch_render_renditions(self, input_dir, output_dir, renditions, max_workers=None, chunksize=8, progress=None,
+                                return_details=False, incremental=False, dry_run=False, recursive=False, include=None,
+                                exclude=None):
+        # render_renditions writes into a directory, so tasks get the mirrored
+        # parent directory rather than a file path.
+        tasks = ((input_path, os.path.dirname(output_path), args) for input_path, output_path, args
+                 in iter_tasks(input_dir, output_dir, (renditions,), IMAGE_EXTENSIONS, None, recursive, include,
+                               exclude, create_dirs=not dry_run))
+        if not dry_run:
+            os.makedirs(output_dir, exist_ok=True)
+        items = self._run_batch(self.render_renditions, tasks, max_workers, chunksize, progress, True, output_dir,
+                                incremental, dry_run)
+        if return_details or dry_run:
+            return items
+        return [path for item in items if item["error"] is None for path in item["result"]]
+
+    def batch_add_watermark(self, input_dir, output_dir, watermark_type, watermark_data, position=(50, 50), opacity=128,
+                            max_workers=None, chunksize=8, progress=None, return_details=False, incremental=False,
+                            dry_run=False, recursive=False, include=None, exclude=None):
+        # Layers are built here first so forked workers inherit them ready-made.
+        params = None
+        if watermark_type == "text":
+            func = self.add_text_watermark
+            _text_layer(watermark_data, 36, opacity)
+            tasks = self._batch_tasks(input_dir, output_dir, (watermark_data, position, opacity), recursive=recursive,
+                                      include=include, exclude=exclude, dry_run=dry_run)
+        elif watermark_type == "image":
+            func = self.add_image_watermark
+            _image_layer(watermark_data, os.path.getmtime(watermark_data), opacity/255.0)
+            tasks = self._batch_tasks(input_dir, output_dir, (watermark_data, position, opacity/255.0),
+                                      recursive=recursive, include=include, exclude=exclude, dry_run=dry_run)
+            # The manifest fingerprints the watermark by content, not by path.
+            if incremental or dry_run:
+                params = (file_digests(watermark_data)["sha256"], position, opacity/255.0)
+        else:
+            raise ValueError(f"Unsupported watermark type: {watermark_type}")
+        return self._run_batch(func, tasks, max_workers, chunksize, progress, return_details, output_dir, incremental,
+                               dry_run, params)
 
     def get_image_info(self, image_path):
         with Image.open(image_path) as img:
@@ -126,25 +606,289 @@ class ImageTools:
             
             return info
 
-    def optimize_image(self, input_path, output_path, quality=85):
+    def strip_jpeg_metadata(self, input_path, output_path, keep_icc=True, keep_orientation=True):
+        with open(input_path, 'rb') as f:
+            data = f.read()
+        orientation = _jpeg_orientation(data) if keep_orientation else 1
+        data = _strip_jpeg_segments(data, keep_icc)
+        if orientation != 1:
+            # A bare Orientation tag keeps the image displaying the right way up.
+            exif = piexif.dump({"0th": {piexif.ImageIFD.Orientation: orientation}})
+            output = io.BytesIO()
+            piexif.insert(exif, data, output)
+            data = output.getvalue()
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        return output_path
+
+    def rewrite_jpeg_exif(self, input_path, output_path, exif_dict):
+        with open(input_path, 'rb') as f:
+            data = f.read()
+        output = io.BytesIO()
+        piexif.insert(piexif.dump(exif_dict), data, output)
+        with open(output_path, 'wb') as f:
+            f.write(output.getvalue())
+        return output_path
+
+    def normalize_jpeg_orientation(self, input_path, output_path, allow_reencode=False):
+        with open(input_path, 'rb') as f:
+            data = f.read()
+        orientation = _jpeg_orientation(data)
+        if orientation in JPEGTRAN_ORIENTATION:
+            try:
+                data = _jpegtran(["-copy", "all", "-perfect", *JPEGTRAN_ORIENTATION[orientation]], data)
+                data = _with_orientation(data, 1)
+            except (RuntimeError, subprocess.CalledProcessError):
+                if not allow_reencode:
+                    raise
+                # Without jpegtran (or when the size is not MCU aligned) fall back
+                # to re-encoding with the source's own tables and subsampling.
+                with Image.open(io.BytesIO(data)) as img:
+                    transposed = ImageOps.exif_transpose(img)
+                    output = io.BytesIO()
+                    transposed.save(output, 'JPEG', qtables=img.quantization,
+                                    subsampling=JpegImagePlugin.get_sampling(img),
+                                    exif=transposed.getexif().tobytes(), icc_profile=img.info.get('icc_profile'))
+                    data = output.getvalue()
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        return output_path
+
+    def crop_jpeg_lossless(self, input_path, output_path, box, allow_reencode=False):
+        with Image.open(input_path) as img:
+            if img.format != 'JPEG':
+                raise ValueError("Lossless crop requires a JPEG input")
+            # Crops can only start on an MCU boundary (8px times the largest
+            # sampling factor), so the origin is snapped up-left to the grid.
+            mcu_w = 8 * max(layer[1] for layer in img.layer)
+            mcu_h = 8 * max(layer[2] for layer in img.layer)
+            left, top = box[0] - box[0] % mcu_w, box[1] - box[1] % mcu_h
+            right, bottom = min(box[2], img.width), min(box[3], img.height)
+            try:
+                with open(input_path, 'rb') as f:
+                    data = _jpegtran(["-copy", "all", "-crop", f"{right - left}x{bottom - top}+{left}+{top}"], f.read())
+            except (RuntimeError, subprocess.CalledProcessError):
+                if not allow_reencode:
+                    raise
+                # Re-encoding has no MCU grid to respect, so it crops the exact box.
+                output = io.BytesIO()
+                img.crop((box[0], box[1], right, bottom)).save(output, 'JPEG', qtables=img.quantization,
+                                                               subsampling=JpegImagePlugin.get_sampling(img),
+                                                               exif=img.info.get('exif', b''),
+                                                               icc_profile=img.info.get('icc_profile'))
+                data = output.getvalue()
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        return output_path
+
+    def _hash_one(self, image_path, _output_path=None, algorithm='phash'):
+        return _image_hash(image_path, algorithm)
+
+    def compute_hashes(self, image_paths, algorithm='phash', cache_path=None, max_workers=None):
+        if algorithm not in HASH_ALGORITHMS:
+            raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+        hashes = {}
+        stats = {}
+        db = None
+        if cache_path:
+            db = sqlite3.connect(cache_path)
+            db.execute("CREATE TABLE IF NOT EXISTS image_hashes (path TEXT, algorithm TEXT, size INTEGER, mtime REAL, "
+                       "hash TEXT, PRIMARY KEY (path, algorithm))")
+
+        pending = []
+        for path in image_paths:
+            stat = os.stat(path)
+            stats[path] = (stat.st_size, stat.st_mtime)
+            if db is not None:
+                row = db.execute("SELECT size, mtime, hash FROM image_hashes WHERE path = ? AND algorithm = ?",
+                                 (os.path.abspath(path), algorithm)).fetchone()
+                if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                    hashes[path] = int(row[2], 16)
+                    continue
+            pending.append((path, None, (algorithm,)))
+
+        for item in run_batch(self._hash_one, pending, max_workers=max_workers, chunksize=32):
+            if item["error"] is not None:
+                continue
+            hashes[item["input"]] = item["result"]
+            if db is not None:
+                size, mtime = stats[item["input"]]
+                db.execute("INSERT OR REPLACE INTO image_hashes VALUES (?, ?, ?, ?, ?)",
+                           (os.path.abspath(item["input"]), algorithm, size, mtime, f'{item["result"]:016x}'))
+        if db is not None:
+            db.commit()
+            db.close()
+        return hashes
+
+    def find_duplicates(self, input_dir, threshold=5, algorithm='phash', cache_path=None, max_workers=None,
+                        recursive=False, include=None, exclude=None):
+        paths = [entry.path for entry in iter_files(input_dir, IMAGE_EXTENSIONS, recursive, include, exclude)]
+        hashes = self.compute_hashes(paths, algorithm, cache_path, max_workers)
+
+        tree = BKTree()
+        parent = {}
+
+        def find(path):
+            while parent[path] != path:
+                parent[path] = parent[parent[path]]
+                path = parent[path]
+            return path
+
+        # Each image is only compared against those already indexed; matches are
+        # merged with union-find so chains of near-duplicates end up in one group.
+        for path in paths:
+            if path not in hashes:
+                continue
+            parent[path] = path
+            for _, match in tree.search(hashes[path], threshold):
+                root_a, root_b = find(path), find(match)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+            tree.add(hashes[path], path)
+
+        groups = {}
+        for path in parent:
+            groups.setdefault(find(path), []).append(path)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+
+    def _scan_metadata(self, image_path, _output_path=None, include_exif=True):
+        # Stat here rather than in the walk: on Linux DirEntry.stat() is a
+        # syscall too, and the worker threads can overlap it with the reads.
+        stat = os.stat(image_path)
+        # Image.open only parses the header (and, for JPEG, the APP segments
+        # holding EXIF); pixel data is never decoded here.
+        with Image.open(image_path) as img:
+            record = {
+                "path": image_path,
+                "format": img.format,
+                "mode": img.mode,
+                "width": img.width,
+                "height": img.height,
+                "size_bytes": stat.st_size,
+                "mtime": stat.st_mtime,
+            }
+            if 'dpi' in img.info:
+                record["dpi"] = [float(value) for value in img.info['dpi']]
+            if include_exif:
+                record["exif"] = _exif_summary(_header_exif(img))
+        return record
+
+    def scan_metadata(self, root, recursive=True, include_exif=True, max_workers=32, chunksize=64, include=None,
+                      exclude=None):
+        tasks = ((entry.path, None, (include_exif,))
+                 for entry in iter_files(root, IMAGE_EXTENSIONS, recursive, include, exclude))
+        for item in iter_batch(self._scan_metadata, tasks, max_workers=max_workers, chunksize=chunksize,
+                               use_processes=False):
+            yield item["result"] if item["error"] is None else {"path": item["input"], "error": item["error"]}
+
+    def scan_metadata_ndjson(self, root, output_path, recursive=True, include_exif=True, max_workers=32):
+        count = 0
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for record in self.scan_metadata(root, recursive, include_exif, max_workers):
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+        return count
+
+    def optimize_image(self, input_path, output_path, quality=85, target_size=None, min_ssim=None, formats=None,
+                       strip_metadata=False):
+        if self.cache is not None:
+            cache_key = self.cache.make_key("optimize_image", input_path, {
+                "quality": quality, "extension": os.path.splitext(output_path)[1].lower(),
+                "target_size": target_size, "min_ssim": min_ssim, "formats": formats,
+                "strip_metadata": strip_metadata})
+            cached = self.cache.get_file(cache_key, output_path)
+            if cached is not None:
+                if cached.get("extension"):
+                    final_path = os.path.splitext(output_path)[0] + cached["extension"]
+                    os.replace(output_path, final_path)
+                    return final_path
+                return output_path
+
+        release_output(output_path)
         with Image.open(input_path) as img:
-            if img.format == 'JPEG':
-                img.save(output_path, 'JPEG', quality=quality, optimize=True)
-            elif img.format == 'PNG':
-                img.save(output_path, 'PNG', optimize=True)
+            lossless = (quality in (None, 'keep') and img.format == 'JPEG' and target_size is None
+                        and min_ssim is None and not formats
+                        and os.path.splitext(output_path)[1].lower() in ('.jpg', '.jpeg'))
+            if lossless:
+                final_path = self._optimize_jpeg_lossless(input_path, output_path, strip_metadata)
+            elif target_size is None and min_ssim is None and not formats:
+                metadata = _metadata_params(img, strip_metadata)
+                if img.format == 'JPEG':
+                    img.save(output_path, 'JPEG', quality=quality if quality is not None else 'keep', optimize=True,
+                             **metadata)
+                elif img.format == 'PNG':
+                    img.save(output_path, 'PNG', optimize=True, **metadata)
+                else:
+                    img.save(output_path, optimize=True, **metadata)
+                final_path = output_path
             else:
-                img.save(output_path, optimize=True)
+                final_path = self._optimize_adaptive(img, output_path, target_size, min_ssim, formats,
+                                                     _metadata_params(img, strip_metadata))
+
+        if self.cache is not None:
+            metadata = {"extension": os.path.splitext(final_path)[1]} if final_path != output_path else None
+            self.cache.put_file(cache_key, final_path, metadata)
+        return final_path
+
+    def _optimize_jpeg_lossless(self, input_path, output_path, strip_metadata=False):
+        # No pixel changes were requested, so the entropy-coded data is kept as
+        # is: metadata is cut at the byte level and, when jpegtran exists, the
+        # Huffman tables are re-optimised losslessly.
+        if strip_metadata:
+            self.strip_jpeg_metadata(input_path, output_path)
+        elif os.path.abspath(input_path) != os.path.abspath(output_path):
+            shutil.copyfile(input_path, output_path)
+        if shutil.which("jpegtran"):
+            with open(output_path, 'rb') as f:
+                data = _jpegtran(["-copy", "all", "-optimize"], f.read())
+            with open(output_path, 'wb') as f:
+                f.write(data)
         return output_path
 
-    def batch_optimize(self, input_dir, output_dir, quality=85):
-        os.makedirs(output_dir, exist_ok=True)
-        results = []
-        
-        for filename in os.listdir(input_dir):
-            if filename.lower().endswith(tuple(['.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff'])):
-                input_path = os.path.join(input_dir, filename)
-                output_path = os.path.join(output_dir, filename)
-                self.optimize_image(input_path, output_path, quality)
-                results.append(output_path)
-        
-        return results
\ No newline at end of file
+    def _optimize_adaptive(self, img, output_path, target_size=None, min_ssim=None, formats=None, metadata=None):
+        if not formats:
+            formats = [{'JPG': 'JPEG'}.get(img.format, img.format) or 'JPEG']
+        formats = [{'JPG': 'JPEG'}.get(f.upper(), f.upper()) for f in formats]
+        if img.mode not in ('RGB', 'RGBA', 'L'):
+            img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+        has_alpha = img.mode == 'RGBA' and img.getchannel('A').getextrema()[0] < 255
+        reference = _ssim_luma(img)
+
+        candidates = []
+        for output_format in formats:
+            if output_format not in OPTIMIZE_FORMATS:
+                raise ValueError(f"Unsupported output format: {output_format}")
+            if output_format == 'JPEG' and has_alpha:
+                continue
+            if output_format in LOSSY_FORMATS:
+                _, data = _search_quality(img, output_format, reference, target_size, min_ssim, metadata=metadata)
+                passes_ssim = min_ssim is None or _encoded_ssim(reference, data) >= min_ssim
+            else:
+                data = _encode(img, output_format, metadata=metadata)
+                passes_ssim = output_format == 'PNG' or min_ssim is None or _encoded_ssim(reference, data) >= min_ssim
+            fits = target_size is None or len(data) <= target_size
+            candidates.append((not (passes_ssim and fits), len(data), output_format, data))
+        if not candidates:
+            raise ValueError("No output format can represent this image")
+
+        # Prefer candidates meeting every constraint, then the smallest file.
+        _, _, output_format, data = min(candidates, key=lambda candidate: candidate[:2])
+        extension = OPTIMIZE_FORMATS[output_format]
+        final_path = output_path
+        current = os.path.splitext(output_path)[1].lower()
+        if current != extension and not (extension == '.jpg' and current == '.jpeg'):
+            final_path = os.path.splitext(output_path)[0] + extension
+            release_output(final_path)
+        with open(final_path, 'wb') as f:
+            f.write(data)
+        return final_path
+
+    def batch_optimize(self, input_dir, output_dir, quality=85, max_workers=None, chunksize=8, progress=None,
+                       return_details=False, target_size=None, min_ssim=None, formats=None, strip_metadata=False,
+                       skip_duplicates=False, incremental=False, dry_run=False, recursive=False, include=None,
+                       exclude=None):
+        tasks = self._batch_tasks(input_dir, output_dir, (quality, target_size, min_ssim, formats, strip_metadata),
+                                  skip_duplicates=skip_duplicates, recursive=recursive, include=include,
+                                  exclude=exclude, dry_run=dry_run)
+        return self._run_batch(self.optimize_image, tasks, max_workers, chunksize, progress, return_details,
+                               output_dir, incremental, dry_run)
\ No newline at end of file
@@ -0,0 +1,578 @@
+import contextlib
+import io
+import math
+import os
+import struct
+import warnings
+import zlib
+
+from PIL import Image
+
+DEFAULT_MEMORY_BUDGET = 512 * 1024 ** 2
+
+# Bytes Pillow actually allocates per pixel (RGB is stored padded to 4 bytes).
+BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'LA': 4, 'PA': 4, 'RGB': 4, 'RGBA': 4, 'CMYK': 4,
+                   'YCbCr': 4, 'I': 4, 'F': 4}
+
+STREAMING_FORMATS = ('PNG', 'TIFF')
+
+
+@contextlib.contextmanager
+def _unbounded_pixels():
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        yield
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+
+def open_large(path):
+    with _unbounded_pixels():
+        return Image.open(path)
+
+
+def decoded_size(img):
+    return img.width * img.height * BYTES_PER_PIXEL.get(img.mode, 4)
+
+
+def exceeds_budget(path, memory_budget):
+    try:
+        with Image.open(path) as img:
+            return decoded_size(img) > memory_budget
+    except Image.DecompressionBombError:
+        return True
+
+
+def _band_rows(width, mode, memory_budget, copies=4):
+    # A band is held a few times over (source, converted copy, encoder input).
+    return max(16, memory_budget // (width * BYTES_PER_PIXEL.get(mode, 4) * copies))
+
+
+def _stream_mode(mode, output_format):
+    if output_format == 'JPEG':
+        return 'L' if mode in ('1', 'L') else 'RGB'
+    if mode in ('L', 'LA', 'RGB', 'RGBA'):
+        return mode
+    if mode in ('1', 'I;16', 'I', 'F'):
+        return 'L'
+    return 'RGBA' if mode in ('PA', 'P') else 'RGB'
+
+
+class _RawStrips:
+    # Uncompressed layouts (raw TIFF, BMP, PPM) are read band by band straight
+    # from the file, so only the requested rows are ever in memory.
+    def __init__(self, img, path):
+        self.width, self.height, self.mode = img.width, img.height, img.mode
+        self.tiles = []
+        for tile in img.tile:
+            args = tile[3] if isinstance(tile[3], tuple) else (tile[3],)
+            rawmode = args[0]
+            stride = args[1] if len(args) > 1 and args[1] else len(
+                Image.new(self.mode, (self.width, 1)).tobytes('raw', rawmode))
+            orientation = args[2] if len(args) > 2 else 1
+            self.tiles.append((tile[1][1], tile[1][3], tile[2], rawmode, stride, orientation))
+        # Palette and transparency are file-level; every band needs its own copy.
+        self.palette = img.palette if self.mode in ('P', 'PA') else None
+        self.transparency = img.info.get('transparency')
+        self.file = open(path, 'rb')
+
+    @staticmethod
+    def supports(img):
+        return bool(img.tile) and all(
+            tile[0] == 'raw' and tile[1][0] == 0 and tile[1][2] == img.width for tile in img.tile)
+
+    def read(self, y0, y1):
+        band = Image.new(self.mode, (self.width, y1 - y0))
+        if self.palette is not None:
+            band.putpalette(self.palette)
+        if self.transparency is not None:
+            band.info['transparency'] = self.transparency
+        for top, bottom, offset, rawmode, stride, orientation in self.tiles:
+            start, stop = max(y0, top), min(y1, bottom)
+            if start >= stop:
+                continue
+            if orientation < 0:
+                self.file.seek(offset + (bottom - stop) * stride)
+            else:
+                self.file.seek(offset + (start - top) * stride)
+            data = self.file.read((stop - start) * stride)
+            part = Image.frombuffer(self.mode, (self.width, stop - start), data, 'raw', rawmode, stride, orientation)
+            band.paste(part, (0, start - y0))
+        return band
+
+    def close(self):
+        self.file.close()
+
+
+class _VipsStrips:
+    def __init__(self, path):
+        import pyvips
+        image = pyvips.Image.new_from_file(path, access='sequential')
+        if image.format == 'ushort':
+            image = (image >> 8).cast('uchar')
+        elif image.format != 'uchar':
+            image = image.cast('uchar')
+        self.image = image
+        self.width, self.height = image.width, image.height
+        self.mode = {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}[min(image.bands, 4)]
+
+    def read(self, y0, y1):
+        region = self.image.crop(0, y0, self.width, y1 - y0)
+        return Image.frombytes(self.mode, (self.width, y1 - y0), region.write_to_memory())
+
+    def close(self):
+        self.image = None
+
+
+class _SequentialStrips:
+    # Shared band logic for decoders that can only move forward: the last
+    # band is kept so overlapping reads (tiled_resize margins) are served from
+    # it, skipped rows are decoded and dropped, and going further back rewinds.
+    def _start(self):
+        self.row = 0
+        self.kept = None
+        self._rewind()
+
+    def read(self, y0, y1):
+        kept_top = self.row - (self.kept.height if self.kept is not None else 0)
+        if y0 < kept_top:
+            self._start()
+            kept_top = 0
+        pieces = []
+        if self.kept is not None and y0 < self.row:
+            pieces.append((y0, self.kept.crop((0, y0 - kept_top, self.width, min(y1, self.row) - kept_top))))
+        while self.row < y0:
+            self.kept = self._decode(min(y0 - self.row, y1 - y0))
+        if self.row < y1:
+            start = self.row
+            self.kept = self._decode(y1 - self.row)
+            pieces.append((start, self.kept))
+        if len(pieces) == 1 and pieces[0][1].height == y1 - y0:
+            return pieces[0][1]
+        band = pieces[0][1].crop((0, 0, self.width, y1 - y0))
+        for top, piece in pieces[1:]:
+            band.paste(piece, (0, top - y0))
+        return band
+
+
+_PNG_MODES = {(1, 0): ('1', '1'), (8, 0): ('L', 'L'), (16, 0): ('I;16', 'I;16B'), (8, 2): ('RGB', 'RGB'),
+              (1, 3): ('P', 'P;1'), (2, 3): ('P', 'P;2'), (4, 3): ('P', 'P;4'), (8, 3): ('P', 'P'),
+              (8, 4): ('LA', 'LA'), (8, 6): ('RGBA', 'RGBA')}
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+class _PNGStrips(_SequentialStrips):
+    # Compressed PNG without pyvips. IDAT is inflated incrementally and each
+    # band is re-wrapped as a small stored (uncompressed) PNG for Pillow to
+    # unfilter; the band is led by the previous band's last row so the
+    # Up/Average/Paeth filters of its first row have their reference.
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self._parse_header()
+        except Exception:
+            self.file.close()
+            raise
+        self._start()
+
+    def _parse_header(self):
+        if self.file.read(8) != _PNG_SIGNATURE:
+            raise ValueError("Not a PNG file")
+        self.extra_chunks = b''
+        header = None
+        while True:
+            length, chunk_type = struct.unpack('>I4s', self.file.read(8))
+            if chunk_type in (b'IDAT', b'IEND'):
+                self.idat_offset = self.file.tell() - 8
+                break
+            data = self.file.read(length)
+            self.file.seek(4, os.SEEK_CUR)
+            if chunk_type == b'IHDR':
+                header = data
+            elif chunk_type in (b'PLTE', b'tRNS'):
+                self.extra_chunks += _png_chunk(chunk_type, data)
+        self.width, self.height, depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', header)
+        if interlace or (depth, color_type) not in _PNG_MODES:
+            raise ValueError(f"Unsupported PNG layout for streaming: depth {depth}, color type {color_type}")
+        self.mode, self.rawmode = _PNG_MODES[(depth, color_type)]
+        self.header = header
+        channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[color_type]
+        self.row_bytes = (self.width * depth * channels + 7) // 8 + 1
+
+    def _rewind(self):
+        self.file.seek(self.idat_offset)
+        self.inflater = zlib.decompressobj()
+        self.chunk_left = 0
+        self.previous = None
+
+    def _compressed(self):
+        while self.chunk_left == 0:
+            length, chunk_type = struct.unpack('>I4s', self.file.read(8))
+            if chunk_type != b'IDAT':
+                raise ValueError("PNG image data ended early")
+            self.chunk_left = length
+            if length == 0:
+                self.file.seek(4, os.SEEK_CUR)
+        data = self.file.read(min(self.chunk_left, 1024 * 1024))
+        self.chunk_left -= len(data)
+        if self.chunk_left == 0:
+            self.file.seek(4, os.SEEK_CUR)
+        return data
+
+    def _write_chunk(self, out, chunk_type, data):
+        out.write(struct.pack('>I', len(data)) + chunk_type)
+        out.write(data)
+        out.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def _decode(self, rows):
+        needed = rows * self.row_bytes
+        filtered = bytearray()
+        while len(filtered) < needed:
+            data = self.inflater.unconsumed_tail or self._compressed()
+            filtered += self.inflater.decompress(data, needed - len(filtered))
+
+        # Written piece by piece so the band's bytes are copied as few times as possible.
+        lead = b'' if self.previous is None else b'\x00' + self.previous
+        png = io.BytesIO()
+        png.write(_PNG_SIGNATURE)
+        header = self.header[:4] + struct.pack('>I', rows + bool(lead)) + self.header[8:]
+        self._write_chunk(png, b'IHDR', header)
+        png.write(self.extra_chunks)
+        compressor = zlib.compressobj(0)
+        self._write_chunk(png, b'IDAT', compressor.compress(lead))
+        self._write_chunk(png, b'IDAT', compressor.compress(filtered))
+        del filtered
+        self._write_chunk(png, b'IDAT', compressor.flush())
+        self._write_chunk(png, b'IEND', b'')
+        png.seek(0)
+
+        band = Image.open(png)
+        band.load()
+        self.previous = band.crop((0, band.height - 1, self.width, band.height)).tobytes('raw', self.rawmode)
+        if lead:
+            band = band.crop((0, 1, self.width, band.height))
+        self.row += rows
+        return band
+
+    def close(self):
+        self.file.close()
+
+
+class _DeflateTIFFStrips(_SequentialStrips):
+    # Deflate-compressed, chunky, 8-bit striped TIFF: every strip is its own
+    # zlib stream, inflated a band at a time straight from the file.
+    def __init__(self, img, path):
+        tags = img.tag_v2
+        self.width, self.height, self.mode = img.width, img.height, img.mode
+        self.rawmode = img.tile[0][3][0]
+        self.offsets, self.counts = tags[273], tags[279]
+        self.rows_per_strip = min(tags.get(278, self.height), self.height)
+        self.samples = tags.get(277, 1)
+        self.predictor = tags.get(317, 1)
+        self.row_bytes = self.width * self.samples
+        self.file = open(path, 'rb')
+        self._start()
+
+    @staticmethod
+    def supports(img):
+        if img.format != 'TIFF' or len(img.tile) != 1:
+            return False
+        tags = img.tag_v2
+        return (tags.get(259) in (8, 32946) and tags.get(284, 1) == 1 and 273 in tags and 322 not in tags
+                and all(bits == 8 for bits in tags.get(258, (8,))) and tags.get(317, 1) in (1, 2))
+
+    def _rewind(self):
+        self.strip = -1
+        self.strip_rows = 0
+        self.inflater = None
+
+    def _next_strip(self):
+        self.strip += 1
+        self.file.seek(self.offsets[self.strip])
+        self.compressed_left = self.counts[self.strip]
+        self.inflater = zlib.decompressobj()
+        self.strip_rows = min(self.rows_per_strip, self.height - self.strip * self.rows_per_strip)
+
+    def _inflate(self, size):
+        parts = []
+        while size > 0:
+            data = self.inflater.unconsumed_tail
+            if not data:
+                data = self.file.read(min(self.compressed_left, 1024 * 1024))
+                self.compressed_left -= len(data)
+                if not data:
+                    raise ValueError("TIFF strip ended early")
+            out = self.inflater.decompress(data, size)
+            parts.append(out)
+            size -= len(out)
+        return b''.join(parts)
+
+    def _decode(self, rows):
+        parts = []
+        remaining = rows
+        while remaining:
+            if self.strip_rows == 0:
+                self._next_strip()
+            take = min(remaining, self.strip_rows)
+            parts.append(self._inflate(take * self.row_bytes))
+            self.strip_rows -= take
+            remaining -= take
+        data = b''.join(parts)
+        if self.predictor == 2:
+            import numpy as np
+            # Horizontal differencing: each sample is stored as the delta to its left neighbour.
+            pixels = np.frombuffer(data, np.uint8).reshape(rows, self.width, self.samples)
+            data = np.cumsum(pixels, axis=1, dtype=np.uint8).tobytes()
+        self.row += rows
+        return Image.frombytes(self.mode, (self.width, rows), data, 'raw', self.rawmode)
+
+    def close(self):
+        self.file.close()
+
+
+class _DecodedStrips:
+    # Last resort for compressed formats Pillow can only decode whole: one
+    # full raster, but bands are still cut from it without extra copies.
+    def __init__(self, img):
+        warnings.warn(f"No streaming reader for this {img.format} image ({img.width}x{img.height}); decoding it "
+                      "whole, which ignores the memory budget. Install pyvips to stream it.", RuntimeWarning,
+                      stacklevel=3)
+        with _unbounded_pixels():
+            img.load()
+        self.img = img
+        self.width, self.height, self.mode = img.width, img.height, img.mode
+
+    def read(self, y0, y1):
+        return self.img.crop((0, y0, self.width, y1))
+
+    def close(self):
+        self.img.close()
+
+
+def strip_source(path, img=None):
+    img = img or open_large(path)
+    if _RawStrips.supports(img):
+        source = _RawStrips(img, path)
+        img.close()
+        return source
+    try:
+        source = _VipsStrips(path)
+        img.close()
+        return source
+    except (ImportError, OSError):
+        pass
+    if _DeflateTIFFStrips.supports(img):
+        source = _DeflateTIFFStrips(img, path)
+        img.close()
+        return source
+    if img.format == 'PNG':
+        try:
+            source = _PNGStrips(path)
+            img.close()
+            return source
+        except (ValueError, struct.error):
+            pass
+    return _DecodedStrips(img)
+
+
+class _PNGStripWriter:
+    COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+    def __init__(self, path, size, mode):
+        self.file = open(path, 'wb')
+        self.row_bytes = size[0] * len(mode)
+        self.compressor = zlib.compressobj(6)
+        self.previous = None
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, self.COLOR_TYPES[mode], 0, 0, 0))
+
+    def _chunk(self, chunk_type, data):
+        self.file.write(struct.pack('>I', len(data)) + chunk_type + data)
+        self.file.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+    def write(self, band):
+        import numpy as np
+        rows = np.frombuffer(band.tobytes(), dtype=np.uint8).reshape(band.height, self.row_bytes)
+        previous = np.zeros((1, self.row_bytes), np.uint8) if self.previous is None else self.previous
+        # PNG "Up" filter (type 2), vectorised over the whole band.
+        filtered = rows - np.vstack([previous, rows[:-1]])
+        data = np.hstack([np.full((band.height, 1), 2, np.uint8), filtered]).tobytes()
+        self.previous = rows[-1:].copy()
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self._chunk(b'IDAT', compressed)
+
+    def close(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.file.close()
+
+
+class _TIFFStripWriter:
+    def __init__(self, path, size, mode):
+        self.file = open(path, 'wb')
+        self.size, self.mode = size, mode
+        self.offsets, self.counts = [], []
+        self.rows_per_strip = None
+        self.file.write(b'II*\x00\x00\x00\x00\x00')
+
+    def write(self, band):
+        if self.rows_per_strip is None:
+            self.rows_per_strip = band.height
+        data = zlib.compress(band.tobytes(), 6)
+        self.offsets.append(self.file.tell())
+        self.counts.append(len(data))
+        self.file.write(data)
+
+    def _entry(self, tag, kind, values):
+        # Values that fit in 4 bytes live inline in the IFD entry (the spec
+        # requires it); longer arrays are written out and referenced by offset.
+        data = struct.pack(f"<{len(values)}{'H' if kind == 3 else 'I'}", *values)
+        if len(data) <= 4:
+            return tag, kind, len(values), data.ljust(4, b'\x00')
+        if self.file.tell() % 2:
+            self.file.write(b'\x00')
+        offset = self.file.tell()
+        self.file.write(data)
+        return tag, kind, len(values), struct.pack('<I', offset)
+
+    def close(self):
+        samples = len(self.mode)
+        entries = [self._entry(258, 3, [8] * samples), self._entry(273, 4, self.offsets),
+                   self._entry(279, 4, self.counts)]
+        for tag, kind, value in ((256, 4, self.size[0]), (257, 4, self.size[1]), (259, 3, 8),
+                                 (262, 3, 1 if self.mode in ('L', 'LA') else 2), (277, 3, samples),
+                                 (278, 4, self.rows_per_strip or self.size[1]), (284, 3, 1)):
+            entries.append(self._entry(tag, kind, [value]))
+        if self.mode in ('LA', 'RGBA'):
+            entries.append(self._entry(338, 3, [2]))
+        entries.sort()
+
+        if self.file.tell() % 2:
+            self.file.write(b'\x00')
+        ifd_offset = self.file.tell()
+        self.file.write(struct.pack('<H', len(entries)))
+        for tag, kind, count, packed in entries:
+            self.file.write(struct.pack('<HHI', tag, kind, count) + packed)
+        self.file.write(b'\x00\x00\x00\x00')
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', ifd_offset))
+        self.file.close()
+
+
+class _AssembledWriter:
+    # Encoders without an incremental API (JPEG, WEBP, ...) need the whole
+    # output raster; only the output is held, never a second source copy.
+    def __init__(self, path, size, mode, output_format, save_params=None):
+        self.path, self.output_format = path, output_format
+        self.save_params = save_params or {}
+        with _unbounded_pixels():
+            self.img = Image.new(mode, size)
+        self.y = 0
+
+    def write(self, band):
+        self.img.paste(band, (0, self.y))
+        self.y += band.height
+
+    def close(self):
+        self.img.save(self.path, self.output_format, **self.save_params)
+
+
+def _output_format(output_path, output_format=None):
+    if output_format:
+        return output_format.upper().replace('JPG', 'JPEG')
+    return Image.registered_extensions().get(os.path.splitext(output_path)[1].lower(), 'PNG')
+
+
+def _strip_writer(output_path, output_format, size, mode):
+    if output_format == 'PNG':
+        return _PNGStripWriter(output_path, size, mode)
+    if output_format == 'TIFF':
+        return _TIFFStripWriter(output_path, size, mode)
+    return _AssembledWriter(output_path, size, mode, output_format)
+
+
+def _composite_band(band, layer, position, y0):
+    x, y = position
+    top, bottom = max(y, y0), min(y + layer.height, y0 + band.height)
+    if top >= bottom:
+        return band
+    piece = layer.crop((0, top - y, layer.width, bottom - y))
+    if band.mode == 'RGBA' and x >= 0:
+        band.alpha_composite(piece, (x, top - y0))
+    else:
+        band.paste(piece, (x, top - y0), piece)
+    return band
+
+
+def tiled_convert(input_path, output_path, output_format=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                  layer=None, position=(0, 0)):
+    output_format = _output_format(output_path, output_format)
+    source = strip_source(input_path)
+    try:
+        mode = _stream_mode(source.mode, output_format)
+        if layer is not None and mode not in ('RGB', 'RGBA'):
+            mode = 'RGBA' if 'A' in mode else 'RGB'
+        rows = _band_rows(source.width, mode, memory_budget)
+        writer = _strip_writer(output_path, output_format, (source.width, source.height), mode)
+        for y0 in range(0, source.height, rows):
+            band = source.read(y0, min(source.height, y0 + rows))
+            if band.mode != mode:
+                band = band.convert(mode)
+            if layer is not None:
+                band = _composite_band(band, layer, position, y0)
+            writer.write(band)
+        writer.close()
+    finally:
+        source.close()
+    return output_path
+
+
+def tiled_watermark(input_path, output_path, layer, position, memory_budget=DEFAULT_MEMORY_BUDGET):
+    return tiled_convert(input_path, output_path, None, memory_budget, layer, (int(position[0]), int(position[1])))
+
+
+def tiled_resize(input_path, output_path, target, resample=Image.Resampling.LANCZOS, reducing_gap=3.0,
+                 memory_budget=DEFAULT_MEMORY_BUDGET):
+    img = open_large(input_path)
+    if reducing_gap and img.format == 'JPEG':
+        img.draft(img.mode, (int(target[0] * reducing_gap), int(target[1] * reducing_gap)))
+    mode = _stream_mode(img.mode, _output_format(output_path))
+    if decoded_size(img) <= memory_budget:
+        with _unbounded_pixels():
+            resized = img.resize(target, resample, reducing_gap=reducing_gap)
+        img.close()
+        (resized if resized.mode == mode else resized.convert(mode)).save(output_path)
+        return output_path
+
+    source = strip_source(input_path, img)
+    try:
+        scale_x, scale_y = source.width / target[0], source.height / target[1]
+        # Integer box-reduce first (like reducing_gap), then the real filter;
+        # bands start on multiples of the factor so reduce blocks line up.
+        factor = max(1, int(min(scale_x, scale_y) / reducing_gap)) if reducing_gap else 1
+        margin = (math.ceil(scale_y * 3) // factor + 2) * factor
+        out_rows = max(1, int(_band_rows(source.width, mode, memory_budget) / scale_y) - 2 * margin)
+        output = Image.new(mode, target)
+
+        for o0 in range(0, target[1], out_rows):
+            o1 = min(target[1], o0 + out_rows)
+            s0, s1 = o0 * scale_y, o1 * scale_y
+            r0 = max(0, (int(s0) - margin) // factor * factor)
+            r1 = min(source.height, -(-(math.ceil(s1) + margin) // factor) * factor)
+            band = source.read(r0, r1)
+            if band.mode != mode:
+                band = band.convert(mode)
+            if factor > 1:
+                band = band.reduce(factor)
+            box = (0, (s0 - r0) / factor, source.width / factor, (s1 - r0) / factor)
+            output.paste(band.resize((target[0], o1 - o0), resample, box=box), (0, o0))
+        output.save(output_path)
+    finally:
+        source.close()
+    return output_path
@@ -1,13 +1,527 @@
 import os
 import fitz
-from PIL import Image
+from PIL import Image, ImageOps, ImageSequence, features
 import io
+import hashlib
+import sqlite3
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
 from PyPDF2 import PdfMerger, PdfReader, PdfWriter
 import pikepdf
+from tools.batch_utils import batch_outputs, file_digests, iter_batch, iter_files, iter_tasks
+from tools.result_cache import ResultCache, release_output
+
+PDF_QUALITY_PRESETS = {
+    "/screen": {"dpi": 72, "quality": 40},
+    "/ebook": {"dpi": 150, "quality": 60},
+    "/printer": {"dpi": 300, "quality": 80},
+    "/prepress": {"dpi": 300, "quality": 90},
+    "/default": {"dpi": None, "quality": 85},
+}
+
+# Images are only downsampled when they exceed the target by this factor.
+DOWNSAMPLE_THRESHOLD = 1.5
+
+SKIPPED_IMAGE_FILTERS = ("/JBIG2Decode", "/CCITTFaxDecode")
+
+IMAGE_COMPONENTS = {"L": 1, "RGB": 3, "CMYK": 4}
+
+
+def _scaled_size(size, scale):
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale))) if scale < 1 else size
+
+
+def _pdf_image_base(image):
+    # pikepdf >= 10 composites an /SMask into RGBA by default; the colour
+    # data and its soft mask are recompressed separately here.
+    pdf_image = pikepdf.PdfImage(image)
+    try:
+        return pdf_image.as_pil_image(apply_mask=False)
+    except TypeError:
+        return pdf_image.as_pil_image()
+
+
+def _resample_mask(mask, size):
+    if mask.mode != "L":
+        mask = mask.convert("L")
+    if mask.size != size:
+        mask = mask.resize(size, Image.Resampling.LANCZOS)
+    # Masks keep hard edges, so they stay lossless (Flate).
+    return zlib.compress(mask.tobytes(), 6), mask.size
+
+
+def _recompress_image(image, scale, image_format, quality, invert=False):
+    if image.mode not in ("RGB", "L", "CMYK"):
+        image = image.convert("RGB")
+    if invert:
+        image = image.point(lambda value: 255 - value)
+    if scale < 1:
+        image = image.resize(_scaled_size(image.size, scale), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    # CMYK stays CMYK and goes out as an Adobe JPEG (stored inverted).
+    if image_format == "jpeg2000" and image.mode != "CMYK":
+        image.save(buffer, "JPEG2000", irreversible=True, quality_mode="rates",
+                   quality_layers=[max(1, 100 - quality)])
+    else:
+        image.save(buffer, "JPEG", quality=quality, optimize=True)
+    return buffer.getvalue(), image.width, image.height, image.mode
+
+
+def _image_display_dpi(pdf_file):
+    dpi = {}
+    with fitz.open(pdf_file) as doc:
+        for page in doc:
+            for info in page.get_image_info(xrefs=True):
+                xref = info.get("xref", 0)
+                bbox = fitz.Rect(info["bbox"])
+                if not xref or bbox.is_empty:
+                    continue
+                value = min(info["width"] * 72 / bbox.width, info["height"] * 72 / bbox.height)
+                # An image placed several times is sized for its largest placement.
+                dpi[xref] = min(dpi.get(xref, value), value)
+    return dpi
+
+
+def _image_filters(image):
+    filters = image.get("/Filter")
+    if filters is None:
+        return []
+    return [str(f) for f in filters] if isinstance(filters, pikepdf.Array) else [str(filters)]
+
+
+def _unsupported_image(image):
+    if image.get("/ImageMask", False):
+        return "stencil mask"
+    if isinstance(image.get("/Mask"), pikepdf.Array):
+        return "colour key mask"
+    for name in _image_filters(image):
+        if name in SKIPPED_IMAGE_FILTERS:
+            return f"{name} filter"
+    return None
+
+
+def _decode_inverted(image, components):
+    # True for a fully inverted /Decode array, False for none or the default
+    # one, None for anything else (ranges the recompressor cannot reproduce).
+    decode = image.get("/Decode")
+    if decode is None:
+        return False
+    values = [float(v) for v in decode]
+    if values == [0.0, 1.0] * components:
+        return False
+    if values == [1.0, 0.0] * components:
+        return True
+    return None
+
+
+def _adobe_jpeg(data):
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return "adobe" in img.info
+    except Exception:
+        return False
+
+
+def _object_fingerprint(value):
+    if isinstance(value, pikepdf.Stream):
+        return (hashlib.sha256(value.read_raw_bytes()).hexdigest(),
+                _object_fingerprint(pikepdf.Dictionary({k: v for k, v in value.stream_dict.items() if k != "/Length"})))
+    if isinstance(value, pikepdf.Dictionary):
+        return tuple(sorted((key, _object_fingerprint(item)) for key, item in value.items()))
+    if isinstance(value, pikepdf.Array):
+        return tuple(_object_fingerprint(item) for item in value)
+    return repr(value)
+
+
+def _font_file_sizes(doc):
+    total = 0
+    for xref in range(1, doc.xref_length()):
+        if doc.xref_get_key(xref, "Type") != ("name", "/FontDescriptor"):
+            continue
+        for key in ("FontFile", "FontFile2", "FontFile3"):
+            kind, value = doc.xref_get_key(xref, key)
+            if kind == "xref":
+                total += len(doc.xref_stream_raw(int(value.split()[0])))
+    return total
+
+PAGE_SIZES = {
+    "A3": (841.89, 1190.55),
+    "A4": (595.28, 841.89),
+    "A5": (419.53, 595.28),
+    "letter": (612.0, 792.0),
+    "legal": (612.0, 1008.0),
+}
+
+FIT_MODES = ("fit", "fill", "stretch", "none")
+
+
+def _png_passthrough(image_file):
+    with open(image_file, "rb") as f:
+        if f.read(8) != b"\x89PNG\r\n\x1a\n":
+            return None
+        idat = []
+        header = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return None
+            length, chunk_type = struct.unpack(">I4s", chunk_header)
+            data = f.read(length)
+            f.seek(4, io.SEEK_CUR)
+            if chunk_type == b"IHDR":
+                width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+                if bit_depth != 8 or color_type not in (0, 2) or interlace:
+                    return None
+                header = (width, height, 1 if color_type == 0 else 3)
+            elif chunk_type == b"tRNS":
+                return None
+            elif chunk_type == b"IDAT":
+                idat.append(data)
+            elif chunk_type == b"IEND":
+                break
+    if header is None:
+        return None
+    return header + (b"".join(idat),)
+
+
+class PDFImageWriter:
+    def __init__(self, output_path, page_size=None, fit="fit", margin=0, dpi=None):
+        if isinstance(page_size, str):
+            if page_size not in PAGE_SIZES:
+                raise ValueError(f"Unsupported page size: {page_size}")
+            page_size = PAGE_SIZES[page_size]
+        if fit not in FIT_MODES:
+            raise ValueError(f"Unsupported fit mode: {fit}")
+        self.output_path = output_path
+        self.page_size = page_size
+        self.fit = fit
+        self.margin = margin
+        self.dpi = dpi
+        self.page_count = 0
+        # Objects 1 and 2 (catalog and page tree) are written last, once every
+        # page id is known; everything else goes straight to disk.
+        self._offsets = {}
+        self._page_ids = []
+        self._next_id = 3
+        self._file = open(output_path, "wb")
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _write_object(self, dictionary, stream=None, object_id=None):
+        if object_id is None:
+            object_id = self._next_id
+            self._next_id += 1
+        self._offsets[object_id] = self._file.tell()
+        if stream is None:
+            self._file.write(f"{object_id} 0 obj\n{dictionary}\nendobj\n".encode())
+        else:
+            self._file.write(f"{object_id} 0 obj\n<< {dictionary} /Length {len(stream)} >>\nstream\n".encode())
+            self._file.write(stream)
+            self._file.write(b"\nendstream\nendobj\n")
+        return object_id
+
+    def _write_image(self, width, height, colorspace, filter_name, data, extra="", bits=8):
+        return self._write_object(
+            f"/Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace {colorspace} "
+            f"/BitsPerComponent {bits} /Filter /{filter_name}{extra}", data)
+
+    def _write_raster(self, img):
+        if img.mode == "1":
+            # Packed rows map straight onto a 1-bit DeviceGray image (1 = white).
+            return self._write_image(img.width, img.height, "/DeviceGray", "FlateDecode",
+                                     zlib.compress(img.tobytes(), 6), bits=1)
+        smask = ""
+        if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+            img = img.convert("RGBA") if img.mode != "LA" else img
+            alpha_id = self._write_image(img.width, img.height, "/DeviceGray", "FlateDecode",
+                                         zlib.compress(img.getchannel("A").tobytes(), 6))
+            smask = f" /SMask {alpha_id} 0 R"
+        if img.mode in ("LA", "I;16", "I", "F"):
+            img = img.convert("L")
+        elif img.mode not in ("L", "RGB", "CMYK"):
+            img = img.convert("RGB")
+        colorspace = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}[img.mode]
+        return self._write_image(img.width, img.height, colorspace, "FlateDecode",
+                                 zlib.compress(img.tobytes(), 6), smask)
+
+    def add_image(self, image_file):
+        with Image.open(image_file) as img:
+            dpi = self.dpi or float(img.info.get("dpi", (72, 72))[0])
+            if dpi < 10:
+                # Pillow reports (1, 1) for TIFFs without a resolution unit.
+                dpi = 72
+            if img.format == "JPEG":
+                orientation = img.getexif().get(0x0112, 1)
+                if orientation in (1, 3, 6, 8) and img.mode in ("L", "RGB", "CMYK"):
+                    # DCT data is copied byte for byte; EXIF rotation is applied
+                    # through the placement matrix rather than by re-encoding.
+                    extra = " /Decode [1 0 1 0 1 0 1 0]" if img.mode == "CMYK" and "adobe" in img.info else ""
+                    colorspace = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}[img.mode]
+                    with open(image_file, "rb") as f:
+                        image_id = self._write_image(img.width, img.height, colorspace, "DCTDecode", f.read(), extra)
+                    self._add_page(image_id, img.width, img.height, dpi, orientation)
+                    return 1
+                img = ImageOps.exif_transpose(img)
+            elif img.format == "PNG":
+                passthrough = _png_passthrough(image_file)
+                if passthrough is not None:
+                    width, height, colors, data = passthrough
+                    parms = f" /DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent 8 /Columns {width} >>"
+                    image_id = self._write_image(width, height, "/DeviceGray" if colors == 1 else "/DeviceRGB",
+                                                 "FlateDecode", data, parms)
+                    self._add_page(image_id, width, height, dpi)
+                    return 1
+
+            pages = 0
+            for frame in ImageSequence.Iterator(img):
+                image_id = self._write_raster(frame)
+                self._add_page(image_id, frame.width, frame.height, dpi)
+                pages += 1
+            return pages
+
+    def _add_page(self, image_id, width, height, dpi, orientation=1):
+        rotated = orientation in (6, 8)
+        image_w, image_h = (height, width) if rotated else (width, height)
+        image_w, image_h = image_w * 72.0 / dpi, image_h * 72.0 / dpi
+        if self.page_size is None:
+            page_w, page_h = image_w + 2 * self.margin, image_h + 2 * self.margin
+        else:
+            page_w, page_h = self.page_size
+        box_w, box_h = page_w - 2 * self.margin, page_h - 2 * self.margin
+
+        if self.fit == "stretch":
+            draw_w, draw_h = box_w, box_h
+        elif self.fit == "none":
+            draw_w, draw_h = image_w, image_h
+        else:
+            pick = min if self.fit == "fit" else max
+            scale = pick(box_w / image_w, box_h / image_h)
+            draw_w, draw_h = image_w * scale, image_h * scale
+        x = self.margin + (box_w - draw_w) / 2
+        y = self.margin + (box_h - draw_h) / 2
+
+        if orientation == 3:
+            matrix = (-draw_w, 0, 0, -draw_h, x + draw_w, y + draw_h)
+        elif orientation == 6:
+            matrix = (0, -draw_h, draw_w, 0, x, y + draw_h)
+        elif orientation == 8:
+            matrix = (0, draw_h, -draw_w, 0, x + draw_w, y)
+        else:
+            matrix = (draw_w, 0, 0, draw_h, x, y)
+        clip = f"{self.margin:.2f} {self.margin:.2f} {box_w:.2f} {box_h:.2f} re W n " if self.fit in ("fill", "none") else ""
+        content = f"q {clip}{' '.join(f'{v:.4f}' for v in matrix)} cm /Im0 Do Q".encode()
+
+        content_id = self._write_object("", content)
+        page_id = self._write_object(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_w:.2f} {page_h:.2f}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>")
+        self._page_ids.append(page_id)
+        self.page_count += 1
+
+    def close(self):
+        if self._file.closed:
+            return
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>", object_id=2)
+        self._write_object("<< /Type /Catalog /Pages 2 0 R >>", object_id=1)
+
+        xref_offset = self._file.tell()
+        size = self._next_id
+        self._file.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode())
+        for object_id in range(1, size):
+            self._file.write(f"{self._offsets[object_id]:010d} 00000 n \n".encode())
+        self._file.write(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+        self._file.close()
+
+
+class PDFImageSheet(PDFImageWriter):
+    # Lays images out on a fixed grid (labels, QR/barcode sheets), row by row
+    # from the top left; a page is written as soon as its grid is full.
+    def __init__(self, output_path, page_size="A4", columns=4, rows=6, margin=36, gap=12):
+        super().__init__(output_path, page_size, "fit", margin)
+        self.columns = columns
+        self.rows = rows
+        self.gap = gap
+        self.image_count = 0
+        self._cells = []
+
+    def add_image(self, image):
+        if isinstance(image, (str, bytes, os.PathLike)) or hasattr(image, "read"):
+            with Image.open(io.BytesIO(image) if isinstance(image, bytes) else image) as img:
+                image_id = self._write_raster(img)
+                size = img.size
+        else:
+            image_id = self._write_raster(image)
+            size = image.size
+        self._cells.append((image_id, size))
+        self.image_count += 1
+        if len(self._cells) == self.columns * self.rows:
+            self._write_sheet()
+        return 1
+
+    def _write_sheet(self):
+        page_w, page_h = self.page_size
+        cell_w = (page_w - 2 * self.margin - (self.columns - 1) * self.gap) / self.columns
+        cell_h = (page_h - 2 * self.margin - (self.rows - 1) * self.gap) / self.rows
+        content = []
+        for index, (image_id, (width, height)) in enumerate(self._cells):
+            row, column = divmod(index, self.columns)
+            scale = min(cell_w / width, cell_h / height)
+            draw_w, draw_h = width * scale, height * scale
+            x = self.margin + column * (cell_w + self.gap) + (cell_w - draw_w) / 2
+            y = page_h - self.margin - row * (cell_h + self.gap) - cell_h + (cell_h - draw_h) / 2
+            content.append(f"q {draw_w:.4f} 0 0 {draw_h:.4f} {x:.4f} {y:.4f} cm /Im{index} Do Q")
+        xobjects = " ".join(f"/Im{index} {image_id} 0 R" for index, (image_id, _) in enumerate(self._cells))
+
+        content_id = self._write_object("", "\n".join(content).encode())
+        page_id = self._write_object(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_w:.2f} {page_h:.2f}] "
+            f"/Resources << /XObject << {xobjects} >> >> /Contents {content_id} 0 R >>")
+        self._page_ids.append(page_id)
+        self.page_count += 1
+        self._cells = []
+
+    def close(self):
+        if self._cells and not self._file.closed:
+            self._write_sheet()
+        super().close()
+
+
+def _extract_page_texts(pdf_file, start=0, stop=None):
+    with fitz.open(pdf_file) as doc:
+        stop = len(doc) if stop is None else min(stop, len(doc))
+        return [(page_num + 1, doc[page_num].get_text()) for page_num in range(start, stop)]
+
+
+def _find_pdfs(paths):
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in paths:
+        if os.path.isdir(path):
+            for entry in iter_files(path, '.pdf', recursive=True):
+                yield entry.path
+        else:
+            yield path
+
+
+def _fts_quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+class PDFTextIndex:
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        self.connection.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER, mtime REAL);
+            CREATE INDEX IF NOT EXISTS files_sha256 ON files(sha256);
+            CREATE TABLE IF NOT EXISTS documents (sha256 TEXT PRIMARY KEY, pages INTEGER, error TEXT);
+            CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(sha256 UNINDEXED, page UNINDEXED, text);
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, paths, max_workers=None):
+        # A files row is only written together with (or after) the documents
+        # row for its digest, so an interrupted run never leaves a path that
+        # looks indexed but has no text; the next run simply picks it up.
+        stats = {"indexed": 0, "unchanged": 0, "removed": 0, "errors": []}
+        db = self.connection
+        pending = {}
+
+        for path in _find_pdfs(paths):
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            row = db.execute("SELECT files.size, files.mtime FROM files JOIN documents USING (sha256) "
+                             "WHERE files.path = ?", (path,)).fetchone()
+            if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                stats["unchanged"] += 1
+                continue
+            digest = file_digests(path)["sha256"]
+            entry = (path, digest, stat.st_size, stat.st_mtime)
+            if digest in pending:
+                pending[digest].append(entry)
+                stats["unchanged"] += 1
+            elif db.execute("SELECT 1 FROM documents WHERE sha256 = ?", (digest,)).fetchone():
+                db.execute("INSERT OR REPLACE INTO files (path, sha256, size, mtime) VALUES (?, ?, ?, ?)", entry)
+                stats["unchanged"] += 1
+            else:
+                pending[digest] = [entry]
+        db.commit()
+
+        if pending:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(_extract_page_texts, entries[0][0]): digest
+                           for digest, entries in pending.items()}
+                for future in as_completed(futures):
+                    digest = futures[future]
+                    try:
+                        pages = future.result()
+                        error = None
+                    except Exception as e:
+                        pages = []
+                        error = str(e)
+                        stats["errors"].append({"file": pending[digest][0][0], "error": error})
+                    with db:
+                        db.executemany("INSERT INTO pages (sha256, page, text) VALUES (?, ?, ?)",
+                                       [(digest, page, text) for page, text in pages])
+                        db.execute("INSERT OR REPLACE INTO documents (sha256, pages, error) VALUES (?, ?, ?)",
+                                   (digest, len(pages), error))
+                        db.executemany("INSERT OR REPLACE INTO files (path, sha256, size, mtime) VALUES (?, ?, ?, ?)",
+                                       pending[digest])
+                    stats["indexed"] += 1
+
+        stats["removed"] = self.prune()
+        return stats
+
+    def prune(self):
+        db = self.connection
+        missing = [path for (path,) in db.execute("SELECT path FROM files") if not os.path.exists(path)]
+        db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in missing])
+        orphan = "SELECT sha256 FROM documents WHERE sha256 NOT IN (SELECT sha256 FROM files)"
+        db.execute(f"DELETE FROM pages WHERE sha256 IN ({orphan})")
+        db.execute(f"DELETE FROM documents WHERE sha256 IN ({orphan})")
+        db.commit()
+        return len(missing)
+
+    def search(self, query, limit=20, raw=False):
+        # Each whitespace-separated word is quoted, so user text such as
+        # "fatura-2024" or "C++" is matched literally (all words must occur).
+        # raw=True passes the query through as FTS5 syntax (AND/OR/NEAR, prefix*).
+        if not raw:
+            query = " ".join(_fts_quote(term) for term in query.split())
+        if not query:
+            raise ValueError("Empty search query")
+        try:
+            rows = self.connection.execute("""
+                SELECT files.path, pages.page, snippet(pages, 2, '[', ']', '...', 12)
+                FROM pages JOIN files ON files.sha256 = pages.sha256
+                WHERE pages MATCH ? ORDER BY rank LIMIT ?
+            """, (query, limit)).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search query {query!r}: {e}") from e
+        return [{"file": path, "page": page, "snippet": snippet} for path, page, snippet in rows]
+
 
 class PDFTools:
-    def __init__(self):
-        pass
+    def __init__(self, cache=None):
+        self.cache = ResultCache(cache) if isinstance(cache, str) else cache
 
     def merge_pdfs(self, pdf_files, output_path):
         merger = PdfMerger()
@@ -35,6 +549,12 @@ class PDFTools:
         return output_files
 
     def pdf_to_jpg(self, pdf_file, output_dir, dpi=300):
+        if self.cache is not None:
+            cache_key = self.cache.make_key("pdf_to_jpg", pdf_file, {"dpi": dpi})
+            cached = self.cache.get_files(cache_key, output_dir)
+            if cached is not None:
+                return cached
+
         doc = fitz.open(pdf_file)
         image_files = []
         
@@ -43,44 +563,343 @@ class PDFTools:
             pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
             img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
             output_file = os.path.join(output_dir, f"page_{page_num+1}.jpg")
+            release_output(output_file)
             img.save(output_file, "JPEG", quality=95)
             image_files.append(output_file)
         
         doc.close()
+        if self.cache is not None:
+            self.cache.put_files(cache_key, image_files)
         return image_files
 
     def jpg_to_pdf(self, image_files, output_path):
-        doc = fitz.open()
-        for image_file in image_files:
-            img = fitz.open(image_file)
-            pdf_bytes = img.convert_to_pdf()
-            pdf_doc = fitz.open("pdf", pdf_bytes)
-            doc.insert_pdf(pdf_doc)
-            img.close()
-            pdf_doc.close()
-        doc.save(output_path)
-        doc.close()
+        return self.images_to_pdf(image_files, output_path)
+
+    def images_to_pdf(self, image_files, output_path, page_size=None, fit="fit", margin=0, dpi=None):
+        with PDFImageWriter(output_path, page_size=page_size, fit=fit, margin=margin, dpi=dpi) as writer:
+            for image_file in image_files:
+                writer.add_image(image_file)
         return output_path
 
-    def compress_pdf(self, pdf_file, output_path, quality="/ebook"):
+    def extract_text(self, pdf_file, max_workers=None, pages_per_task=50):
+        with fitz.open(pdf_file) as doc:
+            page_count = len(doc)
+        if page_count <= pages_per_task or max_workers == 1:
+            return [text for _, text in _extract_page_texts(pdf_file)]
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_extract_page_texts, pdf_file, start, start + pages_per_task)
+                       for start in range(0, page_count, pages_per_task)]
+            return [text for future in futures for _, text in future.result()]
+
+    def batch_extract_text(self, pdf_files, max_workers=None):
+        pdf_files = list(_find_pdfs(pdf_files))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(_extract_page_texts, pdf_files)
+            return {pdf_file: [text for _, text in pages] for pdf_file, pages in zip(pdf_files, results)}
+
+    def index_pdfs(self, paths, index_path, max_workers=None):
+        with PDFTextIndex(index_path) as index:
+            return index.update(paths, max_workers)
+
+    def search_pdfs(self, index_path, query, limit=20, raw=False):
+        with PDFTextIndex(index_path) as index:
+            return index.search(query, limit, raw)
+
+    def compress_pdf(self, pdf_file, output_path, quality="/ebook", image_format="jpeg", target_dpi=None,
+                     subset_fonts=True, max_workers=None, return_report=False):
+        if isinstance(quality, int):
+            preset = {"dpi": target_dpi, "quality": quality}
+        elif quality in PDF_QUALITY_PRESETS:
+            preset = dict(PDF_QUALITY_PRESETS[quality])
+        else:
+            raise ValueError(f"Unsupported quality preset: {quality}")
+        if target_dpi is not None:
+            preset["dpi"] = target_dpi
+        if image_format == "jpeg2000" and not features.check("jpg_2000"):
+            image_format = "jpeg"
+
+        if self.cache is not None:
+            cache_key = self.cache.make_key("compress_pdf", pdf_file, {
+                "preset": preset, "image_format": image_format, "subset_fonts": subset_fonts})
+            report = self.cache.get_file(cache_key, output_path)
+            if report is not None:
+                report.update(output_path=output_path, cached=True)
+                return report if return_report else output_path
+
+        report = {"original_size": os.path.getsize(pdf_file), "stages": []}
+        display_dpi = _image_display_dpi(pdf_file) if preset["dpi"] else {}
+
         with pikepdf.open(pdf_file) as pdf:
+            images = [obj for obj in pdf.objects
+                      if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == pikepdf.Name.Image]
+            masks = set()
+            for image in images:
+                for key in ("/SMask", "/Mask"):
+                    mask = image.get(key)
+                    if isinstance(mask, pikepdf.Stream):
+                        masks.add(mask.objgen)
+            images = [image for image in images if image.objgen not in masks]
+
+            replaced = self._deduplicate_pdf_images(pdf, images)
+            report["stages"].append({
+                "stage": "dedup",
+                "images": len(replaced),
+                "bytes_saved": sum(len(image.read_raw_bytes()) for image, _ in replaced),
+            })
+
+            # The surviving copy now carries every placement of its duplicates.
+            for image, target in replaced:
+                dpi = display_dpi.pop(image.objgen[0], None)
+                if dpi is not None:
+                    xref = target.objgen[0]
+                    display_dpi[xref] = min(display_dpi.get(xref, dpi), dpi)
+
+            replaced_ids = {image.objgen for image, _ in replaced}
+            unique_images = [image for image in images if image.objgen not in replaced_ids]
+            recompressed, saved, skipped = self._recompress_pdf_images(unique_images, display_dpi, preset,
+                                                                       image_format, max_workers)
+            report["stages"].append({"stage": "images", "images": recompressed, "bytes_saved": saved,
+                                     "skipped": skipped})
+
+            buffer = io.BytesIO()
+            pdf.save(buffer)
+
+        if subset_fonts:
+            with fitz.open("pdf", buffer.getvalue()) as doc:
+                before = _font_file_sizes(doc)
+                try:
+                    doc.subset_fonts()
+                    after = _font_file_sizes(doc)
+                    buffer = io.BytesIO(doc.tobytes(garbage=1))
+                except Exception:
+                    after = before
+            report["stages"].append({"stage": "fonts", "bytes_saved": before - after})
+
+        buffer.seek(0)
+        release_output(output_path)
+        with pikepdf.open(buffer) as pdf:
             pdf.save(output_path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
-        return output_path
+
+        report["output_path"] = output_path
+        report["final_size"] = os.path.getsize(output_path)
+        report["bytes_saved"] = report["original_size"] - report["final_size"]
+        report["stages"].append({
+            "stage": "streams",
+            "bytes_saved": report["bytes_saved"] - sum(stage["bytes_saved"] for stage in report["stages"]),
+        })
+        if self.cache is not None:
+            self.cache.put_file(cache_key, output_path, report)
+        return report if return_report else output_path
+
+    def _deduplicate_pdf_images(self, pdf, images):
+        canonical = {}
+        replacements = {}
+        for image in images:
+            key = _object_fingerprint(image)
+            if key in canonical:
+                replacements[image.objgen] = canonical[key]
+            else:
+                canonical[key] = image
+        if not replacements:
+            return []
+
+        for obj in pdf.objects:
+            if not isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream)):
+                continue
+            resources = obj.get("/Resources")
+            xobjects = resources.get("/XObject") if isinstance(resources, pikepdf.Dictionary) else None
+            if not isinstance(xobjects, pikepdf.Dictionary):
+                continue
+            for name in list(xobjects.keys()):
+                target = replacements.get(xobjects[name].objgen)
+                if target is not None:
+                    xobjects[name] = target
+        return [(image, replacements[image.objgen]) for image in images if image.objgen in replacements]
+
+    def _recompress_pdf_images(self, images, display_dpi, preset, image_format, max_workers=None):
+        filter_name = pikepdf.Name.JPXDecode if image_format == "jpeg2000" else pikepdf.Name.DCTDecode
+        recompressed = 0
+        saved = 0
+        skipped = []
+        resized_masks = {}
+
+        workers = max_workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Decoding touches the shared Pdf, so it stays on this thread; only the
+            # resample/encode work is handed to the pool, in bounded windows.
+            window = workers * 4
+            for start in range(0, len(images), window):
+                jobs = []
+                for image in images[start:start + window]:
+                    reason = _unsupported_image(image)
+                    if reason is None:
+                        try:
+                            pil_image = _pdf_image_base(image)
+                        except Exception:
+                            reason = "decode error"
+                    if reason is None and pil_image.mode != "P" and pil_image.mode not in IMAGE_COMPONENTS:
+                        reason = f"colour mode {pil_image.mode}"
+
+                    if reason is None:
+                        filters = _image_filters(image)
+                        inverted = _decode_inverted(image, IMAGE_COMPONENTS.get(pil_image.mode, 0))
+                        # pikepdf hands DCT data over as Pillow decodes it, ignoring
+                        # /Decode, so only there can an inverted array be replayed.
+                        if inverted is None or (inverted and filters != ["/DCTDecode"]):
+                            reason = "/Decode array"
+                        else:
+                            # Pillow also undoes the inversion of Adobe CMYK JPEGs.
+                            adobe = (pil_image.mode == "CMYK" and filters == ["/DCTDecode"]
+                                     and _adobe_jpeg(image.read_raw_bytes()))
+                            invert = inverted != adobe
+                    if reason is not None:
+                        skipped.append({"object": image.objgen[0], "reason": reason})
+                        continue
+
+                    scale = 1.0
+                    dpi = display_dpi.get(image.objgen[0])
+                    if preset["dpi"] and dpi and dpi > preset["dpi"] * DOWNSAMPLE_THRESHOLD:
+                        scale = preset["dpi"] / dpi
+                    future = executor.submit(_recompress_image, pil_image, scale, image_format, preset["quality"],
+                                             invert)
+                    # A soft mask is resampled to the new image size alongside it.
+                    smask = image.get("/SMask")
+                    mask_future = None
+                    if scale < 1 and isinstance(smask, pikepdf.Stream):
+                        try:
+                            mask_future = executor.submit(_resample_mask, _pdf_image_base(smask),
+                                                          _scaled_size(pil_image.size, scale))
+                        except Exception:
+                            pass
+                    jobs.append((image, future, mask_future))
+
+                for image, future, mask_future in jobs:
+                    try:
+                        data, width, height, mode = future.result()
+                    except Exception:
+                        skipped.append({"object": image.objgen[0], "reason": "encode error"})
+                        continue
+                    original_size = len(image.read_raw_bytes())
+                    if len(data) >= original_size:
+                        continue
+
+                    components = IMAGE_COMPONENTS[mode]
+                    colorspace = image.get("/ColorSpace")
+                    keep_colorspace = (isinstance(colorspace, pikepdf.Array) and colorspace[0] == pikepdf.Name.ICCBased
+                                       and int(colorspace[1].get("/N", 0)) == components)
+                    image.write(data, filter=pikepdf.Name.DCTDecode if mode == "CMYK" else filter_name)
+                    image.Width = width
+                    image.Height = height
+                    image.BitsPerComponent = 8
+                    if not keep_colorspace:
+                        image.ColorSpace = {"L": pikepdf.Name.DeviceGray, "RGB": pikepdf.Name.DeviceRGB,
+                                            "CMYK": pikepdf.Name.DeviceCMYK}[mode]
+                    if mode == "CMYK":
+                        # Pillow writes Adobe CMYK JPEGs, whose samples are stored inverted.
+                        image.Decode = pikepdf.Array([1, 0] * 4)
+                    elif "/Decode" in image:
+                        del image["/Decode"]
+                    if "/DecodeParms" in image:
+                        del image["/DecodeParms"]
+                    recompressed += 1
+                    saved += original_size - len(data)
+                    if mask_future is not None:
+                        saved += self._replace_soft_mask(image.SMask, mask_future, (width, height), resized_masks)
+        return recompressed, saved, skipped
+
+    def _replace_soft_mask(self, smask, mask_future, size, resized_masks):
+        # A mask shared by images that ended up at different sizes keeps its
+        # first resample; PDF allows a soft mask to differ in size from its image.
+        try:
+            data, mask_size = mask_future.result()
+        except Exception:
+            return 0
+        if mask_size != size or resized_masks.setdefault(smask.objgen, size) != size:
+            return 0
+        original_size = len(smask.read_raw_bytes())
+        smask.write(data, filter=pikepdf.Name.FlateDecode)
+        smask.Width, smask.Height = size
+        smask.BitsPerComponent = 8
+        smask.ColorSpace = pikepdf.Name.DeviceGray
+        if "/DecodeParms" in smask:
+            del smask["/DecodeParms"]
+        return original_size - len(data)
 
     def add_watermark_text(self, pdf_file, output_path, text, position=(100, 100), opacity=0.5):
         doc = fitz.open(pdf_file)
+        # One template page per distinct page size; show_pdf_page turns each into a
+        # single Form XObject that every matching page references.
+        builder = fitz.open()
+        template_pages = {}
         for page in doc:
             rect = page.rect
-            page.insert_text(position, text, fontsize=40, rotate=45, color=(0.8, 0.8, 0.8), opacity=opacity)
+            size = (round(rect.width, 2), round(rect.height, 2))
+            if size not in template_pages:
+                template = builder.new_page(width=rect.width, height=rect.height)
+                template.insert_text(position, text, fontsize=40, color=(0.8, 0.8, 0.8), fill_opacity=opacity,
+                                     morph=(fitz.Point(position), fitz.Matrix(45)))
+                template_pages[size] = template.number
+        templates = fitz.open("pdf", builder.tobytes())
+        builder.close()
+
+        for page in doc:
+            size = (round(page.rect.width, 2), round(page.rect.height, 2))
+            page.show_pdf_page(page.rect, templates, template_pages[size], overlay=True)
         doc.save(output_path)
+        templates.close()
         doc.close()
         return output_path
 
-    def add_watermark_image(self, pdf_file, output_path, watermark_image, position=(100, 100), opacity=0.5):
+    def add_watermark_image(self, pdf_file, output_path, watermark_image, position=None, opacity=0.5):
+        # position None stretches the image over the page (keeping its aspect);
+        # (x, y) puts its top-left corner there at one point per pixel.
+        stream = self._watermark_image_stream(watermark_image, opacity)
+        return self._stamp_watermark_image(pdf_file, output_path, stream, position)
+
+    def _watermark_image_stream(self, watermark_image, opacity):
+        with Image.open(watermark_image) as img:
+            if opacity >= 1 and img.format in ("JPEG", "PNG"):
+                with open(watermark_image, "rb") as f:
+                    return f.read()
+            img = img.convert("RGBA")
+            alpha = img.getchannel("A").point(lambda p: int(p * opacity))
+            img.putalpha(alpha)
+            buffer = io.BytesIO()
+            img.save(buffer, "PNG", optimize=True)
+        return buffer.getvalue()
+
+    def _stamp_watermark_image(self, pdf_file, output_path, stream, position=None):
+        rect = None
+        if position is not None:
+            with Image.open(io.BytesIO(stream)) as img:
+                rect = fitz.Rect(position[0], position[1], position[0] + img.width, position[1] + img.height)
         doc = fitz.open(pdf_file)
+        xref = 0
         for page in doc:
-            rect = page.rect
-            page.insert_image(rect, filename=watermark_image, overlay=True, opacity=opacity)
-        doc.save(output_path)
+            if xref:
+                page.insert_image(rect or page.rect, xref=xref, overlay=True)
+            else:
+                xref = page.insert_image(rect or page.rect, stream=stream, overlay=True)
+        doc.save(output_path, deflate=True)
         doc.close()
-        return output_path
\ No newline at end of file
+        return output_path
+
+    def batch_add_watermark(self, input_dir, output_dir, watermark_type, watermark_data, position=None,
+                            opacity=0.5, max_workers=None, chunksize=8, progress=None, return_details=False,
+                            recursive=False, include=None, exclude=None):
+        # The watermark is prepared once; the partial carries it to each worker
+        # chunk rather than with every task.
+        if watermark_type == "text":
+            func = partial(self.add_watermark_text, text=watermark_data, position=position or (100, 100),
+                           opacity=opacity)
+        elif watermark_type == "image":
+            func = partial(self._stamp_watermark_image, stream=self._watermark_image_stream(watermark_data, opacity),
+                           position=position)
+        else:
+            raise ValueError(f"Unsupported watermark type: {watermark_type}")
+        tasks = iter_tasks(input_dir, output_dir, extensions='.pdf', recursive=recursive, include=include,
+                           exclude=exclude)
+        os.makedirs(output_dir, exist_ok=True)
+        items = iter_batch(func, tasks, max_workers=max_workers, chunksize=chunksize, progress=progress)
+        return batch_outputs(list(items), return_details)
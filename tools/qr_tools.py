@@ -1,24 +1,491 @@
 import qrcode
 import barcode
-from barcode.writer import ImageWriter
-from pyzbar import pyzbar
-from PIL import Image
+from barcode.writer import ImageWriter, SVGWriter
+from PIL import Image, ImageColor, ImageFilter
 import csv
+import io
+import json
+import math
 import os
+import struct
+import time
+import zipfile
+import zlib
+from functools import lru_cache
+from tools.batch_utils import batch_outputs, iter_batch, iter_files
+
+QR_RENDERERS = ("numpy", "pil")
+BARCODE_TYPES = tuple(barcode.PROVIDED_BARCODES)
+PACK_FORMATS = ("zip", "pdf")
+DECODE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif', '.tif', '.tiff', '.pdf')
+# Adaptive decoding escalates through these (cheapest first) and stops at the
+# first stage that finds anything.
+DECODE_STAGES = ("fast", "full", "binarize", "adaptive", "sharpen", "rotate")
+FAST_DECODE_SIDE = 1024
+ROTATION_ANGLES = (22.5, 45, 67.5)
+ERROR_CORRECTION_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+
+
+# Encoding (version fitting, Reed-Solomon, scoring all eight masks) dominates
+# QR generation, and label runs repeat payloads a lot, so matrices are cached
+# per process as compact read-only bool arrays.
+@lru_cache(maxsize=4096)
+def _qr_modules(data, version=1, error_correction="M", mask_pattern=None):
+    import numpy as np
+    qr = qrcode.QRCode(version=version, error_correction=ERROR_CORRECTION_LEVELS[error_correction],
+                       mask_pattern=mask_pattern)
+    qr.add_data(data)
+    qr.make(fit=True)
+    modules = np.array(qr.modules, dtype=bool)
+    modules.setflags(write=False)
+    return modules
+
+
+def _hashable_color(color):
+    return color if color is None or isinstance(color, str) else tuple(color)
+
+
+@lru_cache(maxsize=1024)
+def _qr_png_bytes(data, version=1, error_correction="M", mask_pattern=None, box_size=10, border=5,
+                  fill_color="black", back_color="white"):
+    modules = _qr_modules(data, version, error_correction, mask_pattern)
+    return _render_qr_png(modules, box_size, border, fill_color, back_color)
+
+
+def _qr_color(color):
+    if color is None or color == "transparent":
+        return (0, 0, 0, 0)
+    if isinstance(color, str):
+        color = ImageColor.getrgb(color)
+    return tuple(color) + (255,) * (4 - len(color))
+
+
+def _module_array(modules, border):
+    import numpy as np
+    return np.pad(np.asarray(modules, dtype=bool), border)
+
+
+def _packed_rows(modules, box_size, border, invert=False):
+    import numpy as np
+    # Each module row is widened and bit-packed once; the box_size identical
+    # pixel rows it stands for are only repeated afterwards.
+    dark = _module_array(modules, border)
+    packed = np.packbits(~dark.repeat(box_size, axis=1) if invert else dark.repeat(box_size, axis=1), axis=1)
+    return packed, dark.shape[1] * box_size
+
+
+def _png_chunk(chunk_type, data):
+    return (struct.pack('>I', len(data)) + chunk_type + data
+            + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+
+def _render_qr_png(modules, box_size=10, border=5, fill_color="black", back_color="white"):
+    import numpy as np
+    fill, back = _qr_color(fill_color), _qr_color(back_color)
+    grayscale = fill == (0, 0, 0, 255) and back == (255, 255, 255, 255)
+    packed, width = _packed_rows(modules, box_size, border, invert=grayscale)
+
+    # The first pixel row of every module row is stored as is (filter 0) and the
+    # repeats as "Up" (filter 2) against it, i.e. all zero bytes.
+    rows = np.zeros((packed.shape[0], box_size, packed.shape[1] + 1), dtype=np.uint8)
+    rows[:, 0, 1:] = packed
+    rows[:, 1:, 0] = 2
+
+    chunks = [_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, width, 1, 0 if grayscale else 3, 0, 0, 0))]
+    if not grayscale:
+        chunks.append(_png_chunk(b'PLTE', bytes(back[:3] + fill[:3])))
+        if back[3] < 255 or fill[3] < 255:
+            chunks.append(_png_chunk(b'tRNS', bytes((back[3], fill[3]))))
+    chunks.append(_png_chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+    chunks.append(_png_chunk(b'IEND', b''))
+    return b'\x89PNG\r\n\x1a\n' + b''.join(chunks)
+
+
+def _render_qr_image(modules, box_size=10, border=5, fill_color="black", back_color="white"):
+    fill, back = _qr_color(fill_color), _qr_color(back_color)
+    if fill == (0, 0, 0, 255) and back == (255, 255, 255, 255):
+        # Mode "1" stores 1 as white, which is exactly the packed inverse.
+        packed, width = _packed_rows(modules, box_size, border, invert=True)
+        return Image.frombytes('1', (width, width), packed.repeat(box_size, axis=0).tobytes())
+
+    # Any other pair becomes a two-entry palette, which PNG still stores at 1 bit per pixel.
+    packed, width = _packed_rows(modules, box_size, border)
+    img = Image.frombytes('P', (width, width), packed.repeat(box_size, axis=0).tobytes(), 'raw', 'P;1')
+    img.putpalette(back[:3] + fill[:3])
+    if back[3] < 255:
+        img.info['transparency'] = 0
+    return img
+
+
+def _svg_color(color):
+    if isinstance(color, str):
+        return color
+    return "#%02x%02x%02x" % tuple(color[:3])
+
+
+def _render_qr_svg(modules, box_size=10, border=5, fill_color="black", back_color="white"):
+    import numpy as np
+    dark = _module_array(modules, border)
+    height, width = dark.shape
+    # One path for all dark modules, merged into horizontal runs per row.
+    path = []
+    for y, row in enumerate(dark):
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], row.view(np.int8), [0]))))
+        for start, stop in zip(edges[::2], edges[1::2]):
+            path.append(f"M{start},{y}h{stop - start}v1h-{stop - start}z")
+
+    background = ""
+    if back_color not in (None, "transparent"):
+        background = f'<rect width="{width}" height="{height}" fill="{_svg_color(back_color)}"/>'
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width * box_size}" height="{height * box_size}" '
+            f'viewBox="0 0 {width} {height}" shape-rendering="crispEdges">'
+            f'{background}<path fill="{_svg_color(fill_color)}" d="{"".join(path)}"/></svg>\n')
+
+
+def _save_qr_image(img, output_path):
+    if img.mode == 'P' and Image.registered_extensions().get(os.path.splitext(output_path)[1].lower()) == 'JPEG':
+        img = img.convert('RGB')
+    img.save(output_path)
+
+
+def _qr_task(data, output_path, box_size=10, border=5, fill_color="black", back_color="white", write=True, row=None):
+    try:
+        return _write_qr(data, output_path, box_size, border, fill_color, back_color, write)
+    except Exception as e:
+        if row is None:
+            raise
+        # The item's input is only the data, so the error names the CSV line.
+        raise ValueError(f"CSV line {row}: {type(e).__name__}: {e}") from e
+
+
+def _write_qr(data, output_path, box_size=10, border=5, fill_color="black", back_color="white", write=True):
+    if data is None or not output_path:
+        raise ValueError("row needs both 'data' and 'filename' columns")
+    if output_path.endswith('.svg'):
+        payload = _render_qr_svg(_qr_modules(data), box_size, border, fill_color, back_color).encode('utf-8')
+    else:
+        payload = _qr_png_bytes(data, 1, "M", None, box_size, border, _hashable_color(fill_color),
+                                _hashable_color(back_color))
+    if not write:
+        return payload
+    with open(output_path, 'wb') as f:
+        f.write(payload)
+    return output_path
+
+
+def _csv_qr_tasks(csv_file, output_dir, extension, args):
+    # Rows are read lazily, so the pool only ever sees a bounded window of them.
+    with open(csv_file, mode='r', encoding='utf-8', newline='') as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            filename = row.get('filename')
+            output_path = os.path.join(output_dir, f"{filename}{extension}") if filename else None
+            # line_num is the file line the row ended on (quoted fields may span lines).
+            yield row.get('data'), output_path, args + (reader.line_num,)
+
+
+def _barcode_class(barcode_type):
+    barcode_type = barcode_type.lower()
+    if barcode_type not in BARCODE_TYPES:
+        raise ValueError(f"Unsupported barcode type: {barcode_type}")
+    return barcode.get_barcode_class(barcode_type)
+
+
+def _barcode_format(output_path):
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension == '.svg':
+        return 'SVG'
+    return Image.registered_extensions().get(extension, 'PNG')
+
+
+# Writers keep whatever options they were last rendered with, so one instance
+# is cached per format/option set and reused across codes in a process.
+@lru_cache(maxsize=32)
+def _barcode_writer(image_format, options):
+    writer = SVGWriter() if image_format == 'SVG' else ImageWriter(format=image_format)
+    writer.set_options(dict(options))
+    return writer
+
+
+def _render_barcode(data, barcode_type="code128", image_format="PNG", options=None):
+    options = dict(options or {})
+    writer = _barcode_writer(image_format, tuple(sorted(options.items())))
+    buffer = io.BytesIO()
+    _barcode_class(barcode_type)(data, writer=writer).write(buffer, options)
+    return buffer.getvalue()
+
+
+def _barcode_task(data, output_path, barcode_type="code128", options=None, write=True):
+    payload = _render_barcode(data, barcode_type, _barcode_format(output_path), options)
+    if not write:
+        return payload
+    with open(output_path, 'wb') as f:
+        f.write(payload)
+    return output_path
+
+
+def _pack_items(items, archive_path, pack, sheet=None):
+    count = 0
+    errors = []
+    if pack == "zip":
+        # PNGs are already deflated; only text formats (SVG) are worth compressing.
+        with zipfile.ZipFile(archive_path, 'w') as archive:
+            for item in items:
+                if item["error"] is not None:
+                    errors.append(item)
+                    continue
+                compression = zipfile.ZIP_DEFLATED if item["output"].endswith('.svg') else zipfile.ZIP_STORED
+                archive.writestr(item["output"], item["result"], compress_type=compression)
+                count += 1
+    else:
+        from tools.pdf_tools import PDFImageSheet
+        with PDFImageSheet(archive_path, **(sheet or {})) as writer:
+            for item in items:
+                if item["error"] is not None:
+                    errors.append(item)
+                    continue
+                writer.add_image(item["result"])
+                count += 1
+    return count, errors
+
+
+def _decode_symbols(img, symbols=None):
+    # zbar is only needed for decoding, so generation works without libzbar.
+    from pyzbar import pyzbar
+    if symbols:
+        return pyzbar.decode(img, symbols=[pyzbar.ZBarSymbol[symbol.upper()] for symbol in symbols])
+    return pyzbar.decode(img)
+
+
+def _decoded_records(decoded, scale=(1.0, 1.0), offset=(0, 0)):
+    # Maps zbar's coordinates on a (cropped, scaled) region back onto the source image.
+    sx, sy = scale
+    records = []
+    for obj in decoded:
+        left, top, width, height = obj.rect
+        records.append({
+            "type": obj.type,
+            "data": obj.data.decode("utf-8", errors="replace"),
+            "rect": [round(offset[0] + left / sx, 2), round(offset[1] + top / sy, 2),
+                     round(width / sx, 2), round(height / sy, 2)],
+            "polygon": [[round(offset[0] + x / sx, 2), round(offset[1] + y / sy, 2)] for x, y in obj.polygon],
+        })
+    return records
+
+
+def _scale_records(records, fx, fy):
+    for record in records:
+        left, top, width, height = record["rect"]
+        record["rect"] = [round(left * fx, 2), round(top * fy, 2), round(width * fx, 2), round(height * fy, 2)]
+        record["polygon"] = [[round(x * fx, 2), round(y * fy, 2)] for x, y in record["polygon"]]
+    return records
+
+
+def _otsu_threshold(img):
+    import numpy as np
+    histogram = np.bincount(np.asarray(img).ravel(), minlength=256).astype(np.float64)
+    weights = np.cumsum(histogram)
+    means = np.cumsum(histogram * np.arange(256))
+    total, total_mean = weights[-1], means[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (total_mean * weights - means * total) ** 2 / (weights * (total - weights))
+    threshold = int(np.argmax(np.nan_to_num(between)))
+    return img.point(lambda p: 255 if p > threshold else 0)
+
+
+def _local_threshold(img, radius=15, offset=7):
+    import numpy as np
+    # Compares each pixel with its neighbourhood mean, which survives the
+    # uneven lighting and shadows a single global threshold cannot.
+    pixels = np.asarray(img, dtype=np.int16)
+    local = np.asarray(img.filter(ImageFilter.BoxBlur(radius)), dtype=np.int16)
+    return Image.fromarray(np.where(pixels > local - offset, 255, 0).astype(np.uint8))
+
+
+def _sharpen(img):
+    return img.filter(ImageFilter.UnsharpMask(radius=2, percent=200, threshold=2))
+
+
+def _stage_variants(stage):
+    # (max side cap, pixel filter, rotation angle) tried in turn for a stage.
+    if stage == "fast":
+        return [(FAST_DECODE_SIDE, None, 0)]
+    if stage == "full":
+        return [(None, None, 0)]
+    if stage == "binarize":
+        return [(None, _otsu_threshold, 0)]
+    if stage == "adaptive":
+        return [(None, _local_threshold, 0)]
+    if stage == "sharpen":
+        return [(None, _sharpen, 0)]
+    if stage == "rotate":
+        return [(None, None, angle) for angle in ROTATION_ANGLES]
+    raise ValueError(f"Unsupported decode stage: {stage}")
+
+
+def _unrotate_records(records, angle, rotated_size, size, scale, offset):
+    # Image.rotate(expand=True) turns counter-clockwise about the centre; map
+    # the found points back onto the source and rebuild the rect around them.
+    theta = math.radians(angle)
+    cos, sin = math.cos(theta), math.sin(theta)
+    sx, sy = scale
+    for record in records:
+        polygon = []
+        for x, y in record["polygon"]:
+            dx, dy = x - rotated_size[0] / 2, y - rotated_size[1] / 2
+            polygon.append([round(offset[0] + (size[0] / 2 + cos * dx - sin * dy) / sx, 2),
+                            round(offset[1] + (size[1] / 2 + sin * dx + cos * dy) / sy, 2)])
+        xs, ys = [x for x, _ in polygon], [y for _, y in polygon]
+        record["polygon"] = polygon
+        record["rect"] = [min(xs), min(ys), round(max(xs) - min(xs), 2), round(max(ys) - min(ys), 2)]
+    return records
+
+
+def _decode_regions(img, max_side=None, rois=None, symbols=None, prepare=None, angle=0):
+    # zbar only looks at luminance, so the grayscale copy is all it gets; rois
+    # are (left, top, right, bottom) boxes as fractions of the image size.
+    if img.mode != 'L':
+        img = img.convert('L')
+    width, height = img.size
+    boxes = [(0, 0, width, height)]
+    if rois:
+        boxes = [(int(left * width), int(top * height), int(right * width), int(bottom * height))
+                 for left, top, right, bottom in rois]
+
+    records = []
+    seen = set()
+    for box in boxes:
+        region = img if box == (0, 0, width, height) else img.crop(box)
+        scale = (1.0, 1.0)
+        if max_side and max(region.size) > max_side:
+            ratio = max_side / max(region.size)
+            size = (max(1, round(region.width * ratio)), max(1, round(region.height * ratio)))
+            scale = (size[0] / region.width, size[1] / region.height)
+            region = region.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        if prepare is not None:
+            region = prepare(region)
+        if angle:
+            rotated = region.rotate(angle, Image.Resampling.BILINEAR, expand=True, fillcolor=255)
+            found = _unrotate_records(_decoded_records(_decode_symbols(rotated, symbols)), angle, rotated.size,
+                                      region.size, scale, box[:2])
+        else:
+            found = _decoded_records(_decode_symbols(region, symbols), scale, box[:2])
+        for record in found:
+            key = (record["type"], record["data"], tuple(round(value) for value in record["rect"][:2]))
+            if key not in seen:
+                seen.add(key)
+                records.append(record)
+    return records
+
+
+def _decode_adaptive(img, max_side=None, rois=None, symbols=None, stages=DECODE_STAGES):
+    if img.mode != 'L':
+        img = img.convert('L')
+    trace = []
+    for stage in stages:
+        variants = _stage_variants(stage)
+        if stage == "full" and "fast" in stages and min(max(img.size), max_side or max(img.size)) <= FAST_DECODE_SIDE:
+            # The fast pass already saw this image at the resolution "full" would use.
+            continue
+        start = time.perf_counter()
+        records = []
+        for cap, prepare, angle in variants:
+            side = min(cap, max_side) if cap and max_side else cap or max_side
+            records = _decode_regions(img, side, rois, symbols, prepare, angle)
+            if records:
+                break
+        trace.append((stage, time.perf_counter() - start, len(records)))
+        if records:
+            return records, trace
+    return [], trace
+
+
+def _decode_page(img, max_side=None, rois=None, symbols=None, adaptive=False, stages=DECODE_STAGES):
+    if adaptive:
+        return _decode_adaptive(img, max_side, rois, symbols, stages)
+    start = time.perf_counter()
+    records = _decode_regions(img, max_side, rois, symbols)
+    return records, [("single", time.perf_counter() - start, len(records))]
+
+
+def _decode_file(path, _output_path=None, max_side=None, rois=None, symbols=None, dpi=200, adaptive=False,
+                 stages=DECODE_STAGES):
+    # Returns the records plus a (stage, seconds, found) trace for statistics.
+    if path.lower().endswith('.pdf'):
+        import fitz
+        records = []
+        trace = []
+        with fitz.open(path) as doc:
+            for page in doc:
+                pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+                img = Image.frombytes('L', (pix.width, pix.height), pix.samples, 'raw', 'L', pix.stride)
+                found, page_trace = _decode_page(img, max_side, rois, symbols, adaptive, stages)
+                trace.extend(page_trace)
+                # Page results are reported in PDF points (PyMuPDF's top-left page space).
+                for record in _scale_records(found, 72 / dpi, 72 / dpi):
+                    records.append({"file": path, "page": page.number + 1, **record})
+        return records, trace
+
+    with Image.open(path) as img:
+        size = img.size
+        if max_side and not rois and not adaptive and img.format == 'JPEG':
+            img.draft('L', (max_side, max_side))
+        records, trace = _decode_page(img, max_side, rois, symbols, adaptive, stages)
+        if img.size != size:
+            _scale_records(records, size[0] / img.width, size[1] / img.height)
+    return [{"file": path, **record} for record in records], trace
+
 
 class QRTools:
     def __init__(self):
-        pass
-
-    def generate_qr(self, data, output_path, version=1, box_size=10, border=5, fill_color="black", back_color="white"):
-        qr = qrcode.QRCode(version=version, box_size=box_size, border=border)
-        qr.add_data(data)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color=fill_color, back_color=back_color)
-        img.save(output_path)
+        self._decode_stats = {}
+
+    def generate_qr(self, data, output_path, version=1, box_size=10, border=5, fill_color="black", back_color="white",
+                    renderer="numpy", error_correction="M", mask_pattern=None):
+        if renderer not in QR_RENDERERS:
+            raise ValueError(f"Unsupported QR renderer: {renderer}")
+        if error_correction not in ERROR_CORRECTION_LEVELS:
+            raise ValueError(f"Unsupported error correction level: {error_correction}")
+        if renderer == "pil":
+            qr = qrcode.QRCode(version=version, error_correction=ERROR_CORRECTION_LEVELS[error_correction],
+                               box_size=box_size, border=border, mask_pattern=mask_pattern)
+            qr.add_data(data)
+            qr.make(fit=True)
+            
+            img = qr.make_image(fill_color=fill_color, back_color=back_color)
+            img.save(output_path)
+            return output_path
+
+        extension = os.path.splitext(output_path)[1].lower()
+        if extension == '.png':
+            # Repeated payload + style: the finished PNG bytes come straight from the cache.
+            png = _qr_png_bytes(data, version, error_correction, mask_pattern, box_size, border,
+                                _hashable_color(fill_color), _hashable_color(back_color))
+            with open(output_path, 'wb') as f:
+                f.write(png)
+            return output_path
+
+        modules = _qr_modules(data, version, error_correction, mask_pattern)
+        if extension == '.svg':
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(_render_qr_svg(modules, box_size, border, fill_color, back_color))
+        else:
+            _save_qr_image(_render_qr_image(modules, box_size, border, fill_color, back_color), output_path)
         return output_path
 
+    def cache_info(self):
+        return {"matrices": _qr_modules.cache_info()._asdict(), "png": _qr_png_bytes.cache_info()._asdict()}
+
+    def clear_cache(self):
+        _qr_modules.cache_clear()
+        _qr_png_bytes.cache_clear()
+
     def generate_wifi_qr(self, ssid, password, security_type="WPA", output_path="wifi_qr.png"):
         wifi_string = f"WIFI:T:{security_type};S:{ssid};P:{password};;"
         return self.generate_qr(wifi_string, output_path)
@@ -27,45 +494,122 @@ class QRTools:
         phone_string = f"tel:{phone_number}"
         return self.generate_qr(phone_string, output_path)
 
-    def read_qr(self, image_path):
-        image = Image.open(image_path)
-        decoded_objects = pyzbar.decode(image)
-        results = []
-        for obj in decoded_objects:
-            results.append({
-                "type": obj.type,
-                "data": obj.data.decode("utf-8")
-            })
-        return results
-
-    def batch_generate_qr(self, csv_file, output_dir):
-        results = []
-        with open(csv_file, mode='r', encoding='utf-8') as file:
-            csv_reader = csv.DictReader(file)
-            for row in csv_reader:
-                if 'data' in row and 'filename' in row:
-                    output_path = os.path.join(output_dir, f"{row['filename']}.png")
-                    self.generate_qr(row['data'], output_path)
-                    results.append(output_path)
-        return results
-
-    def generate_barcode(self, data, barcode_type="code128", output_path="barcode.png"):
-        if barcode_type.lower() == "ean13":
-            barcode_class = barcode.EAN13
-        elif barcode_type.lower() == "code128":
-            barcode_class = barcode.Code128
-        else:
-            barcode_class = barcode.Code128
-        
-        code = barcode_class(data, writer=ImageWriter())
-        code.save(output_path.replace('.png', ''))
-        return output_path
+    def read_qr(self, image_path, max_side=None, rois=None, symbols=None, dpi=200, adaptive=False,
+                stages=DECODE_STAGES):
+        records, trace = _decode_file(image_path, None, max_side, rois, symbols, dpi, adaptive, stages)
+        self._record_decode_trace(trace)
+        return records
+
+    def _record_decode_trace(self, trace):
+        for stage, seconds, found in trace:
+            stats = self._decode_stats.setdefault(stage, {"attempts": 0, "successes": 0, "seconds": 0.0})
+            stats["attempts"] += 1
+            stats["successes"] += 1 if found else 0
+            stats["seconds"] += seconds
+
+    def decode_stats(self):
+        # Per stage: how often it ran, how often it was the one that found a
+        # code, and its time cost - the numbers for tuning the stage list.
+        stats = {}
+        for stage, values in self._decode_stats.items():
+            attempts = values["attempts"]
+            stats[stage] = dict(values, success_rate=values["successes"] / attempts if attempts else 0.0,
+                                avg_ms=1000 * values["seconds"] / attempts if attempts else 0.0)
+        return stats
+
+    def reset_decode_stats(self):
+        self._decode_stats = {}
+
+    def scan_codes(self, root, recursive=True, max_workers=None, chunksize=4, max_side=None, rois=None,
+                   symbols=None, dpi=200, include=None, exclude=None, adaptive=False, stages=DECODE_STAGES):
+        # One record per decoded symbol, streamed in file order; unreadable
+        # files produce an error record instead of stopping the scan.
+        tasks = ((entry.path, None, (max_side, rois, symbols, dpi, adaptive, stages))
+                 for entry in iter_files(root, DECODE_EXTENSIONS, recursive, include, exclude))
+        for item in iter_batch(_decode_file, tasks, max_workers=max_workers, chunksize=chunksize):
+            if item["error"] is not None:
+                yield {"file": item["input"], "error": item["error"]}
+                continue
+            records, trace = item["result"]
+            self._record_decode_trace(trace)
+            yield from records
+
+    def scan_codes_ndjson(self, root, output_path, recursive=True, max_workers=None, max_side=None, rois=None,
+                          symbols=None, dpi=200, adaptive=False, stages=DECODE_STAGES):
+        count = 0
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for record in self.scan_codes(root, recursive, max_workers, max_side=max_side, rois=rois,
+                                          symbols=symbols, dpi=dpi, adaptive=adaptive, stages=stages):
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+        return count
+
+    def iter_generate_qr(self, csv_file, output_dir, image_format="png", max_workers=None, chunksize=256,
+                         progress=None, box_size=10, border=5, fill_color="black", back_color="white", write=True):
+        # With write=False nothing touches output_dir: items carry the encoded
+        # bytes in "result" and the archive member name in "output".
+        if write:
+            os.makedirs(output_dir, exist_ok=True)
+        extension = '.svg' if image_format.lower() == 'svg' else '.png'
+        tasks = _csv_qr_tasks(csv_file, output_dir if write else '', extension,
+                              (box_size, border, fill_color, back_color, write))
+        return iter_batch(_qr_task, tasks, max_workers=max_workers, chunksize=chunksize, progress=progress)
+
+    def batch_generate_qr(self, csv_file, output_dir, max_workers=None, chunksize=256, progress=None,
+                          return_details=False, pack=None, image_format="png", box_size=10, border=5,
+                          fill_color="black", back_color="white", archive_name=None, sheet=None):
+        if pack is None:
+            items = self.iter_generate_qr(csv_file, output_dir, image_format, max_workers, chunksize, progress,
+                                          box_size, border, fill_color, back_color)
+            return batch_outputs(list(items), return_details)
+        if pack not in PACK_FORMATS:
+            raise ValueError(f"Unsupported pack format: {pack}")
+
+        os.makedirs(output_dir, exist_ok=True)
+        archive_path = os.path.join(output_dir, archive_name or f"qr_codes.{pack}")
+        if pack == "pdf":
+            image_format = "png"
+        items = self.iter_generate_qr(csv_file, output_dir, image_format, max_workers, chunksize, progress,
+                                      box_size, border, fill_color, back_color, write=False)
+        count, errors = _pack_items(items, archive_path, pack, sheet)
+        if return_details:
+            return {"output": archive_path, "count": count, "errors": errors}
+        return archive_path
+
+    def generate_barcode(self, data, barcode_type="code128", output_path="barcode.png", options=None):
+        # The output format follows the extension (.svg gives a vector barcode).
+        return _barcode_task(data, output_path, barcode_type, options)
+
+    def iter_generate_barcodes(self, data_list, barcode_type="code128", output_dir="barcodes", image_format="png",
+                               max_workers=None, chunksize=64, progress=None, options=None, write=True):
+        _barcode_class(barcode_type)
+        if write:
+            os.makedirs(output_dir, exist_ok=True)
+        tasks = ((data, os.path.join(output_dir if write else '', f"barcode_{i+1}.{image_format.lower()}"),
+                  (barcode_type, options, write)) for i, data in enumerate(data_list))
+        return iter_batch(_barcode_task, tasks, max_workers=max_workers, chunksize=chunksize, progress=progress)
+
+    def generate_bulk_barcodes(self, data_list, barcode_type="code128", output_dir="barcodes", max_workers=None,
+                               chunksize=64, progress=None, return_details=False, image_format="png", options=None,
+                               pack=None, archive_name=None, sheet=None):
+        if pack is None:
+            items = self.iter_generate_barcodes(data_list, barcode_type, output_dir, image_format, max_workers,
+                                                chunksize, progress, options)
+            return batch_outputs(list(items), return_details)
+        if pack not in PACK_FORMATS:
+            raise ValueError(f"Unsupported pack format: {pack}")
 
-    def generate_bulk_barcodes(self, data_list, barcode_type="code128", output_dir="barcodes"):
         os.makedirs(output_dir, exist_ok=True)
-        results = []
-        for i, data in enumerate(data_list):
-            output_path = os.path.join(output_dir, f"barcode_{i+1}.png")
-            self.generate_barcode(data, barcode_type, output_path)
-            results.append(output_path)
-        return results
\ No newline at end of file
+        archive_path = os.path.join(output_dir, archive_name or f"barcodes.{pack}")
+        if pack == "pdf":
+            image_format = "png"
+            options = dict(options or {})
+            if "foreground" not in options and "background" not in options:
+                # Black-on-white labels: grayscale rasters are a third of the RGB size in the sheet.
+                options.setdefault("mode", "L")
+        items = self.iter_generate_barcodes(data_list, barcode_type, output_dir, image_format, max_workers, chunksize,
+                                            progress, options, write=False)
+        count, errors = _pack_items(items, archive_path, pack, sheet)
+        if return_details:
+            return {"output": archive_path, "count": count, "errors": errors}
+        return archive_path
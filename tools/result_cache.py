@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from importlib import metadata
+from tools.batch_utils import file_digests
+
+CACHED_LIBRARIES = ("Pillow", "PyMuPDF", "pikepdf")
+
+
+@lru_cache(maxsize=None)
+def library_versions():
+    versions = {}
+    for name in CACHED_LIBRARIES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def release_output(path):
+    # Writers call this before producing path: with link=True an earlier hit
+    # may have left it as a read-only hardlink to a cache object, and opening
+    # it for writing would fail or, as root, edit the cached result.
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def _place(source, destination, link):
+    # Linked or copied under a temporary name, then renamed over destination,
+    # so an existing output is replaced rather than written through.
+    fd, temporary = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(os.path.abspath(destination)))
+    os.close(fd)
+    try:
+        if link:
+            os.remove(temporary)
+            try:
+                os.link(source, temporary)
+            except OSError:
+                shutil.copyfile(source, temporary)
+        else:
+            shutil.copyfile(source, temporary)
+        os.replace(temporary, destination)
+    except BaseException:
+        if os.path.lexists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def _intact(entry_dir, names, size):
+    # Cheap check, no hashing: every object is there, still read-only and
+    # the recorded total size matches.
+    total = 0
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(entry_dir, name))
+        except OSError:
+            return False
+        if stat.st_mode & 0o222:
+            return False
+        total += stat.st_size
+    return total == size
+
+
+def _remove_entry(entry_dir):
+    if os.name == "nt":
+        # Windows refuses to delete read-only files.
+        for root, _, files in os.walk(entry_dir):
+            for name in files:
+                os.chmod(os.path.join(root, name), 0o644)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+class ResultCache:
+    # Hits are copied out by default; link=True hardlinks the read-only cache
+    # object instead, which is cheaper but leaves outputs read-only.
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3, link=False):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        self.link = link
+        os.makedirs(os.path.join(self.cache_dir, "objects"), exist_ok=True)
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, files TEXT NOT NULL, size INTEGER,
+                                                    metadata TEXT, last_access REAL);
+                CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access);
+                CREATE TABLE IF NOT EXISTS inputs (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha256 TEXT);
+                CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER);
+            """)
+
+    # The cache holds no open handles so tool instances that own one can still
+    # be pickled into process pools; every call opens a short-lived connection.
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(os.path.join(self.cache_dir, "index.db"), timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, "objects", key[:2], key)
+
+    def _count(self, db, name, amount=1):
+        db.execute("INSERT INTO counters (name, value) VALUES (?, ?) "
+                   "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, amount))
+
+    def content_hash(self, path):
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        with self._connect() as db:
+            row = db.execute("SELECT size, mtime, sha256 FROM inputs WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+
+        digest = file_digests(path)["sha256"]
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO inputs (path, size, mtime, sha256) VALUES (?, ?, ?, ?)",
+                       (path, stat.st_size, stat.st_mtime, digest))
+        return digest
+
+    def make_key(self, operation, input_path, params=None):
+        payload = json.dumps({
+            "operation": operation,
+            "input": self.content_hash(input_path),
+            "params": params or {},
+            "versions": library_versions(),
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _lookup(self, key):
+        with self._connect() as db:
+            row = db.execute("SELECT files, metadata, size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and not _intact(self._entry_dir(key), json.loads(row[0]), row[2]):
+                # Missing, or made writable/changed through a hardlinked
+                # output: drop the entry rather than hand it out again.
+                _remove_entry(self._entry_dir(key))
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self._count(db, "misses")
+                return None
+            db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._count(db, "hits")
+        return json.loads(row[0]), json.loads(row[1]) if row[1] else {}
+
+    def get_files(self, key, output_dir):
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        os.makedirs(output_dir, exist_ok=True)
+        outputs = []
+        for name in entry[0]:
+            destination = os.path.join(output_dir, name)
+            _place(os.path.join(self._entry_dir(key), name), destination, self.link)
+            outputs.append(destination)
+        return outputs
+
+    def get_file(self, key, output_path):
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        _place(os.path.join(self._entry_dir(key), entry[0][0]), output_path, self.link)
+        return entry[1]
+
+    def put_file(self, key, path, metadata=None):
+        return self.put_files(key, [path], metadata)
+
+    def put_files(self, key, paths, metadata=None):
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+
+        # Entries are assembled in a scratch directory and renamed into place,
+        # so readers never observe a partially written result.
+        staging = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(entry_dir))
+        names = []
+        size = 0
+        for path in paths:
+            name = os.path.basename(path)
+            shutil.copyfile(path, os.path.join(staging, name))
+            # Objects are read-only: with link=True hits hardlink them into
+            # place, and a write through such an output must not reach the cache.
+            os.chmod(os.path.join(staging, name), 0o444)
+            names.append(name)
+            size += os.path.getsize(path)
+        try:
+            os.rename(staging, entry_dir)
+        except OSError:
+            _remove_entry(staging)
+            return
+
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO entries (key, files, size, metadata, last_access) VALUES (?, ?, ?, ?, ?)",
+                       (key, json.dumps(names), size, json.dumps(metadata) if metadata else None, time.time()))
+            self._count(db, "stores")
+        self.evict()
+
+    def evict(self, max_bytes=None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        evicted = 0
+        with self._connect() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= max_bytes:
+                return 0
+            for key, size in db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+                if total <= max_bytes:
+                    break
+                _remove_entry(self._entry_dir(key))
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+            self._count(db, "evictions", evicted)
+        return evicted
+
+    def clear(self):
+        return self.evict(0)
+
+    def stats(self):
+        with self._connect() as db:
+            counters = dict(db.execute("SELECT name, value FROM counters"))
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        stats = {name: counters.get(name, 0) for name in ("hits", "misses", "stores", "evictions")}
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = entries
+        stats["size"] = size
+        stats["max_bytes"] = self.max_bytes
+        return stats
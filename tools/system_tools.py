@@ -1,36 +1,152 @@
-import hashlib
+import json
 import os
+import re
+import sqlite3
 import zipfile
+from contextlib import contextmanager
+from itertools import islice
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import base64
 import secrets
+from tools.batch_utils import file_digests, iter_batch, iter_files, new_hashers
+
+# sha256sum/md5sum digest lengths; 128 hex digits is read as sha512.
+DIGEST_LENGTHS = {32: "md5", 40: "sha1", 56: "sha224", 64: "sha256", 96: "sha384", 128: "sha512"}
+_SUM_LINE = re.compile(r"^(\\?)([0-9a-fA-F]+) [ *](.+)$")
+_BSD_LINE = re.compile(r"^(\\?)([A-Za-z0-9_-]+) \((.+)\) = ([0-9a-fA-F]+)$")
+
+
+def _unescape_name(name):
+    # GNU coreutils marks lines whose name contains a backslash or newline
+    # with a leading backslash and escapes those characters.
+    return re.sub(r"\\(.)", lambda m: "\n" if m.group(1) == "n" else m.group(1), name)
+
+
+def _read_manifest(path, hash_type=None):
+    # Returns (hash_type, {relative path: lowercase digest}) from a JSON
+    # manifest ({"hash_type": ..., "files": {...}}) or sha256sum/md5sum/BSD lines.
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith(".json"):
+            data = json.load(f)
+            return hash_type or data["hash_type"], {name: digest.lower() for name, digest in data["files"].items()}
+        entries = {}
+        for number, line in enumerate(f, 1):
+            line = line.rstrip("\r\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            match = _SUM_LINE.match(line)
+            if match:
+                escaped, digest, name = match.groups()
+            else:
+                match = _BSD_LINE.match(line)
+                if not match:
+                    raise ValueError(f"Malformed manifest line {number}: {line}")
+                escaped, algorithm, name, digest = match.groups()
+                hash_type = hash_type or algorithm.lower().replace("-", "_")
+            if hash_type is None:
+                hash_type = DIGEST_LENGTHS.get(len(digest))
+                if hash_type is None:
+                    raise ValueError(f"Unsupported hash type: {len(digest)} hex digits")
+            entries[_unescape_name(name) if escaped else name] = digest.lower()
+    return hash_type or "sha256", entries
+
+
+def _manifest_line(name, digest):
+    if "\\" in name or "\n" in name:
+        return "\\" + digest + "  " + name.replace("\\", "\\\\").replace("\n", "\\n") + "\n"
+    return digest + "  " + name + "\n"
+
+
+def _verify_task(path, _output_path, expected, hash_type, buffer_size):
+    try:
+        digest = file_digests(path, (hash_type,), buffer_size)[hash_type]
+    except FileNotFoundError:
+        return "missing"
+    return "ok" if digest == expected else "mismatched"
+
+
+def _hash_task(path, _output_path, hash_types, buffer_size, stat, cached):
+    if cached is None:
+        cached = file_digests(path, hash_types, buffer_size)
+        hit = False
+    else:
+        hit = True
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino, "digests": cached,
+            "cached": hit}
+
+
+class HashCache:
+    # Digests keyed by absolute path and the (size, mtime_ns, inode) stamp they
+    # were computed from; an unchanged file costs one stat on the next run.
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT, hash_type TEXT, size INTEGER, "
+                       "mtime_ns INTEGER, inode INTEGER, digest TEXT, PRIMARY KEY (path, hash_type))")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def lookup(self, files, hash_types):
+        # files: (absolute path, stat) pairs, looked up over one connection.
+        found = {}
+        with self._connect() as db:
+            for path, stat in files:
+                digests = dict(db.execute("SELECT hash_type, digest FROM hashes WHERE path = ? AND size = ? "
+                                          "AND mtime_ns = ? AND inode = ?",
+                                          (path, stat.st_size, stat.st_mtime_ns, stat.st_ino)))
+                if all(hash_type in digests for hash_type in hash_types):
+                    found[path] = {hash_type: digests[hash_type] for hash_type in hash_types}
+        return found
+
+    def store(self, rows):
+        # rows: (path, hash_type, size, mtime_ns, inode, digest)
+        if rows:
+            with self._connect() as db:
+                db.executemany("INSERT OR REPLACE INTO hashes (path, hash_type, size, mtime_ns, inode, digest) "
+                               "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def prune(self, keep, root=None):
+        # Drops entries for paths outside keep, e.g. files deleted since the last
+        # run; with root, only entries under that directory are considered, so
+        # one cache can serve several trees.
+        keep = set(keep)
+        prefix = os.path.join(os.path.abspath(root), "") if root else ""
+        with self._connect() as db:
+            stale = [(path,) for (path,) in db.execute("SELECT DISTINCT path FROM hashes")
+                     if path.startswith(prefix) and path not in keep]
+            db.executemany("DELETE FROM hashes WHERE path = ?", stale)
+        return len(stale)
+
 
 class SystemTools:
     def __init__(self):
         pass
 
+    def hash_file(self, file_path, hash_types="sha256", buffer_size=None):
+        # A single name returns its hex digest, a list/tuple a {name: digest} dict.
+        # buffer_size=None lets hashlib.file_digest pick the read size for a single
+        # algorithm; an explicit size is always used (see file_digests).
+        if isinstance(hash_types, str):
+            return file_digests(file_path, (hash_types,), buffer_size)[hash_types]
+        return file_digests(file_path, tuple(hash_types), buffer_size)
+
     def generate_md5(self, file_path):
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        return self.hash_file(file_path, "md5")
 
     def generate_sha256(self, file_path):
-        hash_sha256 = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_sha256.update(chunk)
-        return hash_sha256.hexdigest()
+        return self.hash_file(file_path, "sha256")
 
     def generate_sha512(self, file_path):
-        hash_sha512 = hashlib.sha512()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_sha512.update(chunk)
-        return hash_sha512.hexdigest()
+        return self.hash_file(file_path, "sha512")
 
     def generate_key_from_password(self, password, salt=None):
         if salt is None:
@@ -127,33 +243,138 @@ class SystemTools:
         
         return info
 
-    def batch_hash_files(self, directory, hash_type="sha256"):
-        results = {}
-        
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
-            if os.path.isfile(file_path):
-                if hash_type == "md5":
-                    results[filename] = self.generate_md5(file_path)
-                elif hash_type == "sha256":
-                    results[filename] = self.generate_sha256(file_path)
-                elif hash_type == "sha512":
-                    results[filename] = self.generate_sha512(file_path)
-        
-        return results
+    def iter_hash_files(self, directory, hash_types="sha256", recursive=True, include=None, exclude=None,
+                        max_workers=None, cache_path=None, buffer_size=None, lookup_batch=256):
+        # Streams {"path", "size", "digests", "cached", "error"} records in walk
+        # order. Hashing runs on threads (hashlib releases the GIL and most of
+        # the time is I/O anyway); with cache_path only files whose size, mtime
+        # or inode changed since the last run are read. Once an unfiltered
+        # recursive walk has been consumed to the end, cache entries for files
+        # under directory that no longer exist are pruned.
+        hash_types = (hash_types,) if isinstance(hash_types, str) else tuple(hash_types)
+        new_hashers(hash_types)
+        cache = HashCache(cache_path) if cache_path else None
+        seen = set() if cache and recursive and include is None and exclude is None else None
+
+        def tasks():
+            entries = iter_files(directory, recursive=recursive, include=include, exclude=exclude)
+            while True:
+                files = []
+                for entry in islice(entries, lookup_batch):
+                    try:
+                        files.append((os.path.abspath(entry.path), entry.stat()))
+                    except OSError:
+                        continue
+                if not files:
+                    return
+                cached = cache.lookup(files, hash_types) if cache else {}
+                for path, stat in files:
+                    yield path, None, (hash_types, buffer_size, stat, cached.get(path))
+
+        rows = []
+        workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        for item in iter_batch(_hash_task, tasks(), max_workers=workers, chunksize=1, use_processes=False):
+            record = {"path": os.path.relpath(item["input"], directory), "error": item["error"]}
+            if seen is not None:
+                seen.add(item["input"])
+            result = item["result"]
+            if result is not None:
+                record.update(size=result["size"], digests=result["digests"], cached=result["cached"])
+                if cache and not result["cached"]:
+                    rows.extend((item["input"], hash_type, result["size"], result["mtime_ns"], result["inode"],
+                                 digest) for hash_type, digest in result["digests"].items())
+                    if len(rows) >= 500:
+                        cache.store(rows)
+                        rows = []
+            yield record
+        if cache:
+            cache.store(rows)
+        if seen is not None:
+            cache.prune(seen, directory)
+
+    def hash_files_ndjson(self, directory, output_path, hash_types="sha256", recursive=True, include=None,
+                          exclude=None, max_workers=None, cache_path=None):
+        count = 0
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for record in self.iter_hash_files(directory, hash_types, recursive, include, exclude, max_workers,
+                                               cache_path):
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+        return count
+
+    def batch_hash_files(self, directory, hash_type="sha256", recursive=False, include=None, exclude=None,
+                         max_workers=None, cache_path=None):
+        # Keys are paths relative to directory (the bare filename unless recursive);
+        # unreadable files are left out.
+        return {record["path"]: record["digests"][hash_type]
+                for record in self.iter_hash_files(directory, hash_type, recursive, include, exclude, max_workers,
+                                                   cache_path)
+                if record["error"] is None}
+
+    def write_manifest(self, directory, output_path, hash_type="sha256", recursive=True, include=None,
+                       exclude=None, max_workers=None, cache_path=None):
+        # A ".json" output gets {"hash_type", "files"}; anything else is
+        # written in sha256sum/md5sum format, readable by those tools (-c).
+        output = os.path.abspath(output_path)
+        files = {}
+        errors = []
+        for record in self.iter_hash_files(directory, hash_type, recursive, include, exclude, max_workers,
+                                           cache_path):
+            if os.path.abspath(os.path.join(directory, record["path"])) == output:
+                continue
+            if record["error"] is not None:
+                errors.append({"path": record["path"], "error": record["error"]})
+                continue
+            files[record["path"].replace(os.sep, "/")] = record["digests"][hash_type]
+
+        with open(output_path, 'w', encoding='utf-8', newline='\n') as f:
+            if output_path.lower().endswith(".json"):
+                json.dump({"hash_type": hash_type, "files": files}, f, ensure_ascii=False, indent=1)
+            else:
+                f.writelines(_manifest_line(name, digest) for name, digest in files.items())
+        return {"manifest": output_path, "files": len(files), "errors": errors}
+
+    def verify_manifest(self, manifest_path, directory=None, hash_type=None, max_workers=4, stop_on_failure=False,
+                        check_extra=True, include=None, exclude=None, buffer_size=None):
+        # Paths are resolved against directory (default: the manifest's own
+        # folder). max_workers bounds how many files are read at once, which
+        # is what matters on spinning disks and network shares.
+        hash_type, entries = _read_manifest(manifest_path, hash_type)
+        new_hashers((hash_type,))
+        if directory is None:
+            directory = os.path.dirname(os.path.abspath(manifest_path))
+
+        report = {"hash_type": hash_type, "total": len(entries), "ok": 0, "mismatched": [], "missing": [],
+                  "extra": [], "errors": [], "stopped": False}
+        tasks = ((os.path.join(directory, name), name, (digest, hash_type, buffer_size))
+                 for name, digest in entries.items())
+        for item in iter_batch(_verify_task, tasks, max_workers=max_workers, chunksize=1, use_processes=False):
+            name = item["output"]
+            if item["error"] is not None:
+                report["errors"].append({"path": name, "error": item["error"]})
+            elif item["result"] == "ok":
+                report["ok"] += 1
+                continue
+            else:
+                report[item["result"]].append(name)
+            if stop_on_failure:
+                report["stopped"] = True
+                break
+
+        if check_extra and not report["stopped"]:
+            listed = {os.path.abspath(os.path.join(directory, name)) for name in entries}
+            listed.add(os.path.abspath(manifest_path))
+            for entry in iter_files(directory, recursive=True, include=include, exclude=exclude):
+                if os.path.abspath(entry.path) not in listed:
+                    report["extra"].append(os.path.relpath(entry.path, directory).replace(os.sep, "/"))
+
+        report["passed"] = not (report["mismatched"] or report["missing"] or report["errors"] or report["extra"]
+                                or report["stopped"])
+        return report
 
     def generate_secure_password(self, length=16):
         alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!@#$%^&*"
         return ''.join(secrets.choice(alphabet) for _ in range(length))
 
     def verify_hash(self, file_path, expected_hash, hash_type="sha256"):
-        if hash_type == "md5":
-            calculated_hash = self.generate_md5(file_path)
-        elif hash_type == "sha256":
-            calculated_hash = self.generate_sha256(file_path)
-        elif hash_type == "sha512":
-            calculated_hash = self.generate_sha512(file_path)
-        else:
-            raise ValueError("Unsupported hash type")
-        
-        return calculated_hash == expected_hash
\ No newline at end of file
+        return self.hash_file(file_path, hash_type) == expected_hash.strip().lower()
\ No newline at end of file